@@ -6,6 +6,10 @@ class PipelineException(Exception):
     pass
 
 
+class JournalException(Exception):
+    pass
+
+
 class PipelineStep(object):
     def run(self):
         pass
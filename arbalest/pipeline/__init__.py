@@ -38,12 +38,13 @@ def is_day_hour(date):
 
 class S3SortedDataSources(object):
     def __init__(self, metadata, source, bucket, start=None,
-                 end=None):
+                 end=None, list_processes=None):
         self.metadata = metadata
         self.source = source
         self.bucket = bucket
         self.start = start
         self.end = end
+        self.list_processes = list_processes
         self.file_name = '{0}_source_journal.json'.format(source)
 
     @property
@@ -95,6 +96,15 @@ class S3SortedDataSources(object):
         except StopIteration:
             return []
 
+    def __get_children_keys(self, paths):
+        if self.list_processes is None:
+            return [self.__get_directory_keys(path) for path in paths]
+        else:
+            children = self.bucket.list_prefixes(
+                paths, '/', processes=self.list_processes)
+            return [[k.name for k in keys if k.name.endswith('/')] for keys in
+                    children]
+
     def __get_paths(self):
         paths = []
         branches = self.__get_directory_keys(normalize_path(self.source) + '/')
@@ -108,9 +118,9 @@ class S3SortedDataSources(object):
             normalize_path('{0}/{1}'.format(self.source, end_date)) + '/') + 1
 
         if is_day_hour(self.start) or is_day_hour(self.end):
-            for branch in branches[start:end]:
-                children = self.__get_directory_keys(
-                    normalize_path(branch) + '/')
+            selected = branches[start:end]
+            for branch, children in zip(selected, self.__get_children_keys(
+                    [normalize_path(branch) + '/' for branch in selected])):
                 if children:
                     paths = paths + children
                 else:
@@ -1,10 +1,14 @@
 import sqlite3
-from arbalest.redshift.manifest import SqlManifest
+from arbalest.redshift.compaction import Compactor, CsvTranscoder, \
+    ParquetTranscoder, TRANSCODING_PART_SIZE
+from arbalest.redshift.manifest import Manifest, SqlManifest, \
+    RedshiftJournalManifest
+from arbalest.redshift.validation import LocalValidator
 from arbalest.redshift.step import BulkCopyFromS3JsonStep, SqlStep, \
     ManifestCopyFromS3JsonStep
 from psycopg2.extensions import AsIs
-from arbalest.core import Pipeline
-from arbalest.s3 import Bucket
+from arbalest.core import Pipeline, PipelineException
+from arbalest.s3 import Bucket, MAX_CONNECTIONS
 from arbalest.sql import Database
 
 
@@ -52,7 +56,7 @@ class TargetTable(object):
 
 class S3BulkCopyPipeline(Pipeline):
     def __init__(self, aws_access_key_id, aws_secret_access_key, bucket,
-                 db_connection):
+                 db_connection, host=None, max_connections=MAX_CONNECTIONS):
         super(S3BulkCopyPipeline, self).__init__()
 
         self.aws_access_key_id = aws_access_key_id
@@ -60,7 +64,8 @@ class S3BulkCopyPipeline(Pipeline):
 
         if isinstance(bucket, basestring):
             self.bucket = Bucket(aws_access_key_id, aws_secret_access_key,
-                                 bucket)
+                                 bucket, host=host,
+                                 max_connections=max_connections)
         else:
             self.bucket = bucket
 
@@ -69,7 +74,9 @@ class S3BulkCopyPipeline(Pipeline):
         else:
             self.database = Database(db_connection)
 
-    def step(self, metadata, source, schema, max_error_count=1):
+    def step(self, metadata, source, schema, max_error_count=1,
+             compression=None, compaction_part_size=None,
+             staging_format=None, local_validation=False):
         bulk_copy_step = BulkCopyFromS3JsonStep(metadata=metadata,
                                                 source=source,
                                                 schema=schema,
@@ -79,6 +86,12 @@ class S3BulkCopyPipeline(Pipeline):
                                                 table=TargetTable(schema,
                                                                   self.database))
         bulk_copy_step.max_error_count = max_error_count
+        bulk_copy_step.compression = compression
+        bulk_copy_step.compactor = _compactor(bulk_copy_step,
+                                              compaction_part_size,
+                                              staging_format)
+        if local_validation:
+            bulk_copy_step.validator = LocalValidator(self.bucket, schema)
         self.steps().append(bulk_copy_step)
         return self
 
@@ -89,7 +102,7 @@ class S3BulkCopyPipeline(Pipeline):
 
 class S3CopyPipeline(Pipeline):
     def __init__(self, aws_access_key_id, aws_secret_access_key, bucket,
-                 db_connection):
+                 db_connection, host=None, max_connections=MAX_CONNECTIONS):
         super(S3CopyPipeline, self).__init__()
 
         self.aws_access_key_id = aws_access_key_id
@@ -97,7 +110,8 @@ class S3CopyPipeline(Pipeline):
 
         if isinstance(bucket, basestring):
             self.bucket = Bucket(aws_access_key_id, aws_secret_access_key,
-                                 bucket)
+                                 bucket, host=host,
+                                 max_connections=max_connections)
         else:
             self.bucket = bucket
 
@@ -106,7 +120,9 @@ class S3CopyPipeline(Pipeline):
         else:
             self.database = Database(db_connection)
 
-    def bulk_copy(self, metadata, source, schema, max_error_count=1):
+    def bulk_copy(self, metadata, source, schema, max_error_count=1,
+                  compression=None, compaction_part_size=None,
+                  staging_format=None, local_validation=False):
         bulk_copy_step = BulkCopyFromS3JsonStep(metadata=metadata,
                                                 source=source,
                                                 schema=schema,
@@ -115,10 +131,19 @@ class S3CopyPipeline(Pipeline):
                                                 bucket=self.bucket,
                                                 table=TargetTable(schema,
                                                                   self.database))
-        self.__add_copy_step(bulk_copy_step, max_error_count)
+        bulk_copy_step.compression = compression
+        self.__add_copy_step(bulk_copy_step, max_error_count,
+                             compaction_part_size, staging_format,
+                             local_validation)
         return self
 
-    def manifest_copy(self, metadata, source, schema, max_error_count=1):
+    def manifest_copy(self, metadata, source, schema, max_error_count=1,
+                      incremental=False, lookback=None,
+                      false_positive_rate=None, cache=None, retention=None,
+                      slices=None, max_bytes=None, max_files=None,
+                      list_processes=None, key_source=None,
+                      compaction_part_size=None, staging_format=None,
+                      local_validation=False):
         manifest_copy_step = ManifestCopyFromS3JsonStep(metadata=metadata,
                                                         source=source,
                                                         schema=schema,
@@ -128,10 +153,24 @@ class S3CopyPipeline(Pipeline):
                                                         table=TargetTable(
                                                             schema,
                                                             self.database))
-        self.__add_copy_step(manifest_copy_step, max_error_count)
+        manifest_copy_step.manifest = Manifest(
+            metadata, source, schema, self.bucket, incremental, lookback,
+            false_positive_rate=false_positive_rate, cache=cache,
+            retention=retention, slices=slices, max_bytes=max_bytes,
+            max_files=max_files, list_processes=list_processes,
+            key_source=key_source)
+        self.__add_copy_step(manifest_copy_step, max_error_count,
+                             compaction_part_size, staging_format,
+                             local_validation)
         return self
 
-    def sql_manifest_copy(self, metadata, source, schema, max_error_count=1):
+    def sql_manifest_copy(self, metadata, source, schema, max_error_count=1,
+                          incremental=False, lookback=None,
+                          false_positive_rate=None, cache=None,
+                          retention=None, slices=None, max_bytes=None,
+                          max_files=None, list_processes=None,
+                          key_source=None, compaction_part_size=None,
+                          staging_format=None, local_validation=False):
         sql_manifest_copy_step = ManifestCopyFromS3JsonStep(metadata=metadata,
                                                             source=source,
                                                             schema=schema,
@@ -143,17 +182,70 @@ class S3CopyPipeline(Pipeline):
                                                                 self.database))
 
         sql_manifest = SqlManifest(metadata, source, schema, self.bucket,
-                                   self.database)
+                                   self.database, incremental, lookback,
+                                   false_positive_rate, cache, retention,
+                                   slices, max_bytes, max_files,
+                                   list_processes, key_source)
         sql_manifest.database = Database(
             sqlite3.connect(sql_manifest.journal_file_name))
         sql_manifest_copy_step.manifest = sql_manifest
-        self.__add_copy_step(sql_manifest_copy_step, max_error_count)
+        self.__add_copy_step(sql_manifest_copy_step, max_error_count,
+                             compaction_part_size, staging_format,
+                             local_validation)
+        return self
+
+    def redshift_manifest_copy(self, metadata, source, schema,
+                               max_error_count=1, slices=None,
+                               max_bytes=None, max_files=None,
+                               key_source=None, compaction_part_size=None,
+                               staging_format=None,
+                               local_validation=False):
+        redshift_manifest_copy_step = ManifestCopyFromS3JsonStep(
+            metadata=metadata,
+            source=source,
+            schema=schema,
+            aws_access_key_id=self.aws_access_key_id,
+            aws_secret_access_key=self.aws_secret_access_key,
+            bucket=self.bucket,
+            table=TargetTable(schema, self.database))
+        redshift_manifest_copy_step.manifest = RedshiftJournalManifest(
+            metadata, source, schema, self.bucket, self.database,
+            self.aws_access_key_id, self.aws_secret_access_key, slices,
+            max_bytes, max_files, key_source)
+        self.__add_copy_step(redshift_manifest_copy_step, max_error_count,
+                             compaction_part_size, staging_format,
+                             local_validation)
         return self
 
     def sql(self, *args):
         self.steps().append(SqlStep(self.database, *args))
         return self
 
-    def __add_copy_step(self, manifest_copy_step, max_error_count):
+    def __add_copy_step(self, manifest_copy_step, max_error_count,
+                        compaction_part_size=None, staging_format=None,
+                        local_validation=False):
         manifest_copy_step.max_error_count = max_error_count
+        manifest_copy_step.compactor = _compactor(manifest_copy_step,
+                                                  compaction_part_size,
+                                                  staging_format)
+        if local_validation:
+            manifest_copy_step.validator = LocalValidator(
+                manifest_copy_step.bucket, manifest_copy_step.schema)
         self.steps().append(manifest_copy_step)
+
+
+def _compactor(step, part_size, staging_format):
+    if staging_format is None:
+        if not part_size:
+            return None
+        return Compactor(step.bucket, step.compaction_prefix, part_size)
+    elif staging_format.upper() == 'CSV':
+        return CsvTranscoder(step.bucket, step.compaction_prefix, step.schema,
+                             part_size or TRANSCODING_PART_SIZE)
+    elif staging_format.upper() == 'PARQUET':
+        return ParquetTranscoder(step.bucket, step.compaction_prefix,
+                                 step.schema,
+                                 part_size or TRANSCODING_PART_SIZE)
+    else:
+        raise PipelineException(
+            'Unsupported staging format: {0}'.format(staging_format))
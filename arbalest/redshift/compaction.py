@@ -0,0 +1,461 @@
+import bz2
+import collections
+import csv
+import datetime
+import decimal
+import json
+import multiprocessing
+import re
+import uuid
+import zlib
+from StringIO import StringIO
+from multiprocessing.pool import ThreadPool
+from arbalest.core import PipelineException
+from arbalest.redshift.manifest import codec, _content_length, _entry
+from arbalest.s3 import normalize_path
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+COMPACTION_PART_SIZE = 128 * 1024 * 1024
+COMPACTION_PART_FILES = 100000
+COMPACTION_PROCESSES = 8
+COMPACTION_LEVEL = 6
+COMPACTION_FILE_NAME_FORMAT = '{0}_{1:05d}.json.gz'
+TRANSCODING_PART_SIZE = 64 * 1024 * 1024
+TRANSCODING_FILE_NAME_FORMAT = '{0}_{1:05d}.csv.gz'
+CSV_NULL = '\\N'
+PARQUET_FILE_NAME_FORMAT = '{0}_{1:05d}.parquet'
+PARQUET_ROW_GROUP_SIZE = 100000
+PARQUET_COMPRESSION = 'snappy'
+COLUMN_KINDS = {'SMALLINT': 'int16', 'INT2': 'int16',
+                'INTEGER': 'int32', 'INT': 'int32', 'INT4': 'int32',
+                'BIGINT': 'int64', 'INT8': 'int64',
+                'DECIMAL': 'decimal', 'NUMERIC': 'decimal',
+                'REAL': 'float32', 'FLOAT4': 'float32',
+                'DOUBLE PRECISION': 'float64', 'FLOAT8': 'float64',
+                'FLOAT': 'float64',
+                'BOOLEAN': 'bool', 'BOOL': 'bool',
+                'CHAR': 'string', 'CHARACTER': 'string', 'NCHAR': 'string',
+                'BPCHAR': 'string', 'VARCHAR': 'string',
+                'CHARACTER VARYING': 'string', 'NVARCHAR': 'string',
+                'TEXT': 'string',
+                'DATE': 'date', 'TIMESTAMP': 'timestamp',
+                'TIMESTAMP WITHOUT TIME ZONE': 'timestamp',
+                'TIMESTAMPTZ': 'timestamptz',
+                'TIMESTAMP WITH TIME ZONE': 'timestamptz'}
+COLUMN_TYPE_PATTERN = re.compile(
+    r'^\s*([A-Z0-9 ]+?)\s*(?:\((\d+|MAX)\s*(?:,\s*(\d+))?\))?\s*$')
+TIMESTAMP_OFFSET_PATTERN = re.compile(r'(?<=[\d ])([+-])(\d\d):?(\d\d)$')
+TIMESTAMP_SEPARATOR_PATTERN = re.compile(r'(\d)T(\d)')
+WHITESPACE_PATTERN = re.compile(r'\s*')
+CHARACTER_TYPES = ['CHAR', 'CHARACTER', 'NCHAR', 'BPCHAR']
+CHAR_MAX_LENGTH = 4096
+VARCHAR_LENGTH = 256
+VARCHAR_MAX_LENGTH = 65535
+DATE_FORMATS = ['%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%d %H:%M:%S',
+                '%Y-%m-%d %H:%M', '%Y-%m-%d']
+TIMESTAMP_FORMATS = [date_format + time_format for date_format in
+                     ['%Y-%m-%d', '%Y/%m/%d', '%Y%m%d', '%m/%d/%Y',
+                      '%m-%d-%Y', '%m.%d.%Y', '%d-%b-%Y', '%d %b %Y',
+                      '%b %d %Y', '%b %d, %Y'] for time_format in
+                     [' %H:%M:%S.%f', ' %H:%M:%S', ' %H:%M',
+                      ' %I:%M:%S.%f %p', ' %I:%M:%S %p', ' %I:%M %p',
+                      ' %H%M%S', '']]
+
+
+class Compactor(object):
+    format = None
+    codec = 'GZIP'
+    file_name_format = COMPACTION_FILE_NAME_FORMAT
+
+    def __init__(self, bucket, prefix, part_size=COMPACTION_PART_SIZE,
+                 part_files=COMPACTION_PART_FILES,
+                 processes=COMPACTION_PROCESSES):
+        self.bucket = bucket
+        self.prefix = normalize_path(prefix).lstrip('/')
+        self.part_size = part_size
+        self.part_files = part_files
+        self.processes = processes
+        self.run_id = None
+        self.parts = []
+
+    @property
+    def parts_prefix(self):
+        return '{0}/{1}_'.format(self.prefix, self.run_id)
+
+    @property
+    def parts_url(self):
+        return 's3://{0}/{1}'.format(self.bucket.name, self.parts_prefix)
+
+    def compact(self, entries):
+        self.run_id = uuid.uuid4().hex
+        self.parts = []
+        pool = ThreadPool(self.processes)
+        pending = collections.deque()
+        try:
+            for batch in _batches(entries, self.part_size, self.part_files):
+                key = self.__part_key(len(self.parts))
+                self.parts.append(key)
+                pending.append(pool.apply_async(self.write_part, [key,
+                                                                  batch]))
+                while len(pending) > self.processes:
+                    yield pending.popleft().get()
+            while pending:
+                yield pending.popleft().get()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def write_part(self, key, entries):
+        return _compact_part(self.bucket, key, entries)
+
+    def __part_key(self, i):
+        return '{0}/{1}'.format(
+            self.prefix, self.file_name_format.format(self.run_id, i))
+
+
+class Transcoder(Compactor):
+    def __init__(self, bucket, prefix, schema,
+                 part_size=TRANSCODING_PART_SIZE,
+                 part_files=COMPACTION_PART_FILES,
+                 processes=COMPACTION_PROCESSES, transcode_processes=None):
+        super(Transcoder, self).__init__(bucket, prefix, part_size,
+                                         part_files, processes)
+        self.columns = [(schema_property.column_name, schema_property.keys,
+                         schema_property.type) for schema_property in
+                        schema.schema]
+        self.transcode_processes = transcode_processes or \
+            multiprocessing.cpu_count()
+        self.__pool = None
+
+    def compact(self, entries):
+        self.__pool = multiprocessing.Pool(self.transcode_processes)
+        try:
+            for entry in super(Transcoder, self).compact(entries):
+                yield entry
+        finally:
+            self.__pool.terminate()
+            self.__pool.join()
+            self.__pool = None
+
+    def write_part(self, key, entries):
+        contents = [(name, _download(self.bucket, name)) for name in
+                    (_key_name(self.bucket, entry['url']) for entry in
+                     entries)]
+        data = self.__pool.apply(_transcode, [(self.format, self.columns,
+                                               contents)])
+        with self.bucket.writer(key) as writer:
+            writer.write(data)
+        return _entry(self.bucket.name, key, len(data))
+
+
+class CsvTranscoder(Transcoder):
+    format = 'CSV'
+    file_name_format = TRANSCODING_FILE_NAME_FORMAT
+
+
+class ParquetTranscoder(Transcoder):
+    format = 'PARQUET'
+    codec = None
+    file_name_format = PARQUET_FILE_NAME_FORMAT
+
+    def __init__(self, *args, **kwargs):
+        if pyarrow is None:
+            raise PipelineException(
+                'PARQUET staging requires pyarrow to be installed')
+        super(ParquetTranscoder, self).__init__(*args, **kwargs)
+
+
+def _batches(entries, part_size, part_files):
+    batch = []
+    size = 0
+    for entry in entries:
+        batch.append(entry)
+        size += _content_length(entry)
+        if size >= part_size or len(batch) >= part_files:
+            yield batch
+            batch = []
+            size = 0
+    if batch:
+        yield batch
+
+
+def _compact_part(bucket, key, entries):
+    compressor = zlib.compressobj(COMPACTION_LEVEL, zlib.DEFLATED,
+                                  16 + zlib.MAX_WBITS)
+    size = 0
+    with bucket.writer(key) as writer:
+        for entry in entries:
+            name = _key_name(bucket, entry['url'])
+            contents = _decompress(name, _download(bucket, name))
+            if contents and not contents.endswith('\n'):
+                contents += '\n'
+            data = compressor.compress(contents)
+            size += len(data)
+            writer.write(data)
+        data = compressor.flush()
+        size += len(data)
+        writer.write(data)
+    return _entry(bucket.name, key, size)
+
+
+def _transcode(part):
+    staging_format, columns, contents = part
+    if staging_format == 'PARQUET':
+        return _transcode_parquet(columns, contents)
+    return _transcode_csv(columns, contents)
+
+
+def _transcode_csv(columns, contents):
+    compressor = zlib.compressobj(COMPACTION_LEVEL, zlib.DEFLATED,
+                                  16 + zlib.MAX_WBITS)
+    chunks = []
+    for name, data in contents:
+        rows = StringIO()
+        writer = csv.writer(rows)
+        for _, json_object in _json_objects(_decompress(name, data)):
+            writer.writerow([_csv_value(_project(json_object, keys)) for
+                             _, keys, _ in columns])
+        chunks.append(compressor.compress(rows.getvalue()))
+    chunks.append(compressor.flush())
+    return ''.join(chunks)
+
+
+def _transcode_parquet(columns, contents):
+    kinds = [column_kind(column_type) for _, _, column_type in columns]
+    schema = pyarrow.schema([pyarrow.field(column_name, _arrow_type(kind))
+                             for (column_name, _, _), kind in
+                             zip(columns, kinds)])
+    sink = pyarrow.BufferOutputStream()
+    writer = pyarrow.parquet.ParquetWriter(sink, schema,
+                                           compression=PARQUET_COMPRESSION)
+    values = [[] for _ in columns]
+    names = []
+    try:
+        for name, data in contents:
+            for _, json_object in _json_objects(_decompress(name, data)):
+                for column_values, (_, keys, _) in zip(values, columns):
+                    column_values.append(_project(json_object, keys))
+                names.append(name)
+                if len(names) == PARQUET_ROW_GROUP_SIZE:
+                    _write_row_group(writer, schema, columns, kinds, values,
+                                     names)
+                    values = [[] for _ in columns]
+                    names = []
+        if names:
+            _write_row_group(writer, schema, columns, kinds, values, names)
+    finally:
+        writer.close()
+    return sink.getvalue().to_pybytes()
+
+
+def _write_row_group(writer, schema, columns, kinds, values, names):
+    writer.write_table(pyarrow.Table.from_arrays(
+        [_arrow_column(kind, column_values, column_name, names) for
+         (column_name, _, _), kind, column_values in
+         zip(columns, kinds, values)], schema=schema))
+
+
+def _arrow_column(kind, values, column_name, names):
+    arrow_type = _arrow_type(kind)
+    try:
+        column = _cast(kind, pyarrow.array(values), arrow_type)
+    except (pyarrow.ArrowException, ArithmeticError, TypeError, ValueError):
+        column = None
+    if column is not None:
+        return column
+    return pyarrow.array([_converted(kind, value, column_name, name) for
+                          value, name in zip(values, names)],
+                         type=arrow_type)
+
+
+def _cast(kind, column, arrow_type):
+    name = kind[0]
+    source_type = column.type
+    if source_type == arrow_type or pyarrow.types.is_null(source_type):
+        return column.cast(arrow_type)
+    elif name in ('int16', 'int32', 'int64', 'float32', 'float64'):
+        if pyarrow.types.is_integer(source_type) or \
+                pyarrow.types.is_floating(source_type) or \
+                pyarrow.types.is_string(source_type):
+            return column.cast(arrow_type)
+    elif name == 'bool' and pyarrow.types.is_string(source_type):
+        return column.cast(arrow_type)
+    elif name in ('date', 'timestamp', 'timestamptz') and \
+            pyarrow.types.is_string(source_type):
+        return column.cast(pyarrow.timestamp('us')).cast(arrow_type)
+    return None
+
+
+def _arrow_type(kind):
+    name, precision, scale = kind
+    if name == 'decimal':
+        return pyarrow.decimal128(precision, scale)
+    elif name == 'string':
+        return pyarrow.string()
+    elif name == 'bool':
+        return pyarrow.bool_()
+    elif name == 'date':
+        return pyarrow.date32()
+    elif name == 'timestamp':
+        return pyarrow.timestamp('us')
+    elif name == 'timestamptz':
+        return pyarrow.timestamp('us', tz='UTC')
+    return getattr(pyarrow, name)()
+
+
+def column_kind(column_type):
+    match = COLUMN_TYPE_PATTERN.match(str(column_type).upper())
+    if match is None or match.group(1) not in COLUMN_KINDS:
+        raise PipelineException(
+            'Unsupported column type: {0}'.format(column_type))
+    name = COLUMN_KINDS[match.group(1)]
+    if match.group(2) == 'MAX':
+        precision = CHAR_MAX_LENGTH if match.group(1) in CHARACTER_TYPES \
+            else VARCHAR_MAX_LENGTH
+    else:
+        precision = int(match.group(2)) if match.group(2) else None
+    scale = int(match.group(3)) if match.group(3) else None
+    if name == 'decimal':
+        return name, precision or 18, scale or 0
+    elif name == 'string' and precision is None:
+        return name, 1 if match.group(1) in CHARACTER_TYPES else \
+            VARCHAR_LENGTH, None
+    return name, precision, scale
+
+
+def convert(kind, value):
+    name, precision, scale = kind
+    if value is None:
+        return None
+    elif name in ('int16', 'int32', 'int64'):
+        if isinstance(value, float) and not value.is_integer():
+            raise ValueError('Not an integer: {0!r}'.format(value))
+        return int(value)
+    elif name in ('float32', 'float64'):
+        return float(value)
+    elif name == 'decimal':
+        number = decimal.Decimal(repr(value) if isinstance(value, float)
+                                 else unicode(value))
+        return number.quantize(decimal.Decimal(1).scaleb(-scale),
+                               rounding=decimal.ROUND_HALF_UP)
+    elif name == 'bool':
+        if isinstance(value, bool):
+            return value
+        elif unicode(value).lower() in ('true', 't', '1'):
+            return True
+        elif unicode(value).lower() in ('false', 'f', '0'):
+            return False
+        raise ValueError('Not a boolean: {0!r}'.format(value))
+    elif name == 'string':
+        if isinstance(value, (dict, list)):
+            return json.dumps(value, separators=(',', ':'))
+        elif isinstance(value, bool):
+            return u'true' if value else u'false'
+        return value if isinstance(value, unicode) else unicode(value)
+    elif name == 'date':
+        return _timestamp(value, DATE_FORMATS).date()
+    return _timestamp(value, TIMESTAMP_FORMATS)
+
+
+def _converted(kind, value, column_name, name):
+    try:
+        return convert(kind, value)
+    except (ArithmeticError, TypeError, ValueError), e:
+        raise PipelineException('Cannot convert {0} in {1}: {2}'.format(
+            column_name, name, e))
+
+
+def _timestamp(value, formats):
+    if isinstance(value, (int, long, float)) and \
+            not isinstance(value, bool):
+        return datetime.datetime.utcfromtimestamp(value)
+    text = TIMESTAMP_SEPARATOR_PATTERN.sub(r'\1 \2', unicode(value).strip())
+    offset = datetime.timedelta()
+    if text.endswith('Z'):
+        text = text[:-1]
+    elif len(text) > 10:
+        match = TIMESTAMP_OFFSET_PATTERN.search(text)
+        if match is not None:
+            sign, hours, minutes = match.groups()
+            offset = datetime.timedelta(hours=int(hours),
+                                        minutes=int(minutes))
+            offset = -offset if sign == '-' else offset
+            text = text[:match.start()].strip()
+    for timestamp_format in formats:
+        try:
+            return datetime.datetime.strptime(text, timestamp_format) - offset
+        except ValueError:
+            pass
+    raise ValueError('Not a timestamp: {0!r}'.format(value))
+
+
+def _json_objects(contents):
+    decoder = json.JSONDecoder()
+    contents = contents.decode('utf-8')
+    position = 0
+    line = 1
+    while True:
+        start = WHITESPACE_PATTERN.match(contents, position).end()
+        line += contents.count('\n', position, start)
+        if start == len(contents):
+            break
+        json_object, position = decoder.raw_decode(contents, start)
+        yield line, json_object
+        line += contents.count('\n', start, position)
+
+
+def _project(json_object, keys):
+    for key in keys:
+        if not isinstance(json_object, dict):
+            return None
+        json_object = json_object.get(key)
+    return json_object
+
+
+def _csv_value(value):
+    if value is None:
+        return CSV_NULL
+    elif isinstance(value, bool):
+        return 'true' if value else 'false'
+    elif isinstance(value, unicode):
+        return value.encode('utf-8')
+    elif isinstance(value, float):
+        return repr(value)
+    elif isinstance(value, (dict, list)):
+        return json.dumps(value, separators=(',', ':'))
+    return str(value)
+
+
+def _download(bucket, name):
+    return bucket.limiter.request(bucket.get(name).get_contents_as_string)
+
+
+def _key_name(bucket, url):
+    prefix = 's3://{0}/'.format(bucket.name)
+    if not url.startswith(prefix):
+        raise PipelineException(
+            'Cannot compact {0} outside of {1}'.format(url, bucket.name))
+    return url[len(prefix):]
+
+
+def _decompress(name, contents):
+    name_codec = codec(name)
+    if name_codec is None:
+        return contents
+    elif name_codec == 'GZIP':
+        members = []
+        while contents:
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            members.append(decompressor.decompress(contents))
+            contents = decompressor.unused_data
+        return ''.join(members)
+    elif name_codec == 'BZIP2':
+        return bz2.decompress(contents)
+    else:
+        raise PipelineException(
+            'Cannot compact {0} compressed key {1}'.format(name_codec, name))
@@ -0,0 +1,352 @@
+import array
+import bisect
+import hashlib
+import heapq
+import itertools
+import json
+import math
+import os
+import struct
+import sys
+import tempfile
+import zlib
+from arbalest.core import JournalException
+
+SORT_BUFFER_SIZE = 1000000
+JOURNAL_MAGIC = 'ARBJ'
+JOURNAL_VERSION = 1
+JOURNAL_BLOCK_SIZE = 64 * 1024
+
+BLOOM_FILTER_MAGIC = 'ARBF'
+BLOOM_FILTER_VERSION = 2
+
+_HEADER = struct.Struct('>4sB')
+_BLOCK = struct.Struct('>II')
+_FOOTER = struct.Struct('>QI4s')
+_BLOOM_FILTER_HEADER = struct.Struct('>4sBdQQ16s')
+_BLOOM_FILTER_HEADER_V1 = struct.Struct('>4sBdQQ')
+_NO_IDENTITY = '\0' * 16
+_HASH = struct.Struct('>QQ')
+
+
+class JournalWriter(object):
+    def __init__(self, fileobj, block_size=JOURNAL_BLOCK_SIZE):
+        self.fileobj = fileobj
+        self.block_size = block_size
+        self.index = []
+        self.offset = 0
+        self.count = 0
+        self.__shared = array.array('H')
+        self.__lengths = array.array('H')
+        self.__suffixes = []
+        self.__block_length = 0
+        self.__first_key = None
+        self.__previous = None
+        self.__write(_HEADER.pack(JOURNAL_MAGIC, JOURNAL_VERSION))
+
+    def write(self, key):
+        encoded = _encode(key)
+        if self.__previous is not None:
+            if encoded == self.__previous:
+                return
+            elif encoded < self.__previous:
+                raise JournalException(
+                    'Journal keys must be sorted: {0} after {1}'.format(
+                        encoded, self.__previous))
+
+        if not self.__suffixes:
+            shared = 0
+            self.__first_key = encoded.decode('utf-8')
+        else:
+            shared = _shared_prefix_length(self.__previous, encoded)
+
+        suffix = encoded[shared:]
+        self.__shared.append(shared)
+        self.__lengths.append(len(suffix))
+        self.__suffixes.append(suffix)
+        self.__block_length += len(suffix)
+        self.__previous = encoded
+        self.count += 1
+
+        if self.__block_length >= self.block_size:
+            self.__flush()
+
+    def close(self):
+        self.__flush()
+        self.__write(_BLOCK.pack(0, 0))
+        index_offset = self.offset
+        index = zlib.compress(json.dumps(self.index))
+        self.__write(index)
+        self.__write(_FOOTER.pack(index_offset, len(index), JOURNAL_MAGIC))
+
+    def __flush(self):
+        if self.__suffixes:
+            block = zlib.compress(_pack(self.__shared) +
+                                  _pack(self.__lengths) +
+                                  ''.join(self.__suffixes))
+            self.index.append([self.offset, self.__first_key])
+            self.__write(_BLOCK.pack(len(block), len(self.__suffixes)))
+            self.__write(block)
+            self.__shared = array.array('H')
+            self.__lengths = array.array('H')
+            self.__suffixes = []
+            self.__block_length = 0
+
+    def __write(self, data):
+        self.fileobj.write(data)
+        self.offset += len(data)
+
+
+class JournalReader(object):
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.__index = None
+        self.__first_keys = None
+        self.__block = (None, [])
+
+        magic, version = _HEADER.unpack(_read(fileobj, _HEADER.size))
+        if magic != JOURNAL_MAGIC:
+            raise JournalException('Invalid journal')
+        elif version != JOURNAL_VERSION:
+            raise JournalException(
+                'Unsupported journal version: {0}'.format(version))
+
+    @property
+    def index(self):
+        if self.__index is None:
+            self.fileobj.seek(-_FOOTER.size, os.SEEK_END)
+            offset, length, magic = _FOOTER.unpack(
+                _read(self.fileobj, _FOOTER.size))
+            if magic != JOURNAL_MAGIC:
+                raise JournalException('Invalid journal index')
+            self.fileobj.seek(offset)
+            self.__index = json.loads(
+                zlib.decompress(_read(self.fileobj, length)))
+            self.__first_keys = [first_key for _, first_key in self.__index]
+        return self.__index
+
+    def __iter__(self):
+        while True:
+            length, count = _BLOCK.unpack(_read(self.fileobj, _BLOCK.size))
+            if length == 0:
+                break
+            for key in _decode(_read(self.fileobj, length), count):
+                yield key
+
+    def __contains__(self, key):
+        if not self.index:
+            return False
+
+        position = bisect.bisect_right(self.__first_keys, key) - 1
+        if position < 0:
+            return False
+
+        keys = self.__keys(position)
+        i = bisect.bisect_left(keys, key)
+        return i < len(keys) and keys[i] == key
+
+    def __keys(self, position):
+        if self.__block[0] != position:
+            offset = self.index[position][0]
+            self.fileobj.seek(offset)
+            length, count = _BLOCK.unpack(_read(self.fileobj, _BLOCK.size))
+            self.__block = (position,
+                            _decode(_read(self.fileobj, length), count))
+        return self.__block[1]
+
+
+class BloomFilter(object):
+    def __init__(self, capacity, error_rate, count=0, bits=None,
+                 identity=None):
+        self.capacity = max(int(capacity), 1)
+        self.error_rate = error_rate
+        self.count = count
+        self.identity = identity
+        self.size = int(math.ceil(
+            -self.capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, int(round(
+            float(self.size) / self.capacity * math.log(2))))
+        self.bits = bits if bits is not None else bytearray(
+            (self.size + 7) // 8)
+
+    @property
+    def full(self):
+        return self.count > self.capacity
+
+    def add(self, key):
+        for position in self.__positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def dumps(self):
+        return _BLOOM_FILTER_HEADER.pack(
+            BLOOM_FILTER_MAGIC, BLOOM_FILTER_VERSION, self.error_rate,
+            self.capacity, self.count, self.identity or _NO_IDENTITY) + \
+            zlib.compress(str(self.bits))
+
+    @classmethod
+    def loads(cls, data):
+        magic, version = _HEADER.unpack(data[:_HEADER.size])
+        if magic != BLOOM_FILTER_MAGIC:
+            raise JournalException('Invalid journal filter')
+        elif version == 1:
+            header = _BLOOM_FILTER_HEADER_V1
+            _, _, error_rate, capacity, count = header.unpack(
+                data[:header.size])
+            identity = None
+        elif version == BLOOM_FILTER_VERSION:
+            header = _BLOOM_FILTER_HEADER
+            _, _, error_rate, capacity, count, identity = header.unpack(
+                data[:header.size])
+        else:
+            raise JournalException(
+                'Unsupported journal filter version: {0}'.format(version))
+        return cls(capacity, error_rate, count, bytearray(
+            zlib.decompress(data[header.size:])),
+            None if identity == _NO_IDENTITY else identity)
+
+    def __contains__(self, key):
+        bits = self.bits
+        for position in self.__positions(key):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def __positions(self, key):
+        a, b = _HASH.unpack(hashlib.md5(_encode(key)).digest())
+        size = self.size
+        return [(a + i * b) % size for i in xrange(self.hashes)]
+
+
+def write_journal(keys, fileobj, block_size=JOURNAL_BLOCK_SIZE):
+    writer = JournalWriter(fileobj, block_size)
+    for key in keys:
+        writer.write(key)
+    writer.close()
+    return writer
+
+
+def unique(keys):
+    return (key for key, _ in itertools.groupby(keys))
+
+
+def is_sorted(keys):
+    return all(a <= b for a, b in itertools.izip(keys, itertools.islice(
+        keys, 1, None)))
+
+
+def sort(keys, buffer_size=SORT_BUFFER_SIZE, directory=None):
+    if isinstance(keys, list) and is_sorted(keys):
+        return iter(keys)
+    else:
+        return _external_sort(iter(keys), buffer_size, directory)
+
+
+def difference(keys, journal, updated_journal=None, bloom_filter=None,
+               key=None):
+    journal = unique(journal)
+    entry = None
+    for name, items in itertools.groupby(keys, key):
+        item = next(items)
+        journaled = False
+        if bloom_filter is None or name in bloom_filter:
+            while entry is None or entry < name:
+                entry = next(journal, None)
+                if entry is None:
+                    break
+            journaled = entry == name
+
+        if not journaled:
+            if updated_journal is not None:
+                updated_journal.append(name)
+            yield item
+
+
+def _external_sort(keys, buffer_size, directory):
+    runs = []
+    try:
+        while True:
+            chunk = list(itertools.islice(keys, buffer_size))
+            if not chunk:
+                break
+            chunk.sort()
+            runs.append(_spill(chunk, directory))
+            del chunk
+
+        for key in heapq.merge(*[_read_run(run) for run in runs]):
+            yield key
+    finally:
+        for run in runs:
+            run.close()
+            os.remove(run.name)
+
+
+def _spill(keys, directory):
+    run = tempfile.NamedTemporaryFile(prefix='arbalest_sort_', dir=directory,
+                                      delete=False)
+    for key in keys:
+        run.write(json.dumps(key) + '\n')
+    run.flush()
+    run.seek(0)
+    return run
+
+
+def _read_run(run):
+    for line in run:
+        yield json.loads(line)
+
+
+def _encode(key):
+    return key.encode('utf-8') if isinstance(key, unicode) else key
+
+
+def _decode(block, count):
+    data = zlib.decompress(block)
+    shared = _unpack(data[:2 * count])
+    lengths = _unpack(data[2 * count:4 * count])
+    position = 4 * count
+    previous = ''
+    keys = []
+    for prefix_length, length in itertools.izip(shared, lengths):
+        previous = previous[:prefix_length] + \
+            data[position:position + length]
+        position += length
+        keys.append(previous.decode('utf-8'))
+    return keys
+
+
+def _pack(values):
+    if sys.byteorder == 'little':
+        values = array.array(values.typecode, values)
+        values.byteswap()
+    return values.tostring()
+
+
+def _unpack(data):
+    values = array.array('H', data)
+    if sys.byteorder == 'little':
+        values.byteswap()
+    return values
+
+
+def _shared_prefix_length(a, b):
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[:middle] == b[:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def _read(fileobj, size):
+    data = []
+    remaining = size
+    while remaining > 0:
+        chunk = fileobj.read(remaining)
+        if not chunk:
+            raise JournalException('Unexpected end of journal')
+        data.append(chunk)
+        remaining -= len(chunk)
+    return ''.join(data)
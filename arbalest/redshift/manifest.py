@@ -1,21 +1,235 @@
+import csv
+import datetime
+import hashlib
+import heapq
 import json
+import logging
+import operator
+import shutil
+import tempfile
+import uuid
+from psycopg2.extensions import AsIs
+from arbalest.redshift.journal import difference, sort, unique, \
+    BloomFilter, JournalReader, write_journal
 from arbalest.s3 import normalize_path
 from arbalest.sql import Database
 
+WATERMARK_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+JOURNAL_SEGMENT_TIME_FORMAT = '%Y%m%d%H%M%S%f'
+JOURNAL_COMPACTION_SEGMENTS = 16
+JOURNAL_COMPACTION_SIZE = 64 * 1024 * 1024
+JOURNAL_FILTER_CAPACITY = 100000
+CODECS = [('.gz', 'GZIP'), ('.gzip', 'GZIP'), ('.bz2', 'BZIP2'),
+          ('.zst', 'ZSTD')]
+MANIFEST_FILE_NAME_FORMAT = '{0}_manifest_{1}.json'
+SQL_JOURNAL_PRAGMAS = ['PRAGMA page_size = 65536',
+                       'PRAGMA journal_mode = MEMORY',
+                       'PRAGMA synchronous = OFF']
+
+_logger = logging.getLogger(__name__)
+
+
+class Watermark(object):
+    def __init__(self, bucket, key, lookback=None, retention=None):
+        self.bucket = bucket
+        self.key = key
+        self.lookback = lookback
+        self.retention = retention
+
+    @property
+    def marker(self):
+        return self.marker_before(self.lookback)
+
+    def marker_before(self, age):
+        committed = self.__committed(self.marks(), age)
+        return committed[-1]['key'] if committed else ''
+
+    def marks(self):
+        if self.bucket.exists(self.key):
+            return json.loads(self.bucket.get(
+                self.key).get_contents_as_string())['marks']
+        else:
+            return []
+
+    def commit(self, saved_keys):
+        marks = self.marks()
+        latest = marks[-1]['key'] if marks else ''
+        key = max([latest] + list(saved_keys))
+        if key != latest:
+            marks.append({'key': key,
+                          'committed': self.__now().strftime(
+                              WATERMARK_TIME_FORMAT)})
+
+        committed = self.__committed(marks, max(
+            self.lookback or datetime.timedelta(0),
+            self.retention or datetime.timedelta(0)))
+        if committed:
+            marks = marks[marks.index(committed[-1]):]
+
+        self.bucket.save(self.key, json.dumps({'marks': marks}))
+
+    def __committed(self, marks, age):
+        cutoff = self.__now() - (age or datetime.timedelta(0))
+        return [mark for mark in marks if datetime.datetime.strptime(
+            mark['committed'], WATERMARK_TIME_FORMAT) <= cutoff]
+
+    @staticmethod
+    def __now():
+        return datetime.datetime.utcnow()
+
+
+class JournalFilter(object):
+    def __init__(self, bucket, key, false_positive_rate=None,
+                 capacity=JOURNAL_FILTER_CAPACITY):
+        self.bucket = bucket
+        self.key = key
+        self.false_positive_rate = false_positive_rate
+        self.capacity = capacity
+        self.__filter = None
+
+    @property
+    def enabled(self):
+        return self.false_positive_rate is not None
+
+    def get(self, journal, identity):
+        if not self.enabled:
+            return None
+
+        if self.__filter is None:
+            self.__filter = self.__load()
+        if not self.__current(self.__filter, identity) or \
+                self.__filter.full:
+            self.__filter = self.__build(journal, identity)
+        return self.__filter
+
+    def commit(self, saved_keys, journal, previous_identity, identity):
+        if not self.enabled:
+            return
+
+        self.save(self.update(saved_keys, journal, previous_identity),
+                  identity)
+
+    def update(self, saved_keys, journal, previous_identity):
+        if not self.enabled:
+            return None
+
+        bloom_filter = self.__filter or self.__load()
+        if not self.__current(bloom_filter, previous_identity):
+            return self.__build(journal, None)
+
+        for key in saved_keys:
+            bloom_filter.add(key)
+        if bloom_filter.full:
+            return self.__build(journal, None)
+        return bloom_filter
+
+    def save(self, bloom_filter, identity):
+        if not self.enabled:
+            return
+
+        bloom_filter.identity = identity
+        self.__save(bloom_filter)
+
+    def rebase(self, previous_identity, identity):
+        if not self.enabled:
+            return
+
+        bloom_filter = self.__filter or self.__load()
+        if self.__current(bloom_filter, previous_identity):
+            bloom_filter.identity = identity
+            self.__save(bloom_filter)
+
+    def __current(self, bloom_filter, identity):
+        return bloom_filter is not None and \
+            bloom_filter.error_rate == self.false_positive_rate and \
+            bloom_filter.identity is not None and \
+            bloom_filter.identity == identity
+
+    def __save(self, bloom_filter):
+        self.__filter = None
+        self.bucket.save(self.key, bloom_filter.dumps())
+        self.__filter = bloom_filter
+
+    def __load(self):
+        if self.bucket.exists(self.key):
+            return BloomFilter.loads(
+                self.bucket.get(self.key).get_contents_as_string())
+        else:
+            return None
+
+    def __build(self, journal, identity):
+        keys = list(journal())
+        bloom_filter = BloomFilter(max(2 * len(keys), self.capacity),
+                                   self.false_positive_rate,
+                                   identity=identity)
+        for key in keys:
+            bloom_filter.add(key)
+        return bloom_filter
+
 
 class Manifest(object):
-    def __init__(self, metadata, source, schema, bucket):
+    def __init__(self, metadata, source, schema, bucket, incremental=False,
+                 lookback=None,
+                 compaction_segments=JOURNAL_COMPACTION_SEGMENTS,
+                 compaction_size=JOURNAL_COMPACTION_SIZE,
+                 false_positive_rate=None, cache=None, retention=None,
+                 slices=None, max_bytes=None, max_files=None,
+                 list_processes=None, key_source=None):
         self.metadata = metadata
         self.source = source
         self.schema = schema
         self.bucket = bucket
+        self.incremental = incremental
+        self.cache = cache
+        self.retention = retention
+        self.list_processes = list_processes
+        self.key_source = key_source
+        self.compactor = None
+        self.validator = None
+        self.slices = slices
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.manifest_count = 1
+        self.manifest_codecs = [None]
+        self.compaction_segments = compaction_segments
+        self.compaction_size = compaction_size
         self.file_name = '{0}_manifest.json'.format(schema.table)
-        self.journal_file_name = '{0}_journal.json'.format(schema.table)
+        self.journal_file_name = '{0}_journal.bin'.format(schema.table)
+        self.journal_segments_name = '{0}_journal'.format(schema.table)
+        self.legacy_journal_file_name = '{0}_journal.json'.format(
+            schema.table)
+        self.watermark_file_name = '{0}_watermark.json'.format(schema.table)
+        self.journal_filter_file_name = '{0}_journal.bloom'.format(
+            schema.table)
+        self.watermark = Watermark(
+            bucket, self.watermark_key, lookback,
+            retention if isinstance(retention, datetime.timedelta) else None)
+        self.journal_filter = JournalFilter(bucket, self.journal_filter_key,
+                                            false_positive_rate)
 
     @property
     def all_keys(self):
-        return [k.name for k in self.bucket.list(self.source) if
-                not k.name.endswith('/')]
+        return (k.name for k in self.listing)
+
+    @property
+    def listing(self):
+        marker = self.watermark.marker if self.incremental else ''
+        marker = max(marker, self.retention_key)
+        if self.key_source is not None:
+            keys = self.key_source.keys(self.source, marker)
+        elif self.list_processes is None:
+            keys = self.bucket.list_keys(self.source, marker=marker)
+        else:
+            keys = self.bucket.list_parallel(self.source, marker=marker,
+                                             processes=self.list_processes)
+        return (k for k in keys if not k.name.endswith('/'))
+
+    @property
+    def retention_key(self):
+        if isinstance(self.retention, datetime.timedelta):
+            return self.watermark.marker_before(self.retention)
+        else:
+            return self.retention or ''
 
     @property
     def manifest_key(self):
@@ -26,53 +240,206 @@ class Manifest(object):
         return normalize_path(
             '{0}/{1}'.format(self.metadata, self.journal_file_name))
 
+    @property
+    def journal_segments_prefix(self):
+        return normalize_path(
+            '{0}/{1}'.format(self.metadata, self.journal_segments_name)) + '/'
+
+    @property
+    def legacy_journal_key(self):
+        return normalize_path(
+            '{0}/{1}'.format(self.metadata, self.legacy_journal_file_name))
+
+    @property
+    def watermark_key(self):
+        return normalize_path(
+            '{0}/{1}'.format(self.metadata, self.watermark_file_name))
+
+    @property
+    def journal_filter_key(self):
+        return normalize_path(
+            '{0}/{1}'.format(self.metadata, self.journal_filter_file_name))
+
+    @property
+    def manifest_keys(self):
+        return self.__manifest_keys(self.manifest_count)
+
     @property
     def manifest_url(self):
         return 's3://{0}{1}'.format(self.bucket.name, self.manifest_key)
 
+    @property
+    def manifest_urls(self):
+        return ['s3://{0}{1}'.format(self.bucket.name, key) for key in
+                self.manifest_keys]
+
+    def __manifest_keys(self, count):
+        return _manifest_keys(self.metadata, self.schema, self.manifest_key,
+                              count)
+
     def journal(self):
-        journal = self.bucket.get(self.journal_key)
-        if journal.exists():
-            return json.loads(journal.get_contents_as_string())
-        else:
-            return []
+        for key in self.__merge(self.journal_segments()):
+            yield key
+
+    def journal_segments(self):
+        return [k for k in self.bucket.list(self.journal_segments_prefix) if
+                not k.name.endswith('/')]
 
     def get(self):
-        updated_journal = self.all_keys
-        journal = self.journal()
-        keys = list(set(updated_journal) - set(journal))
+        updated_journal = []
+        entries = list(self.__entries(updated_journal))
 
         return {
             'manifest': {
-                'entries': [
-                    {'url': 's3://{0}/{1}'.format(self.bucket.name, key),
-                     'mandatory': True} for key in keys
-                ]
+                'entries': entries
             },
             'updated_journal': updated_journal
         }
 
     def save(self):
-        manifest = self.get()
-        self.bucket.save(self.manifest_key, json.dumps(manifest['manifest']))
-        return manifest['updated_journal']
+        updated_journal = []
+        self.manifest_codecs = _save_manifests(
+            self.bucket, self.__manifest_keys,
+            _validated(self.validator, self.__entries(updated_journal)),
+            self.slices, self.max_bytes, self.max_files, self.compactor)
+        self.manifest_count = len(self.manifest_codecs)
+        return updated_journal
 
     def commit(self, saved_keys):
-        self.bucket.save(self.journal_key, json.dumps(saved_keys))
+        previous_identity = self.journal_identity() if \
+            self.journal_filter.enabled else None
+        if not self.__base_exists():
+            self.__write(self.journal_key, saved_keys)
+        elif saved_keys:
+            self.__write(self.__segment_key(), saved_keys)
+
+        if self.journal_filter.enabled:
+            self.journal_filter.commit(saved_keys, self.journal,
+                                       previous_identity,
+                                       self.journal_identity())
+        if self.incremental or self.watermark.retention is not None:
+            self.watermark.commit(saved_keys)
+
+        segments = self.journal_segments()
+        if len(segments) >= self.compaction_segments or sum(
+                [segment.size or 0 for segment in segments]) >= \
+                self.compaction_size:
+            self.compact(segments)
+
+    def compact(self, segments=None):
+        segments = self.journal_segments() if segments is None else segments
+        previous_identity = self.journal_identity(segments) if \
+            self.journal_filter.enabled else None
+        retention_key = self.retention_key
+        self.__write(self.journal_key, (key for key in self.__merge(segments)
+                                        if key > retention_key))
+        for error in self.bucket.delete_many(segments):
+            _logger.warning('Could not delete journal segment %s: %s %s',
+                            error.key, error.code, error.message)
+        if self.journal_filter.enabled:
+            self.journal_filter.rebase(previous_identity,
+                                       self.journal_identity())
+
+    def journal_identity(self, segments=None):
+        segments = self.journal_segments() if segments is None else segments
+        base = self.bucket.head(self.journal_key) or \
+            self.bucket.head(self.legacy_journal_key)
+        return _identity(None if base is None else base.etag,
+                         sorted(segment.name for segment in segments))
 
     def exists(self):
-        return self.bucket.get(self.manifest_key).exists()
+        return self.bucket.exists(self.manifest_key)
 
     def journal_exists(self):
-        return self.bucket.get(self.journal_key).exists()
+        return self.__base_exists() or len(self.journal_segments()) > 0
+
+    def __entries(self, updated_journal):
+        bloom_filter = self.journal_filter.get(
+            self.journal, self.journal_identity()) if \
+            self.journal_filter.enabled else None
+        keys = difference(self.listing, self.journal(), updated_journal,
+                          bloom_filter, operator.attrgetter('name'))
+        return (_entry(self.bucket.name, key.name, key.size) for key in keys)
+
+    def __base_exists(self):
+        return self.bucket.exists(self.journal_key) or \
+            self.bucket.exists(self.legacy_journal_key)
+
+    def __base(self):
+        journal = self.__fetch(self.bucket.get(self.journal_key))
+        if journal is not None:
+            return self.__read(journal)
+
+        legacy_journal = self.__fetch(
+            self.bucket.get(self.legacy_journal_key))
+        if legacy_journal is None:
+            return iter([])
+        elif self.cache is None:
+            return sort(json.loads(legacy_journal.get_contents_as_string()))
+        else:
+            with legacy_journal:
+                return sort(json.load(legacy_journal))
+
+    def __fetch(self, key, etag=None):
+        if etag is None:
+            metadata = self.bucket.head(key)
+            if metadata is None:
+                return None
+            etag = metadata.etag
+
+        if self.cache is not None:
+            return self.cache.fetch(key, etag)
+        else:
+            return key
+
+    def __merge(self, segments):
+        return unique(heapq.merge(self.__base(), *[
+            self.__read(self.__fetch(segment, segment.etag)) for segment in
+            segments]))
+
+    def __segment_key(self):
+        return '{0}{1}-{2}.bin'.format(
+            self.journal_segments_prefix,
+            datetime.datetime.utcnow().strftime(JOURNAL_SEGMENT_TIME_FORMAT),
+            uuid.uuid4().hex)
+
+    def __write(self, key, keys):
+        with tempfile.TemporaryFile() as journal:
+            write_journal(keys, journal)
+            etag = self.bucket.save(key, journal)
+            if self.cache is not None:
+                self.cache.put(self.bucket.name, key, etag, journal)
+
+    @staticmethod
+    def __read(journal):
+        try:
+            for key in JournalReader(journal):
+                yield key
+        finally:
+            journal.close()
 
 
 class SqlManifest(object):
-    def __init__(self, metadata, source, schema, bucket, db_connection):
+    def __init__(self, metadata, source, schema, bucket, db_connection,
+                 incremental=False, lookback=None, false_positive_rate=None,
+                 cache=None, retention=None, slices=None, max_bytes=None,
+                 max_files=None, list_processes=None, key_source=None):
         self.metadata = metadata
         self.source = source
         self.schema = schema
         self.bucket = bucket
+        self.incremental = incremental
+        self.cache = cache
+        self.retention = retention
+        self.list_processes = list_processes
+        self.key_source = key_source
+        self.compactor = None
+        self.validator = None
+        self.slices = slices
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.manifest_count = 1
+        self.manifest_codecs = [None]
 
         if isinstance(db_connection, Database):
             self.database = db_connection
@@ -81,11 +448,38 @@ class SqlManifest(object):
 
         self.file_name = '{0}_manifest.json'.format(schema.table)
         self.journal_file_name = '{0}_journal.db'.format(schema.table)
+        self.watermark_file_name = '{0}_watermark.json'.format(schema.table)
+        self.journal_filter_file_name = '{0}_journal.bloom'.format(
+            schema.table)
+        self.watermark = Watermark(
+            bucket, self.watermark_key, lookback,
+            retention if isinstance(retention, datetime.timedelta) else None)
+        self.journal_filter = JournalFilter(bucket, self.journal_filter_key,
+                                            false_positive_rate)
 
     @property
     def all_keys(self):
-        return (k.name for k in self.bucket.list(self.source) if
-                not k.name.endswith('/'))
+        return (k.name for k in self.listing)
+
+    @property
+    def listing(self):
+        marker = self.watermark.marker if self.incremental else ''
+        marker = max(marker, self.retention_key)
+        if self.key_source is not None:
+            keys = self.key_source.keys(self.source, marker)
+        elif self.list_processes is None:
+            keys = self.bucket.list_keys(self.source, marker=marker)
+        else:
+            keys = self.bucket.list_parallel(self.source, marker=marker,
+                                             processes=self.list_processes)
+        return (k for k in keys if not k.name.endswith('/'))
+
+    @property
+    def retention_key(self):
+        if isinstance(self.retention, datetime.timedelta):
+            return self.watermark.marker_before(self.retention)
+        else:
+            return self.retention or ''
 
     @property
     def manifest_key(self):
@@ -96,86 +490,430 @@ class SqlManifest(object):
         return normalize_path(
             '{0}/{1}'.format(self.metadata, self.journal_file_name))
 
+    @property
+    def watermark_key(self):
+        return normalize_path(
+            '{0}/{1}'.format(self.metadata, self.watermark_file_name))
+
+    @property
+    def journal_filter_key(self):
+        return normalize_path(
+            '{0}/{1}'.format(self.metadata, self.journal_filter_file_name))
+
+    @property
+    def manifest_keys(self):
+        return self.__manifest_keys(self.manifest_count)
+
     @property
     def manifest_url(self):
         return 's3://{0}{1}'.format(self.bucket.name, self.manifest_key)
 
+    @property
+    def manifest_urls(self):
+        return ['s3://{0}{1}'.format(self.bucket.name, key) for key in
+                self.manifest_keys]
+
+    def __manifest_keys(self, count):
+        return _manifest_keys(self.metadata, self.schema, self.manifest_key,
+                              count)
+
     def journal(self):
-        journal = self.bucket.get(self.journal_key)
-        if journal.exists():
-            journal.get_contents_to_filename(self.journal_file_name)
-            self.database.open()
-            self.database.execute('SELECT key FROM journal')
-            return (row[0] for row in self.database.fetchall())
+        if self.__download():
+            self.__open()
+            return self.__keys()
         else:
-            self.database.open()
-            self.database.execute(
-                'CREATE TABLE IF NOT EXISTS journal (key TEXT)')
-            self.database.commit()
-            self.database.close()
+            self.__open()
             return []
 
     def get(self):
-        updated_journal = self.all_keys
+        updated_journal = []
         journal = self.journal()
-        keys = list(set(updated_journal) - set(journal))
+        bloom_filter = self.journal_filter.get(
+            self.__keys, self.journal_identity()) if \
+            self.journal_filter.enabled else None
+        keys = difference(self.listing, journal, updated_journal,
+                          bloom_filter, operator.attrgetter('name'))
 
         return {
             'manifest': {
-                'entries': (
-                    {'url': 's3://{0}/{1}'.format(self.bucket.name, key),
-                     'mandatory': True} for key in keys
-                )
+                'entries': (_entry(self.bucket.name, key.name, key.size) for
+                            key in keys)
             },
             'updated_journal': updated_journal
         }
 
     def save(self):
-        entries = self.get()['manifest']['entries']
-        offset = 0
-        offsets = []
-        last_entry = None
-
-        with open(self.file_name, 'wb') as f:
-            f.seek(0)
-            f.truncate()
-            offset += self.__write(f, '{\n')
-            offsets.append(offset)
-            offset += self.__write(f, '"entries": [\n')
-            offsets.append(offset)
-
-            for entry in entries:
-                line = json.dumps(entry) + ',\n'
-                offset += self.__write(f, line)
-                offsets.append(offset)
-                last_entry = line
-            f.seek(offsets[-2])
-            f.truncate()
-            if last_entry is not None:
-                line = last_entry[0:-2] + '\n'
-                f.write(line)
-            f.write(']}')
-
-        self.bucket.get(self.manifest_key).set_contents_from_filename(
-            self.file_name)
+        manifest = self.get()
+        self.manifest_codecs = _save_manifests(
+            self.bucket, self.__manifest_keys,
+            _validated(self.validator, manifest['manifest']['entries']),
+            self.slices, self.max_bytes, self.max_files, self.compactor)
+        self.manifest_count = len(self.manifest_codecs)
+        return manifest['updated_journal']
 
     def commit(self, saved_keys):
+        previous_identity = self.journal_identity() if \
+            self.journal_filter.enabled else None
         self.database.open()
-        self.database.execute('DELETE FROM journal')
-        for key in saved_keys:
-            self.database.execute('INSERT INTO journal VALUES (?)', (key,))
+        self.database.executemany('INSERT OR IGNORE INTO journal VALUES (?)',
+                                  ((key,) for key in saved_keys))
         self.database.commit()
-        self.database.close()
-        self.bucket.get(self.journal_key).set_contents_from_filename(
-            self.journal_file_name)
+        self.__prune()
+        try:
+            bloom_filter = self.journal_filter.update(
+                saved_keys, self.__keys, previous_identity)
+        finally:
+            self.database.close()
+        etag = self.bucket.upload(self.journal_key, self.journal_file_name)
+        if bloom_filter is not None:
+            self.journal_filter.save(bloom_filter, _identity(etag))
+        if self.cache is not None:
+            with open(self.journal_file_name, 'rb') as journal:
+                self.cache.put(self.bucket.name, self.journal_key, etag,
+                               journal)
+        if self.incremental or self.watermark.retention is not None:
+            self.watermark.commit(saved_keys)
 
     def exists(self):
-        return self.bucket.get(self.manifest_key).exists()
+        return self.bucket.exists(self.manifest_key)
 
     def journal_exists(self):
-        return self.bucket.get(self.journal_key).exists()
+        return self.bucket.exists(self.journal_key)
 
-    @staticmethod
-    def __write(fd, line):
-        fd.write(line)
-        return len(line)
+    def journal_identity(self):
+        return _identity(self.bucket.etag(self.journal_key))
+
+    def __prune(self):
+        retention_key = self.retention_key
+        if retention_key:
+            self.database.execute('DELETE FROM journal WHERE key <= ?',
+                                  (retention_key,))
+            pruned = self.database.cursor.rowcount
+            self.database.commit()
+            if pruned > 0:
+                self.database.execute('VACUUM')
+
+    def __download(self):
+        journal = self.bucket.get(self.journal_key)
+        metadata = self.bucket.head(journal)
+        if metadata is None:
+            return False
+        elif self.cache is None:
+            journal.get_contents_to_filename(self.journal_file_name)
+            return True
+
+        cached = self.cache.fetch(journal, metadata.etag)
+        if cached is None:
+            return False
+        with cached:
+            with open(self.journal_file_name, 'wb') as f:
+                shutil.copyfileobj(cached, f)
+        return True
+
+    def __keys(self):
+        self.database.execute('SELECT key FROM journal ORDER BY key')
+        for row in self.database.fetchall():
+            yield row[0]
+
+    def __open(self):
+        self.database.open()
+        for pragma in SQL_JOURNAL_PRAGMAS:
+            self.database.execute(pragma)
+        self.database.execute('CREATE TABLE IF NOT EXISTS journal (key TEXT)')
+        self.database.execute(
+            'CREATE UNIQUE INDEX IF NOT EXISTS journal_key ON journal (key)')
+        self.database.commit()
+
+
+class RedshiftJournalManifest(object):
+    def __init__(self, metadata, source, schema, bucket, db_connection,
+                 aws_access_key_id, aws_secret_access_key, slices=None,
+                 max_bytes=None, max_files=None, key_source=None):
+        self.metadata = metadata
+        self.source = source
+        self.schema = schema
+        self.bucket = bucket
+        self.aws_access_key_id = aws_access_key_id
+        self.aws_secret_access_key = aws_secret_access_key
+
+        if isinstance(db_connection, Database):
+            self.database = db_connection
+        else:
+            self.database = Database(db_connection)
+
+        self.slices = slices
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.key_source = key_source
+        self.compactor = None
+        self.validator = None
+        self.manifest_count = 1
+        self.manifest_codecs = [None]
+        self.file_name = '{0}_manifest.json'.format(schema.table)
+        self.listing_file_name = '{0}_listing.csv'.format(schema.table)
+        self.journal_table = '{0}_journal'.format(schema.table)
+        self.listing_table = '{0}_listing'.format(schema.table)
+        self.__journal_exists = None
+
+    @property
+    def all_keys(self):
+        return (k.name for k in self.listing)
+
+    @property
+    def listing(self):
+        if self.key_source is not None:
+            keys = self.key_source.keys(self.source)
+        else:
+            keys = self.bucket.list_keys(self.source)
+        return (k for k in keys if not k.name.endswith('/'))
+
+    @property
+    def manifest_key(self):
+        return normalize_path('{0}/{1}'.format(self.metadata, self.file_name))
+
+    @property
+    def listing_key(self):
+        return normalize_path(
+            '{0}/{1}'.format(self.metadata, self.listing_file_name))
+
+    @property
+    def manifest_keys(self):
+        return self.__manifest_keys(self.manifest_count)
+
+    @property
+    def manifest_url(self):
+        return 's3://{0}{1}'.format(self.bucket.name, self.manifest_key)
+
+    @property
+    def manifest_urls(self):
+        return ['s3://{0}{1}'.format(self.bucket.name, key) for key in
+                self.manifest_keys]
+
+    def __manifest_keys(self, count):
+        return _manifest_keys(self.metadata, self.schema, self.manifest_key,
+                              count)
+
+    @property
+    def listing_url(self):
+        return 's3://{0}{1}'.format(self.bucket.name, self.listing_key)
+
+    @property
+    def copy_listing_sql(self):
+        return "COPY %s FROM '%s' " \
+               "CREDENTIALS 'aws_access_key_id=%s;" \
+               "aws_secret_access_key=%s' " \
+               "CSV"
+
+    def journal(self):
+        self.database.execute('SELECT key FROM %s ORDER BY key',
+                              (AsIs(self.journal_table),))
+        return (row[0] for row in self.database.fetchall())
+
+    def get(self):
+        self.stage()
+        self.database.execute('SELECT key, size FROM %s ORDER BY key',
+                              (AsIs(self.listing_table),))
+        keys = list(self.database.fetchall())
+
+        return {
+            'manifest': {
+                'entries': [_entry(self.bucket.name, key, size) for key, size
+                            in keys]
+            },
+            'updated_journal': [key for key, _ in keys]
+        }
+
+    def stage(self):
+        self.database.open()
+        self.journal_exists()
+        self.database.execute(
+            'CREATE TABLE IF NOT EXISTS %s (key VARCHAR(1024) NOT NULL) '
+            'DISTKEY (key) SORTKEY (key)', (AsIs(self.journal_table),))
+        self.database.execute(
+            'CREATE TEMP TABLE %s (key VARCHAR(1024) NOT NULL, size BIGINT) '
+            'DISTKEY (key) SORTKEY (key)', (AsIs(self.listing_table),))
+
+        with self.bucket.writer(self.listing_key) as listing:
+            writer = csv.writer(listing)
+            for key in self.listing:
+                writer.writerow([key.name.encode('utf-8') if isinstance(
+                    key.name, unicode) else key.name, key.size])
+
+        self.database.execute(self.copy_listing_sql, (
+            AsIs(self.listing_table), AsIs(self.listing_url),
+            AsIs(self.aws_access_key_id), AsIs(self.aws_secret_access_key)))
+        self.bucket.delete(self.listing_key)
+        self.database.execute(
+            'DELETE FROM %s USING %s WHERE %s.key = %s.key',
+            (AsIs(self.listing_table), AsIs(self.journal_table),
+             AsIs(self.listing_table), AsIs(self.journal_table)))
+
+    def save(self):
+        manifest = self.get()
+        self.manifest_codecs = _save_manifests(
+            self.bucket, self.__manifest_keys,
+            _validated(self.validator, manifest['manifest']['entries']),
+            self.slices, self.max_bytes, self.max_files, self.compactor)
+        self.manifest_count = len(self.manifest_codecs)
+        return manifest['updated_journal']
+
+    def commit(self, saved_keys):
+        self.database.execute('INSERT INTO %s SELECT DISTINCT key FROM %s',
+                              (AsIs(self.journal_table),
+                               AsIs(self.listing_table)))
+        self.database.execute('DROP TABLE %s', (AsIs(self.listing_table),))
+        self.__journal_exists = None
+
+    def exists(self):
+        return self.bucket.exists(self.manifest_key)
+
+    def journal_exists(self):
+        if self.__journal_exists is None:
+            self.database.open()
+            self.database.execute(
+                "SELECT 1 FROM pg_tables WHERE tablename = '%s'",
+                (AsIs(self.journal_table),))
+            self.__journal_exists = self.database.cursor.fetchone() is not None
+        return self.__journal_exists
+
+
+def balance(entries, slices=None, max_bytes=None, max_files=None):
+    entries = sorted(entries, key=_content_length, reverse=True)
+    size = sum(_content_length(entry) for entry in entries)
+    count = max(1, _ceil(size, max_bytes), _ceil(len(entries), max_files))
+    batches = [(0, 0, i, []) for i in range(count)]
+    full = []
+
+    for entry in entries:
+        length = _content_length(entry)
+        if batches:
+            total, files, i, batch = heapq.heappop(batches)
+        else:
+            total, files, i, batch = 0, 0, count, []
+            count += 1
+        if batch and max_bytes and total + length > max_bytes:
+            heapq.heappush(batches, (total, files, i, batch))
+            total, files, i, batch = 0, 0, count, []
+            count += 1
+        batch.append(entry)
+        if max_files and files + 1 >= max_files:
+            full.append((total + length, files + 1, i, batch))
+        else:
+            heapq.heappush(batches, (total + length, files + 1, i, batch))
+
+    return [_interleave(batch, slices) for _, _, _, batch in
+            sorted(batches + full, key=operator.itemgetter(2)) if batch] or \
+        [[]]
+
+
+def _interleave(entries, slices):
+    if not slices or len(entries) <= slices:
+        return entries
+
+    bins = [(0, i, []) for i in range(slices)]
+    for entry in entries:
+        total, i, entries_bin = heapq.heappop(bins)
+        entries_bin.append(entry)
+        heapq.heappush(bins, (total + _content_length(entry), i,
+                              entries_bin))
+
+    bins = [entries_bin for _, _, entries_bin in
+            sorted(bins, key=operator.itemgetter(1))]
+    return [entries_bin[rank] for rank in
+            range(max(len(entries_bin) for entries_bin in bins)) for
+            entries_bin in bins if rank < len(entries_bin)]
+
+
+def _ceil(value, limit):
+    return -(-value // limit) if limit else 1
+
+
+def _content_length(entry):
+    return entry.get('meta', {}).get('content_length') or 0
+
+
+def _validated(validator, entries):
+    if validator is None:
+        return entries
+    entries = list(entries)
+    validator.validate(entries)
+    return entries
+
+
+def _identity(*parts):
+    return hashlib.md5(json.dumps(parts)).digest()
+
+
+def _entry(bucket_name, key, size):
+    entry = {'url': 's3://{0}/{1}'.format(bucket_name, key),
+             'mandatory': True}
+    if size is not None:
+        entry['meta'] = {'content_length': int(size)}
+    return entry
+
+
+def codec(key_name):
+    for suffix, name in CODECS:
+        if key_name.endswith(suffix):
+            return name
+    return None
+
+
+def _save_manifests(bucket, manifest_keys, entries, slices=None,
+                    max_bytes=None, max_files=None, compactor=None):
+    if compactor is not None:
+        entries = compactor.compact(entries)
+    if slices or max_bytes or max_files:
+        names = []
+        groups = {}
+        for entry in entries:
+            name = codec(entry['url'])
+            if name not in groups:
+                names.append(name)
+                groups[name] = []
+            groups[name].append(entry)
+        batches = [(name, batch) for name, group in
+                   ([(name, groups[name]) for name in names] or
+                    [(None, [])]) for batch in
+                   balance(group, slices, max_bytes, max_files)]
+        for key, (_, batch) in zip(manifest_keys(len(batches)), batches):
+            bucket.save(key, json.dumps({'entries': batch}))
+        return [name for name, _ in batches]
+
+    names = []
+    writers = {}
+    counts = {}
+    try:
+        for entry in entries:
+            name = codec(entry['url'])
+            if name not in writers:
+                writers[name] = _open_manifest(
+                    bucket, manifest_keys(len(writers) + 1)[-1])
+                names.append(name)
+                counts[name] = 0
+            writers[name].write(
+                (',\n' if counts[name] else '') + json.dumps(entry))
+            counts[name] += 1
+        if not writers:
+            writers[None] = _open_manifest(bucket, manifest_keys(1)[0])
+            names.append(None)
+        for name in names:
+            writers[name].write('\n]}')
+            writers[name].close()
+    except:
+        for writer in writers.values():
+            writer.abort()
+        raise
+    return names
+
+
+def _open_manifest(bucket, key):
+    writer = bucket.writer(key)
+    writer.write('{\n"entries": [\n')
+    return writer
+
+
+def _manifest_keys(metadata, schema, manifest_key, count):
+    return [manifest_key] + [normalize_path('{0}/{1}'.format(
+        metadata, MANIFEST_FILE_NAME_FORMAT.format(schema.table, i))) for i in
+        range(1, count)]
@@ -1,6 +1,9 @@
 import json
+import logging
 from arbalest.s3 import normalize_path
 
+_logger = logging.getLogger(__name__)
+
 
 class S3JsonStepRunner(object):
     def __init__(self, metadata, schema, bucket, table):
@@ -8,6 +11,7 @@ class S3JsonStepRunner(object):
         self.bucket = bucket
         self.table = table
         self.schema = schema
+        self.artifacts = []
 
     @property
     def schema_key(self):
@@ -18,14 +22,26 @@ class S3JsonStepRunner(object):
     def schema_url(self):
         return 's3://{0}{1}'.format(self.bucket.name, self.schema_key)
 
+    @property
+    def compaction_prefix(self):
+        return normalize_path('{0}/{1}_compacted'.format(
+            self.metadata, self.schema.table))
+
     def stage(self):
         self.bucket.save(self.schema_key, json.dumps(self.schema.paths()))
         self.table.database.open()
 
     def commit(self):
         self.table.database.commit()
-        self.bucket.delete(self.schema_key)
+        self.cleanup()
 
     def rollback(self):
         self.table.database.rollback()
-        self.bucket.delete(self.schema_key)
+        self.cleanup()
+
+    def cleanup(self):
+        errors = self.bucket.delete_many([self.schema_key] + self.artifacts)
+        for error in errors:
+            _logger.warning('Could not delete %s: %s %s', error.key,
+                            error.code, error.message)
+        self.artifacts = []
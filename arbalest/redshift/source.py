@@ -0,0 +1,366 @@
+import collections
+import csv
+import itertools
+import json
+import os
+import tempfile
+import threading
+import urllib
+import zlib
+from multiprocessing.pool import ThreadPool
+from boto.sqs.message import RawMessage
+from arbalest.core import PipelineException
+from arbalest.redshift.journal import sort, SORT_BUFFER_SIZE
+from arbalest.s3 import ListedKey
+
+INVENTORY_PROCESSES = 8
+INVENTORY_CHUNK_SIZE = 1024 * 1024
+INVENTORY_MANIFEST_FILE_NAME = 'manifest.json'
+NOTIFICATION_BATCH_SIZE = 10
+NOTIFICATION_MAX_MESSAGES = 100000
+SQS_WAIT_TIME_SECONDS = 1
+
+
+class InventoryKeySource(object):
+    def __init__(self, bucket, inventory_bucket, inventory_prefix,
+                 processes=INVENTORY_PROCESSES,
+                 buffer_size=SORT_BUFFER_SIZE, directory=None):
+        self.bucket = bucket
+        self.inventory_bucket = inventory_bucket
+        self.inventory_prefix = inventory_prefix
+        self.processes = processes
+        self.buffer_size = buffer_size
+        self.directory = directory
+        self.__manifest = None
+
+    @property
+    def manifest_key(self):
+        manifest_keys = [key.name for key in
+                         self.inventory_bucket.list_keys(
+                             self.inventory_prefix) if
+                         key.name.endswith('/' + INVENTORY_MANIFEST_FILE_NAME)]
+        if not manifest_keys:
+            raise PipelineException('No inventory manifest in {0}'.format(
+                self.inventory_prefix))
+        return max(manifest_keys)
+
+    @property
+    def manifest(self):
+        if self.__manifest is None:
+            manifest = json.loads(self.inventory_bucket.get(
+                self.manifest_key).get_contents_as_string())
+            if manifest['fileFormat'] != 'CSV':
+                raise PipelineException(
+                    'Unsupported inventory format: {0}'.format(
+                        manifest['fileFormat']))
+            self.__manifest = manifest
+        return self.__manifest
+
+    def keys(self, prefix='', marker=''):
+        last = marker
+        for item in sort(self.__inventory(prefix, marker), self.buffer_size,
+                         self.directory):
+            key = ListedKey(*item)
+            if key.name != last:
+                last = key.name
+                yield key
+
+        for key in self.bucket.list_keys(prefix, marker=last):
+            yield key
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def __inventory(self, prefix, marker):
+        columns = [column.strip() for column in
+                   self.manifest['fileSchema'].split(',')]
+        pool = ThreadPool(self.processes)
+        pending = collections.deque()
+        try:
+            for data_file in self.manifest['files']:
+                pending.append(pool.apply_async(_read_inventory_file, [(
+                    self.inventory_bucket, data_file['key'], columns, prefix,
+                    marker)]))
+                while len(pending) > self.processes:
+                    for key in pending.popleft().get():
+                        yield key
+            while pending:
+                for key in pending.popleft().get():
+                    yield key
+        finally:
+            pool.terminate()
+            pool.join()
+
+
+class NotificationKeySource(object):
+    def __init__(self, queue, bucket_name=None,
+                 batch_size=NOTIFICATION_BATCH_SIZE,
+                 max_messages=NOTIFICATION_MAX_MESSAGES):
+        self.queue = queue
+        self.bucket_name = bucket_name
+        self.batch_size = batch_size
+        self.max_messages = max_messages
+        self.__buffer = None
+        self.__receipts = []
+        self.__prefixes = []
+        self.__covered = set()
+
+    def keys(self, prefix='', marker=''):
+        if self.__buffer is None:
+            self.__buffer = self.__receive()
+        self.__prefixes.append(prefix)
+        for name, key in sorted(self.__buffer.items()):
+            if name.startswith(prefix):
+                self.__covered.add(name)
+                if name > marker:
+                    yield key
+
+    def commit(self):
+        acknowledged = []
+        released = []
+        for receipt, names in self.__receipts:
+            if all(self.__done(name) for name in names):
+                acknowledged.append(receipt)
+            else:
+                released.append(receipt)
+        if acknowledged:
+            self.queue.acknowledge(acknowledged)
+        if released:
+            self.queue.release(released)
+        self.__reset()
+
+    def rollback(self):
+        if self.__receipts:
+            self.queue.release([receipt for receipt, _ in self.__receipts])
+        self.__reset()
+
+    def __reset(self):
+        self.__buffer = None
+        self.__receipts = []
+        self.__prefixes = []
+        self.__covered = set()
+
+    def __done(self, name):
+        if name in self.__covered:
+            return True
+        return getattr(self.queue, 'exclusive', False) and not any(
+            name.startswith(prefix) for prefix in self.__prefixes)
+
+    def __receive(self):
+        buffer = {}
+        while len(self.__receipts) < self.max_messages:
+            messages = self.queue.receive(min(
+                self.batch_size, self.max_messages - len(self.__receipts)))
+            if not messages:
+                break
+            for receipt, body in messages:
+                names = []
+                for bucket_name, key in _created_keys(body):
+                    if self.bucket_name is not None and \
+                            bucket_name != self.bucket_name:
+                        continue
+                    names.append(key.name)
+                    if key.name not in buffer or \
+                            buffer[key.name].last_modified <= \
+                            key.last_modified:
+                        buffer[key.name] = key
+                self.__receipts.append((receipt, names))
+        return buffer
+
+
+class MemoryQueue(object):
+    exclusive = False
+
+    def __init__(self, messages=None):
+        self.messages = {}
+        self.__receipts = []
+        self.__ids = itertools.count()
+        self.__in_flight = set()
+        self.__lock = threading.Lock()
+        for body in messages or []:
+            self.send(body)
+
+    def send(self, body):
+        with self.__lock:
+            receipt = next(self.__ids)
+            self.messages[receipt] = body
+            self.__receipts.append(receipt)
+
+    def receive(self, max_messages):
+        with self.__lock:
+            messages = list(itertools.islice(
+                ((receipt, self.messages[receipt]) for receipt in
+                 self.__receipts if receipt in self.messages and
+                 receipt not in self.__in_flight), max_messages))
+            self.__in_flight.update(receipt for receipt, _ in messages)
+            return messages
+
+    def acknowledge(self, receipts):
+        with self.__lock:
+            for receipt in receipts:
+                self.messages.pop(receipt, None)
+                self.__in_flight.discard(receipt)
+            self.__receipts = [receipt for receipt in self.__receipts if
+                               receipt in self.messages]
+
+    def release(self, receipts):
+        with self.__lock:
+            self.__in_flight.difference_update(receipts)
+
+
+class FileQueue(object):
+    exclusive = True
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.offset_file_name = file_name + '.offset'
+        self.__position = None
+        self.__pending = collections.deque()
+        self.__acknowledged = set()
+
+    @property
+    def offset(self):
+        try:
+            with open(self.offset_file_name) as f:
+                return int(f.read())
+        except IOError:
+            return 0
+
+    def send(self, body):
+        with open(self.file_name, 'a') as f:
+            f.write(body.replace('\n', ' ') + '\n')
+
+    def receive(self, max_messages):
+        if self.__position is None:
+            self.__position = self.offset
+        messages = []
+        try:
+            f = open(self.file_name, 'rb')
+        except IOError:
+            return messages
+        with f:
+            f.seek(self.__position)
+            while len(messages) < max_messages:
+                line = f.readline()
+                if not line.endswith('\n'):
+                    break
+                self.__position += len(line)
+                if line.strip():
+                    messages.append((self.__position, line))
+        self.__pending.extend(receipt for receipt, _ in messages)
+        return messages
+
+    def acknowledge(self, receipts):
+        self.__acknowledged.update(receipts)
+        offset = None
+        while self.__pending and self.__pending[0] in self.__acknowledged:
+            offset = self.__pending.popleft()
+            self.__acknowledged.discard(offset)
+        if offset is None:
+            return
+        fd, offset_file_name = tempfile.mkstemp(
+            prefix='.', dir=os.path.dirname(os.path.abspath(self.file_name)))
+        with os.fdopen(fd, 'w') as f:
+            f.write(str(offset))
+        os.rename(offset_file_name, self.offset_file_name)
+
+    def release(self, receipts):
+        self.__position = None
+        self.__pending.clear()
+        self.__acknowledged.clear()
+
+
+class SqsQueue(object):
+    exclusive = False
+
+    def __init__(self, queue, wait_time_seconds=SQS_WAIT_TIME_SECONDS,
+                 visibility_timeout=None):
+        self.queue = queue
+        self.queue.set_message_class(RawMessage)
+        self.wait_time_seconds = wait_time_seconds
+        self.visibility_timeout = visibility_timeout
+
+    def receive(self, max_messages):
+        return [(message, message.get_body()) for message in
+                self.queue.get_messages(
+                    num_messages=min(max_messages, NOTIFICATION_BATCH_SIZE),
+                    visibility_timeout=self.visibility_timeout,
+                    wait_time_seconds=self.wait_time_seconds)]
+
+    def acknowledge(self, receipts):
+        for i in range(0, len(receipts), NOTIFICATION_BATCH_SIZE):
+            self.queue.delete_message_batch(
+                receipts[i:i + NOTIFICATION_BATCH_SIZE])
+
+    def release(self, receipts):
+        for i in range(0, len(receipts), NOTIFICATION_BATCH_SIZE):
+            self.queue.change_message_visibility_batch(
+                [(message, 0) for message in
+                 receipts[i:i + NOTIFICATION_BATCH_SIZE]])
+
+
+def _created_keys(body):
+    event = json.loads(body)
+    if 'Records' not in event and 'Message' in event:
+        event = json.loads(event['Message'])
+    for record in event.get('Records', []):
+        if not record.get('eventName', '').startswith('ObjectCreated:'):
+            continue
+        bucket = record['s3']['bucket']
+        s3_object = record['s3']['object']
+        yield bucket['name'], ListedKey(
+            urllib.unquote_plus(s3_object['key'].encode('utf-8')).decode(
+                'utf-8'),
+            s3_object.get('size'), s3_object.get('eTag'),
+            record.get('eventTime'))
+
+
+def _read_inventory_file(data_file):
+    bucket, key_name, columns, prefix, marker = data_file
+    key = bucket.get(key_name)
+    position = dict((column, i) for i, column in enumerate(columns))
+    keys = []
+    try:
+        for row in csv.reader(_lines(_gunzip(key))):
+            if row[position['Key']] == '' or \
+                    _column(row, position, 'IsLatest') == 'false' or \
+                    _column(row, position, 'IsDeleteMarker') == 'true':
+                continue
+            name = urllib.unquote_plus(row[position['Key']]).decode('utf-8')
+            if name.startswith(prefix) and name > marker:
+                size = _column(row, position, 'Size')
+                keys.append(ListedKey(
+                    name, int(size) if size else None,
+                    _column(row, position, 'ETag'),
+                    _column(row, position, 'LastModifiedDate')))
+    finally:
+        key.close()
+    return keys
+
+
+def _column(row, position, column):
+    return row[position[column]] if column in position else None
+
+
+def _gunzip(fileobj):
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    while True:
+        chunk = fileobj.read(INVENTORY_CHUNK_SIZE)
+        if not chunk:
+            break
+        yield decompressor.decompress(chunk)
+    yield decompressor.flush()
+
+
+def _lines(chunks):
+    remainder = ''
+    for chunk in chunks:
+        lines = (remainder + chunk).split('\n')
+        remainder = lines.pop()
+        for line in lines:
+            yield line + '\n'
+    if remainder:
+        yield remainder
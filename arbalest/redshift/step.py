@@ -1,6 +1,6 @@
 from psycopg2.extensions import AsIs
 from arbalest.core import PipelineStep
-from arbalest.redshift.manifest import Manifest
+from arbalest.redshift.manifest import Manifest, _entry
 from arbalest.redshift.runner import S3JsonStepRunner
 from arbalest.s3 import normalize_path
 
@@ -18,6 +18,9 @@ class BulkCopyFromS3JsonStep(PipelineStep):
         self.runner = S3JsonStepRunner(metadata, schema, bucket, table)
         self.sql = SqlStep(table.database)
         self.max_error_count = 1
+        self.compression = None
+        self.compactor = None
+        self.validator = None
 
     @property
     def source_key(self):
@@ -29,14 +32,36 @@ class BulkCopyFromS3JsonStep(PipelineStep):
 
     @property
     def source_url(self):
+        if self.compactor is not None:
+            return self.compactor.parts_url
         return 's3://{0}/{1}'.format(self.bucket.name, self.source_key)
 
+    @property
+    def compaction_prefix(self):
+        return self.runner.compaction_prefix
+
     @property
     def schema_url(self):
         return self.runner.schema_url
 
+    @property
+    def staging_format(self):
+        return None if self.compactor is None else self.compactor.format
+
     @property
     def copy_sql(self):
+        if self.staging_format == 'PARQUET':
+            return "COPY %s FROM '%s' " \
+                   "CREDENTIALS " \
+                   "'aws_access_key_id=%s;aws_secret_access_key=%s' " \
+                   "FORMAT AS PARQUET"
+        elif self.staging_format == 'CSV':
+            return "COPY %s FROM '%s' " \
+                   "CREDENTIALS " \
+                   "'aws_access_key_id=%s;aws_secret_access_key=%s' " \
+                   "CSV NULL AS '\\\\N' " \
+                   "TIMEFORMAT 'auto' " \
+                   "MAXERROR %s"
         return "COPY %s FROM '%s' " \
                "CREDENTIALS 'aws_access_key_id=%s;aws_secret_access_key=%s' " \
                "JSON '%s' " \
@@ -49,22 +74,41 @@ class BulkCopyFromS3JsonStep(PipelineStep):
 
     def run(self):
         self.runner.stage()
+        self.__compact()
         self.__execute(self.copy_sql)
         self.__promote()
         self.runner.commit()
 
     def validate(self):
+        if self.validator is not None:
+            self.validator.validate(
+                _entry(self.bucket.name, key.name, key.size) for key in
+                self.bucket.list_keys(self.source_key))
         self.runner.stage()
+        self.__compact()
         self.__execute(self.validate_sql)
         self.__promote()
         self.runner.rollback()
 
     def __execute(self, sql):
+        compression = self.compression if self.compactor is None else \
+            self.compactor.codec
         self.table.stage_update()
         self.sql.execute((
-            sql, self.schema.update_table, self.source_url,
+            _compressed(sql, compression), self.schema.update_table,
+            self.source_url,
             self.aws_access_key_id,
-            self.aws_secret_access_key, self.schema_url, self.max_error_count))
+            self.aws_secret_access_key) + _format_params(
+            self.staging_format, self.schema_url, self.max_error_count))
+
+    def __compact(self):
+        if self.compactor is not None:
+            try:
+                list(self.compactor.compact(
+                    _entry(self.bucket.name, key.name, key.size) for key in
+                    self.bucket.list_keys(self.source_key)))
+            finally:
+                self.runner.artifacts.extend(self.compactor.parts)
 
     def __promote(self):
         if self.table.exists():
@@ -86,6 +130,8 @@ class ManifestCopyFromS3JsonStep(PipelineStep):
         self.manifest = Manifest(metadata, source, schema, bucket)
         self.sql = SqlStep(table.database)
         self.max_error_count = 1
+        self.compactor = None
+        self.validator = None
 
     @property
     def schema_key(self):
@@ -95,8 +141,30 @@ class ManifestCopyFromS3JsonStep(PipelineStep):
     def schema_url(self):
         return self.runner.schema_url
 
+    @property
+    def compaction_prefix(self):
+        return self.runner.compaction_prefix
+
+    @property
+    def staging_format(self):
+        return None if self.compactor is None else self.compactor.format
+
     @property
     def copy_sql(self):
+        if self.staging_format == 'PARQUET':
+            return "COPY %s FROM '%s' " \
+                   "CREDENTIALS 'aws_access_key_id=%s;" \
+                   "aws_secret_access_key=%s' " \
+                   "FORMAT AS PARQUET " \
+                   "MANIFEST"
+        elif self.staging_format == 'CSV':
+            return "COPY %s FROM '%s' " \
+                   "CREDENTIALS 'aws_access_key_id=%s;" \
+                   "aws_secret_access_key=%s' " \
+                   "CSV NULL AS '\\\\N' " \
+                   "TIMEFORMAT 'auto' " \
+                   "MANIFEST " \
+                   "MAXERROR %s"
         return "COPY %s FROM '%s' " \
                "CREDENTIALS 'aws_access_key_id=%s;" \
                "aws_secret_access_key=%s' " \
@@ -111,16 +179,30 @@ class ManifestCopyFromS3JsonStep(PipelineStep):
 
     def run(self):
         self.runner.stage()
-        updated_journal = self.manifest.save()
+        updated_journal = self.__save()
         self.__execute(self.copy_sql)
         self.manifest.commit(updated_journal)
         self.runner.commit()
+        if self.manifest.key_source is not None:
+            self.manifest.key_source.commit()
 
     def validate(self):
         self.runner.stage()
-        self.manifest.save()
+        self.__save(self.validator)
         self.__execute(self.validate_sql)
         self.runner.rollback()
+        if self.manifest.key_source is not None:
+            self.manifest.key_source.rollback()
+
+    def __save(self, validator=None):
+        self.manifest.validator = validator
+        if self.compactor is None:
+            return self.manifest.save()
+        self.manifest.compactor = self.compactor
+        try:
+            return self.manifest.save()
+        finally:
+            self.runner.artifacts.extend(self.compactor.parts)
 
     def __execute(self, sql):
         if self.table.exists() and not self.manifest.journal_exists():
@@ -128,10 +210,13 @@ class ManifestCopyFromS3JsonStep(PipelineStep):
             self.table.create()
         elif not self.table.exists():
             self.table.create()
-        self.sql.execute((sql, self.schema.table, self.manifest.manifest_url,
-                          self.aws_access_key_id, self.aws_secret_access_key,
-                          self.schema_url,
-                          self.max_error_count))
+        for manifest_url, codec in zip(self.manifest.manifest_urls,
+                                       self.manifest.manifest_codecs):
+            self.sql.execute((_compressed(sql, codec), self.schema.table,
+                              manifest_url,
+                              self.aws_access_key_id,
+                              self.aws_secret_access_key) + _format_params(
+                self.staging_format, self.schema_url, self.max_error_count))
 
 
 class SqlStep(PipelineStep):
@@ -163,3 +248,15 @@ class SqlStep(PipelineStep):
             query = statement[0]
             params = statement[1:]
             self.database.execute(query, tuple([AsIs(x) for x in params]))
+
+
+def _format_params(staging_format, schema_url, max_error_count):
+    if staging_format is None:
+        return schema_url, max_error_count
+    elif staging_format == 'CSV':
+        return max_error_count,
+    return ()
+
+
+def _compressed(sql, codec):
+    return sql if codec is None else '{0} {1}'.format(sql, codec)
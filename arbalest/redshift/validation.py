@@ -0,0 +1,133 @@
+import collections
+import itertools
+import multiprocessing
+import zlib
+from multiprocessing.pool import ThreadPool
+from arbalest.core import PipelineException
+from arbalest.redshift.compaction import column_kind, convert, \
+    _batches, _decompress, _download, _json_objects, _key_name, _project, \
+    COMPACTION_PROCESSES
+
+VALIDATION_BATCH_SIZE = 16 * 1024 * 1024
+VALIDATION_BATCH_FILES = 1000
+VALIDATION_MAX_ERRORS = 100
+INTEGER_RANGES = {'int16': (-2 ** 15, 2 ** 15 - 1),
+                  'int32': (-2 ** 31, 2 ** 31 - 1),
+                  'int64': (-2 ** 63, 2 ** 63 - 1)}
+
+
+class ValidationError(collections.namedtuple(
+        'ValidationError', ['key', 'line', 'column', 'message'])):
+    def __str__(self):
+        location = self.key if self.line is None else '{0}:{1}'.format(
+            self.key, self.line)
+        if self.column is None:
+            return '{0}: {1}'.format(location, self.message)
+        return '{0}: {1}: {2}'.format(location, self.column, self.message)
+
+
+class LocalValidator(object):
+    def __init__(self, bucket, schema, processes=None,
+                 download_processes=COMPACTION_PROCESSES,
+                 batch_size=VALIDATION_BATCH_SIZE,
+                 batch_files=VALIDATION_BATCH_FILES,
+                 max_errors=VALIDATION_MAX_ERRORS):
+        self.bucket = bucket
+        self.columns = [(schema_property.column_name, schema_property.keys,
+                         _checked_kind(schema_property.type)) for
+                        schema_property in schema.schema]
+        self.processes = processes or multiprocessing.cpu_count()
+        self.download_processes = download_processes
+        self.batch_size = batch_size
+        self.batch_files = batch_files
+        self.max_errors = max_errors
+        self.__pool = None
+
+    def errors(self, entries):
+        self.__pool = multiprocessing.Pool(self.processes)
+        downloads = ThreadPool(self.download_processes)
+        pending = collections.deque()
+        try:
+            for batch in _batches(entries, self.batch_size,
+                                  self.batch_files):
+                pending.append(downloads.apply_async(self.__check, [batch]))
+                while len(pending) > self.download_processes:
+                    for error in pending.popleft().get():
+                        yield ValidationError(*error)
+            while pending:
+                for error in pending.popleft().get():
+                    yield ValidationError(*error)
+        finally:
+            downloads.terminate()
+            downloads.join()
+            self.__pool.terminate()
+            self.__pool.join()
+            self.__pool = None
+
+    def validate(self, entries):
+        errors = list(itertools.islice(self.errors(entries),
+                                       self.max_errors + 1))
+        if errors:
+            raise PipelineException('Invalid source objects{0}:\n{1}'.format(
+                ' (first {0} errors)'.format(self.max_errors) if
+                len(errors) > self.max_errors else '',
+                '\n'.join(str(error) for error in
+                          errors[:self.max_errors])))
+
+    def __check(self, entries):
+        contents = [(name, _download(self.bucket, name)) for name in
+                    (_key_name(self.bucket, entry['url']) for entry in
+                     entries)]
+        return self.__pool.apply(_validate_batch, [(self.columns, contents)])
+
+
+def _validate_batch(batch):
+    columns, contents = batch
+    errors = []
+    for name, data in contents:
+        try:
+            for line, json_object in _json_objects(_decompress(name, data)):
+                if not isinstance(json_object, dict):
+                    errors.append((name, line, None, 'Not a JSON object'))
+                    continue
+                for column_name, keys, kind in columns:
+                    message = check(kind, _project(json_object, keys))
+                    if message is not None:
+                        errors.append((name, line, column_name, message))
+        except (PipelineException, IOError, ValueError, zlib.error), e:
+            errors.append((name, None, None, str(e)))
+    return errors
+
+
+def check(kind, value):
+    if kind is None:
+        return None
+    name, precision, scale = kind
+    try:
+        value = convert(kind, value)
+    except (ArithmeticError, TypeError, ValueError), e:
+        return str(e)
+
+    if value is None:
+        return None
+    elif name == 'string':
+        length = len(value.encode('utf-8'))
+        if length > precision:
+            return 'Length of {0} bytes exceeds {1}'.format(length,
+                                                           precision)
+    elif name in INTEGER_RANGES:
+        low, high = INTEGER_RANGES[name]
+        if not low <= value <= high:
+            return 'Out of range for {0}: {1}'.format(name, value)
+    elif name == 'decimal':
+        if value and value.adjusted() + 1 > precision - scale:
+            return 'Exceeds DECIMAL({0}, {1}): {2}'.format(precision, scale,
+                                                          value)
+    return None
+
+
+def _checked_kind(column_type):
+    try:
+        return column_kind(column_type)
+    except PipelineException:
+        return None
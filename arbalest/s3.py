@@ -1,29 +1,206 @@
+import collections
+import errno
+import hashlib
+import heapq
+import itertools
+import os
 import posixpath
+import Queue
+import random
+import shutil
+import tempfile
+import threading
+import time
+import urllib
+from StringIO import StringIO
+from multiprocessing.pool import ThreadPool
+from xml.etree import cElementTree
+from boto.exception import S3ResponseError
 from boto.s3.connection import S3Connection
 from boto.s3.key import Key
+from boto.s3.prefix import Prefix
+
+MULTIPART_PART_SIZE = 16 * 1024 * 1024
+MULTIPART_PROCESSES = 8
+CACHE_SIZE = 1024 * 1024 * 1024
+LIST_PROCESSES = 8
+DELETE_BATCH_SIZE = 1000
+MAX_CONNECTIONS = 32
+MAX_PENDING = 1024
+LIST_PREFETCH_SIZE = 1000
+RETRY_ATTEMPTS = 8
+RETRY_BASE_DELAY = 0.05
+RETRY_MAX_DELAY = 20
+THROTTLE_ERROR_CODES = ['SlowDown', 'RequestLimitExceeded', 'Throttling']
+LIST_NAMESPACE = '{http://s3.amazonaws.com/doc/2006-03-01/}'
+LIST_PAGE_SIZE = 1000
+LOCAL_KEY_SUFFIX = '$'
+
+ListedKey = collections.namedtuple('ListedKey',
+                                   ['name', 'size', 'etag', 'last_modified'])
 
 
 def normalize_path(path):
     return posixpath.normpath(path)
 
 
+_connections = {}
+_limiters = {}
+_connections_lock = threading.Lock()
+
+
+def connect(aws_access_key_id, aws_secret_access_key, host=None,
+            max_connections=MAX_CONNECTIONS):
+    pool_key = (aws_access_key_id, aws_secret_access_key, host)
+    limiter_key = pool_key + (max_connections,)
+    with _connections_lock:
+        if pool_key not in _connections:
+            if host is None:
+                _connections[pool_key] = S3Connection(aws_access_key_id,
+                                                      aws_secret_access_key)
+            else:
+                _connections[pool_key] = S3Connection(
+                    aws_access_key_id, aws_secret_access_key, host=host)
+        if limiter_key not in _limiters:
+            _limiters[limiter_key] = ConcurrencyLimiter(max_connections)
+        return _connections[pool_key], _limiters[limiter_key]
+
+
+class ConcurrencyLimiter(object):
+    def __init__(self, maximum=MAX_CONNECTIONS, minimum=1):
+        self.maximum = maximum
+        self.minimum = minimum
+        self.limit = maximum
+        self.active = 0
+        self.__successes = 0
+        self.__condition = threading.Condition()
+
+    def acquire(self):
+        with self.__condition:
+            while self.active >= self.limit:
+                self.__condition.wait()
+            self.active += 1
+
+    def release(self, throttled=False):
+        with self.__condition:
+            self.active -= 1
+            if throttled:
+                self.limit = max(self.minimum, self.limit // 2)
+                self.__successes = 0
+            else:
+                self.__successes += 1
+                if self.__successes >= self.limit and \
+                        self.limit < self.maximum:
+                    self.limit += 1
+                    self.__successes = 0
+            self.__condition.notify_all()
+
+    def request(self, function, *args, **kwargs):
+        attempt = 0
+        while True:
+            self.acquire()
+            try:
+                result = function(*args, **kwargs)
+            except S3ResponseError, e:
+                throttled = is_throttled(e)
+                self.release(throttled)
+                if not throttled or attempt >= RETRY_ATTEMPTS:
+                    raise
+                time.sleep(random.uniform(0, min(
+                    RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt)))
+                attempt += 1
+            except:
+                self.release()
+                raise
+            else:
+                self.release()
+                return result
+
+
+def is_throttled(error):
+    return error.status == 503 or error.error_code in THROTTLE_ERROR_CODES
+
+
 class Bucket(object):
     def __init__(self, aws_access_key_id, aws_secret_access_key, name,
-                 s3_connection=None):
+                 s3_connection=None, limiter=None, metadata_cache=None,
+                 host=None, max_connections=MAX_CONNECTIONS):
         self.name = name
+        self.metadata_cache = metadata_cache
         if s3_connection is None:
-            self.connection = S3Connection(aws_access_key_id,
-                                           aws_secret_access_key)
+            self.connection, self.limiter = connect(
+                aws_access_key_id, aws_secret_access_key, host,
+                max_connections)
         else:
             self.connection = s3_connection
+            self.limiter = ConcurrencyLimiter(max_connections)
+        if limiter is not None:
+            self.limiter = limiter
 
         self.bucket = self.connection.get_bucket(name)
 
     def save(self, key, contents):
-        self.get(key).set_contents_from_string(contents)
+        key = self.get(key)
+        self.invalidate([key])
+        if hasattr(contents, 'read'):
+            self.limiter.request(key.set_contents_from_file, contents,
+                                 rewind=True)
+        else:
+            self.limiter.request(key.set_contents_from_string, contents)
+        return key.etag
+
+    def upload(self, key, file_name, part_size=MULTIPART_PART_SIZE,
+               processes=MULTIPART_PROCESSES):
+        size = os.path.getsize(file_name)
+        self.invalidate([key])
+        if size <= part_size:
+            key = self.get(key)
+            self.limiter.request(key.set_contents_from_filename, file_name)
+            return key.etag
+
+        multipart_upload = self.limiter.request(
+            self.bucket.initiate_multipart_upload, key)
+        parts = [(multipart_upload, file_name, part_number + 1, offset,
+                  min(part_size, size - offset)) for part_number, offset in
+                 enumerate(range(0, size, part_size))]
+        pool = ThreadPool(processes)
+        try:
+            pool.map(lambda part: self.limiter.request(_upload_part, part),
+                     parts)
+            return self.limiter.request(multipart_upload.complete_upload).etag
+        except:
+            multipart_upload.cancel_upload()
+            raise
+        finally:
+            pool.close()
+            pool.join()
 
     def delete(self, key):
-        self.get(key).delete()
+        key = self.get(key)
+        self.invalidate([key])
+        self.limiter.request(key.delete)
+
+    def delete_many(self, keys):
+        keys = iter(keys)
+        errors = []
+        while True:
+            batch = [key.name if isinstance(key, Key) else key for key in
+                     itertools.islice(keys, DELETE_BATCH_SIZE)]
+            if not batch:
+                return errors
+            self.invalidate(batch)
+            result = self.limiter.request(self.bucket.delete_keys, batch,
+                                          quiet=True)
+            errors.extend(result.errors)
+
+    def writer(self, key, part_size=MULTIPART_PART_SIZE,
+               processes=MULTIPART_PROCESSES):
+        return MultipartWriter(self, key, part_size, processes)
+
+    def invalidate(self, keys):
+        if self.metadata_cache is not None:
+            self.metadata_cache.invalidate(self.name, [
+                key.name if isinstance(key, Key) else key for key in keys])
 
     def get(self, key):
         if isinstance(key, Key):
@@ -31,7 +208,717 @@ class Bucket(object):
         else:
             return Key(self.bucket, key)
 
+    def head(self, key):
+        name = key.name if isinstance(key, Key) else key
+        if self.metadata_cache is not None:
+            try:
+                return self.metadata_cache.get(self.name, name)
+            except KeyError:
+                pass
+
+        key = self.limiter.request(self.bucket.get_key, name)
+        metadata = None if key is None else ListedKey(
+            key.name, key.size, key.etag, key.last_modified)
+        if self.metadata_cache is not None:
+            self.metadata_cache.put(self.name, name, metadata)
+        return metadata
+
+    def exists(self, key):
+        return self.head(key) is not None
+
+    def size(self, key):
+        metadata = self.head(key)
+        return None if metadata is None else metadata.size
+
+    def etag(self, key):
+        metadata = self.head(key)
+        return None if metadata is None else metadata.etag
+
     def list(self, prefix='', delimiter='', marker='', headers=None,
              encoding_type=None):
         return self.bucket.list(prefix, delimiter, marker, headers,
                                 encoding_type)
+
+    def list_keys(self, prefix='', marker='', page_size=None):
+        truncated = True
+        while truncated:
+            query = [('prefix', prefix), ('marker', marker)]
+            if page_size is not None:
+                query.append(('max-keys', page_size))
+            response = self.limiter.request(self.__list_page, '&'.join(
+                '{0}={1}'.format(name, _quote(value)) for name, value in
+                query))
+
+            truncated = False
+            for event, element in cElementTree.iterparse(response):
+                tag = element.tag
+                if tag == LIST_NAMESPACE + 'Contents':
+                    key = ListedKey(
+                        element.findtext(LIST_NAMESPACE + 'Key'),
+                        int(element.findtext(LIST_NAMESPACE + 'Size')),
+                        element.findtext(LIST_NAMESPACE + 'ETag'),
+                        element.findtext(LIST_NAMESPACE + 'LastModified'))
+                    marker = key.name
+                    element.clear()
+                    yield key
+                elif tag == LIST_NAMESPACE + 'IsTruncated':
+                    truncated = element.text == 'true'
+
+    def list_parallel(self, prefix='', marker='', delimiter='/',
+                      boundaries=None, processes=LIST_PROCESSES):
+        if boundaries is None:
+            partitions = self.__discover(prefix, marker, delimiter)
+        else:
+            bounds = [marker] + sorted(prefix + boundary for boundary in
+                                       boundaries if prefix + boundary >
+                                       marker) + [None]
+            partitions = [(prefix, lower, upper) for lower, upper in
+                          zip(bounds, bounds[1:])]
+        return self.__ordered(partitions, processes)
+
+    def list_prefixes(self, prefixes, delimiter='', marker='',
+                      processes=LIST_PROCESSES):
+        pool = ThreadPool(processes)
+        try:
+            for keys in pool.imap(_list_partition, [
+                    (self.bucket, prefix, delimiter, marker) for prefix in
+                    prefixes]):
+                yield keys
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def __list_page(self, query_args):
+        response = self.connection.make_request('GET', self.name,
+                                                query_args=query_args)
+        if response.status != 200:
+            raise S3ResponseError(response.status, response.reason,
+                                  response.read())
+        return response
+
+    def __discover(self, prefix, marker, delimiter):
+        items = []
+        for item in self.list(prefix, delimiter, marker):
+            heapq.heappush(items, (item.name, item))
+            if len(items) > LIST_PAGE_SIZE:
+                yield self.__partition(heapq.heappop(items)[1], marker)
+        while items:
+            yield self.__partition(heapq.heappop(items)[1], marker)
+
+    @staticmethod
+    def __partition(item, marker):
+        if isinstance(item, Prefix):
+            return (item.name, marker, None)
+        else:
+            return [ListedKey(item.name, item.size, item.etag,
+                              item.last_modified)]
+
+    def __ordered(self, partitions, processes):
+        pool = ThreadPool(processes)
+        pending = collections.deque()
+        try:
+            for partition in partitions:
+                if isinstance(partition, list):
+                    pending.append(partition)
+                else:
+                    prefix, lower, upper = partition
+                    pending.append(pool.apply_async(_list_range, [(
+                        self, prefix, lower, upper)]))
+                while len(pending) > processes:
+                    for key in _result(pending.popleft()):
+                        yield key
+            while pending:
+                for key in _result(pending.popleft()):
+                    yield key
+        finally:
+            pool.terminate()
+            pool.join()
+
+
+class MultipartWriter(object):
+    def __init__(self, bucket, key, part_size=MULTIPART_PART_SIZE,
+                 processes=MULTIPART_PROCESSES):
+        self.bucket = bucket
+        self.key = key
+        self.part_size = part_size
+        self.processes = processes
+        self.etag = None
+        self.__buffer = []
+        self.__buffered = 0
+        self.__multipart_upload = None
+        self.__pool = None
+        self.__parts = collections.deque()
+        self.__part_number = 0
+
+    def write(self, data):
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        self.__buffer.append(data)
+        self.__buffered += len(data)
+        if self.__buffered >= self.part_size:
+            self.__flush()
+
+    def close(self):
+        if self.__multipart_upload is None:
+            self.etag = self.bucket.save(self.key, ''.join(self.__buffer))
+            self.__buffer = []
+            return self.etag
+
+        try:
+            if self.__buffer:
+                self.__flush()
+            while self.__parts:
+                self.__parts.popleft().get()
+            self.etag = self.bucket.limiter.request(
+                self.__multipart_upload.complete_upload).etag
+        except:
+            self.abort()
+            raise
+        self.__pool.close()
+        self.__pool.join()
+        self.bucket.invalidate([self.key])
+        return self.etag
+
+    def abort(self):
+        if self.__multipart_upload is not None:
+            self.__pool.terminate()
+            self.__pool.join()
+            self.__multipart_upload.cancel_upload()
+        self.__buffer = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def __flush(self):
+        data = ''.join(self.__buffer)
+        self.__buffer = []
+        self.__buffered = 0
+        if self.__multipart_upload is None:
+            self.__multipart_upload = self.bucket.limiter.request(
+                self.bucket.bucket.initiate_multipart_upload,
+                self.key.name if isinstance(self.key, Key) else self.key)
+            self.__pool = ThreadPool(self.processes)
+
+        while len(self.__parts) >= self.processes:
+            self.__parts.popleft().get()
+        self.__part_number += 1
+        self.__parts.append(self.__pool.apply_async(
+            self.bucket.limiter.request, (_upload_part_contents, (
+                self.__multipart_upload, self.__part_number, data))))
+
+
+class AsyncBucket(object):
+    def __init__(self, bucket, processes=MAX_CONNECTIONS,
+                 max_pending=MAX_PENDING):
+        self.bucket = bucket
+        self.pool = ThreadPool(processes)
+        self.__pending = threading.BoundedSemaphore(max_pending)
+
+    def save(self, key, contents):
+        return self.__submit(self.bucket.save, key, contents)
+
+    def get(self, key):
+        return self.__submit(self.__contents, key)
+
+    def delete(self, key):
+        return self.__submit(self.bucket.delete, key)
+
+    def exists(self, key):
+        return self.__submit(self.bucket.exists, key)
+
+    def list(self, prefix='', marker='', prefetch=LIST_PREFETCH_SIZE):
+        keys = Queue.Queue(prefetch)
+        stopped = threading.Event()
+        done = object()
+
+        def produce():
+            try:
+                for key in self.bucket.list_keys(prefix, marker):
+                    keys.put((key, None))
+                    if stopped.is_set():
+                        return
+            except Exception, e:
+                keys.put((done, e))
+            else:
+                keys.put((done, None))
+
+        producer = threading.Thread(target=produce)
+        producer.daemon = True
+        producer.start()
+        try:
+            while True:
+                key, error = keys.get()
+                if error is not None:
+                    raise error
+                elif key is done:
+                    break
+                yield key
+        finally:
+            stopped.set()
+            while not keys.empty():
+                keys.get_nowait()
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __contents(self, key):
+        key = self.bucket.get(key)
+        return self.bucket.limiter.request(key.get_contents_as_string)
+
+    def __submit(self, function, *args):
+        self.__pending.acquire()
+        try:
+            return self.pool.apply_async(self.__call, (function,) + args)
+        except:
+            self.__pending.release()
+            raise
+
+    def __call(self, function, *args):
+        try:
+            return function(*args)
+        finally:
+            self.__pending.release()
+
+
+class MetadataCache(object):
+    def __init__(self, ttl=None):
+        self.ttl = ttl
+        self.__entries = {}
+        self.__lock = threading.Lock()
+
+    def get(self, bucket_name, key_name):
+        with self.__lock:
+            expires, metadata = self.__entries[(bucket_name, key_name)]
+            if expires is not None and expires <= time.time():
+                del self.__entries[(bucket_name, key_name)]
+                raise KeyError(key_name)
+            return metadata
+
+    def put(self, bucket_name, key_name, metadata):
+        expires = None if self.ttl is None else \
+            time.time() + _seconds(self.ttl)
+        with self.__lock:
+            self.__entries[(bucket_name, key_name)] = (expires, metadata)
+
+    def invalidate(self, bucket_name, key_names):
+        with self.__lock:
+            for key_name in key_names:
+                self.__entries.pop((bucket_name, key_name), None)
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+
+
+class DownloadCache(object):
+    def __init__(self, directory=None, size=CACHE_SIZE):
+        self.directory = directory or os.path.join(tempfile.gettempdir(),
+                                                   'arbalest_cache')
+        self.size = size
+
+    def path(self, bucket_name, key_name, etag):
+        digest = hashlib.sha1('\0'.join(
+            [bucket_name, key_name, etag.strip('"')])).hexdigest()
+        return os.path.join(self.directory, digest)
+
+    def fetch(self, key, etag=None):
+        if etag is None:
+            key = key.bucket.get_key(key.name)
+            if key is None:
+                return None
+            etag = key.etag
+
+        path = self.path(key.bucket.name, key.name, etag)
+        cached = self.__open(path)
+        if cached is not None:
+            return cached
+
+        self.__makedirs()
+        fd, download = tempfile.mkstemp(prefix='.', dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                key.get_contents_to_file(f)
+            path = self.path(key.bucket.name, key.name, key.etag or etag)
+            os.rename(download, path)
+            cached = open(path, 'rb')
+        except:
+            _remove(download)
+            raise
+
+        self.evict()
+        return cached
+
+    def put(self, bucket_name, key_name, etag, contents):
+        if etag is None:
+            return
+
+        self.__makedirs()
+        fd, copy = tempfile.mkstemp(prefix='.', dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                contents.seek(0)
+                shutil.copyfileobj(contents, f)
+            os.rename(copy, self.path(bucket_name, key_name, etag))
+        except:
+            _remove(copy)
+            raise
+
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.startswith('.'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+
+        size = sum(entry[1] for entry in entries)
+        for _, entry_size, name in sorted(entries):
+            if size <= self.size:
+                break
+            _remove(os.path.join(self.directory, name))
+            size -= entry_size
+
+    def __makedirs(self):
+        _makedirs(self.directory)
+
+    @staticmethod
+    def __open(path):
+        try:
+            cached = open(path, 'rb')
+        except IOError:
+            return None
+
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return cached
+
+
+class LocalBucket(Bucket):
+    def __init__(self, directory, name=None, latency=0,
+                 page_size=LIST_PAGE_SIZE, metadata_cache=None):
+        self.name = name or os.path.basename(os.path.normpath(directory))
+        self.metadata_cache = metadata_cache
+        self.connection = None
+        self.limiter = ConcurrencyLimiter()
+        self.page_size = page_size
+        self.bucket = LocalStore(directory, self.name, latency, page_size)
+
+    def get(self, key):
+        if isinstance(key, Key):
+            return key
+        else:
+            return LocalKey(self.bucket, key)
+
+    def list_keys(self, prefix='', marker='', page_size=None):
+        page_size = page_size or self.page_size
+        for i, key in enumerate(self.bucket.walk(prefix, marker)):
+            if i % page_size == 0:
+                self.bucket.wait()
+            yield ListedKey(key.name, key.size, key.etag, key.last_modified)
+
+
+class LocalStore(object):
+    def __init__(self, directory, name, latency=0,
+                 page_size=LIST_PAGE_SIZE):
+        self.directory = directory
+        self.name = name
+        self.latency = latency
+        self.page_size = page_size
+
+    def wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def path(self, key_name):
+        components = key_name.split('/')
+        return os.path.join(self.directory, *[
+            _local_name(component) for component in components[:-1]] + [
+            _local_name(components[-1]) + LOCAL_KEY_SUFFIX])
+
+    def get_key(self, key_name, headers=None):
+        self.wait()
+        key = LocalKey(self, key_name)
+        try:
+            key.stat(os.stat(key.local_path))
+        except OSError:
+            return None
+        return key
+
+    def list(self, prefix='', delimiter='', marker='', headers=None,
+             encoding_type=None):
+        previous = None
+        for i, key in enumerate(self.walk(prefix, marker)):
+            if i % self.page_size == 0:
+                self.wait()
+            position = key.name.find(delimiter, len(prefix)) if \
+                delimiter else -1
+            if position < 0:
+                yield key
+            else:
+                common_prefix = key.name[:position + len(delimiter)]
+                if common_prefix != previous:
+                    previous = common_prefix
+                    yield Prefix(self, common_prefix)
+
+    def walk(self, prefix='', marker=''):
+        return self.__walk(self.directory, '', prefix, marker)
+
+    def delete_keys(self, keys, quiet=False, mfa_token=None, headers=None):
+        self.wait()
+        for key in keys:
+            _remove(self.path(key.name if isinstance(key, Key) else key))
+        return LocalDeleteResult()
+
+    def initiate_multipart_upload(self, key_name, headers=None,
+                                  reduced_redundancy=False, metadata=None,
+                                  encrypt_key=False, policy=None):
+        self.wait()
+        return LocalMultipartUpload(self, key_name)
+
+    def __walk(self, directory, name, prefix, marker):
+        try:
+            entries = os.listdir(directory)
+        except OSError:
+            return
+
+        children = []
+        for entry in entries:
+            path = os.path.join(directory, entry)
+            if entry.endswith(LOCAL_KEY_SUFFIX):
+                key_name = name + _key_name(entry[:-len(LOCAL_KEY_SUFFIX)])
+                if key_name.startswith(prefix) and key_name > marker:
+                    children.append((key_name, path, False))
+            elif os.path.isdir(path):
+                key_prefix = name + _key_name(entry) + '/'
+                if (key_prefix.startswith(prefix) or
+                        prefix.startswith(key_prefix)) and \
+                        (key_prefix > marker or
+                         marker.startswith(key_prefix)):
+                    children.append((key_prefix, path, True))
+
+        for child_name, path, is_directory in sorted(children):
+            if is_directory:
+                for key in self.__walk(path, child_name, prefix, marker):
+                    yield key
+            else:
+                key = LocalKey(self, child_name)
+                try:
+                    key.stat(os.stat(path))
+                except OSError:
+                    continue
+                yield key
+
+
+class LocalKey(Key):
+    def __init__(self, bucket=None, name=None):
+        super(LocalKey, self).__init__(bucket, name)
+        self.__file = None
+
+    @property
+    def local_path(self):
+        return self.bucket.path(self.name)
+
+    def stat(self, stat):
+        self.size = stat.st_size
+        self.etag = '"{0}"'.format(hashlib.md5('{0}:{1!r}'.format(
+            stat.st_size, stat.st_mtime)).hexdigest())
+        self.last_modified = time.strftime('%Y-%m-%dT%H:%M:%S.000Z',
+                                           time.gmtime(stat.st_mtime))
+
+    def exists(self, headers=None):
+        return self.bucket.get_key(self.name) is not None
+
+    def read(self, size=0):
+        if self.__file is None:
+            self.bucket.wait()
+            self.__file = self.__open()
+        return self.__file.read(size or -1)
+
+    def close(self, fast=False):
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+
+    def get_contents_as_string(self, *args, **kwargs):
+        self.bucket.wait()
+        with self.__open() as f:
+            return f.read()
+
+    def get_contents_to_file(self, fp, *args, **kwargs):
+        self.bucket.wait()
+        with self.__open() as f:
+            shutil.copyfileobj(f, fp)
+
+    def get_contents_to_filename(self, filename, *args, **kwargs):
+        with open(filename, 'wb') as fp:
+            self.get_contents_to_file(fp)
+
+    def set_contents_from_string(self, string_data, *args, **kwargs):
+        if isinstance(string_data, unicode):
+            string_data = string_data.encode('utf-8')
+        self.set_contents_from_file(StringIO(string_data))
+
+    def set_contents_from_file(self, fp, headers=None, replace=True,
+                               cb=None, num_cb=10, policy=None, md5=None,
+                               reduced_redundancy=False, query_args=None,
+                               encrypt_key=False, size=None, rewind=False):
+        self.bucket.wait()
+        if rewind:
+            fp.seek(0)
+        directory = os.path.dirname(self.local_path)
+        _makedirs(directory)
+        fd, upload = tempfile.mkstemp(prefix='.', dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                shutil.copyfileobj(fp, f)
+            os.rename(upload, self.local_path)
+        except:
+            _remove(upload)
+            raise
+        self.stat(os.stat(self.local_path))
+
+    def set_contents_from_filename(self, filename, *args, **kwargs):
+        with open(filename, 'rb') as fp:
+            self.set_contents_from_file(fp)
+
+    def delete(self, headers=None):
+        self.bucket.wait()
+        _remove(self.local_path)
+
+    def __open(self):
+        try:
+            return open(self.local_path, 'rb')
+        except IOError:
+            raise S3ResponseError(404, 'Not Found')
+
+
+class LocalMultipartUpload(object):
+    def __init__(self, bucket, key_name):
+        self.bucket = bucket
+        self.key_name = key_name
+        self.directory = tempfile.mkdtemp(prefix='.', dir=bucket.directory)
+
+    def upload_part_from_file(self, fp, part_num, size=None, *args,
+                              **kwargs):
+        self.bucket.wait()
+        with open(os.path.join(self.directory, '{0:05d}'.format(
+                part_num)), 'wb') as f:
+            f.write(fp.read(size) if size is not None else fp.read())
+
+    def complete_upload(self):
+        self.bucket.wait()
+        key = LocalKey(self.bucket, self.key_name)
+        directory = os.path.dirname(key.local_path)
+        _makedirs(directory)
+        fd, upload = tempfile.mkstemp(prefix='.', dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for part in sorted(os.listdir(self.directory)):
+                    with open(os.path.join(self.directory, part), 'rb') as p:
+                        shutil.copyfileobj(p, f)
+            os.rename(upload, key.local_path)
+        except:
+            _remove(upload)
+            raise
+        finally:
+            shutil.rmtree(self.directory, ignore_errors=True)
+        key.stat(os.stat(key.local_path))
+        return key
+
+    def cancel_upload(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class LocalDeleteResult(object):
+    def __init__(self):
+        self.deleted = []
+        self.errors = []
+
+
+def _seconds(delta):
+    return delta.days * 86400 + delta.seconds + delta.microseconds / 1e6
+
+
+def _local_name(component):
+    if component in ('.', '..'):
+        return component.replace('.', '%2E')
+    return _quote(component) or '%'
+
+
+def _key_name(local_name):
+    if local_name == '%':
+        return ''
+    return urllib.unquote(local_name).decode('utf-8')
+
+
+def _makedirs(directory):
+    try:
+        os.makedirs(directory)
+    except OSError, e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _list_partition(partition):
+    bucket, prefix, delimiter, marker = partition
+    return list(bucket.list(prefix, delimiter, marker))
+
+
+def _list_range(partition):
+    bucket, prefix, lower, upper = partition
+    keys = bucket.list_keys(prefix, lower or '')
+    if upper is not None:
+        keys = itertools.takewhile(lambda key: key.name <= upper, keys)
+    return list(keys)
+
+
+def _quote(value):
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    return urllib.quote(str(value), safe='')
+
+
+def _result(partition):
+    return partition if isinstance(partition, list) else partition.get()
+
+
+def _upload_part_contents(part):
+    multipart_upload, part_number, data = part
+    multipart_upload.upload_part_from_file(StringIO(data),
+                                           part_num=part_number,
+                                           size=len(data))
+
+
+def _upload_part(part):
+    multipart_upload, file_name, part_number, offset, size = part
+    with open(file_name, 'rb') as f:
+        f.seek(offset)
+        multipart_upload.upload_part_from_file(f, part_num=part_number,
+                                               size=size)
@@ -17,6 +17,9 @@ class Database(object):
             else:
                 raise ValueError(e)
 
+    def executemany(self, sql, params):
+        return self.cursor.executemany(sql, params)
+
     def fetchall(self):
         for row in self.cursor:
             yield row
@@ -28,4 +31,5 @@ class Database(object):
         return self.connection.rollback()
 
     def close(self):
+        self.cursor = None
         return self.connection.close()
@@ -30,6 +30,7 @@ setup(
                       'luigi==1.0.20',
                       'protobuf==2.6.1',
                       'psycopg2'],
+    extras_require={'parquet': ['pyarrow']},
     tests_require=['mock==1.0.1'],
     packages=['arbalest',
               'arbalest.contrib',
@@ -96,6 +96,24 @@ class S3SortedDataSourcesShould(unittest.TestCase):
              call('event.entity.created/2014-11-05/', '/'),
              call('event.entity.created/2014-11-06/', '/')])
 
+    def test_list_children_in_parallel(self):
+        self.bucket.list_prefixes = Mock(return_value=[
+            [mock_key('event.entity.created/2014-11-04/01/')],
+            [mock_key('event.entity.created/2014-11-05/00/')],
+            []])
+        source = S3SortedDataSources('', 'event.entity.created', self.bucket,
+                                     start='2014-11-04/01',
+                                     end='2014-11-06', list_processes=4)
+
+        self.assertEqual(['event.entity.created/2014-11-04/01',
+                          'event.entity.created/2014-11-05/00',
+                          'event.entity.created/2014-11-06'],
+                         list(source.get()))
+        self.bucket.list_prefixes.assert_called_once_with(
+            ['event.entity.created/2014-11-04/',
+             'event.entity.created/2014-11-05/',
+             'event.entity.created/2014-11-06/'], '/', processes=4)
+
     def test_committed(self):
         source = S3SortedDataSources('', 'event.entity.created', self.bucket)
         key = mock_key(source.source_journal_key)
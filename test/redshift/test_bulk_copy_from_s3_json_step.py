@@ -1,10 +1,11 @@
 import json
 import unittest
 from mock import Mock, patch
+from arbalest.core import PipelineException
 from arbalest.redshift import TargetTable
 from arbalest.redshift.schema import JsonObject
 from arbalest.redshift.step import BulkCopyFromS3JsonStep
-from arbalest.s3 import Bucket
+from arbalest.s3 import Bucket, ListedKey
 from test import AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, BUCKET_NAME, \
     TABLE_NAME
 
@@ -17,6 +18,7 @@ class BulkCopyFromS3JsonStepShould(unittest.TestCase):
                              BUCKET_NAME, Mock())
         self.bucket.save = Mock()
         self.bucket.delete = Mock()
+        self.bucket.delete_many = Mock(return_value=[])
         self.schema = JsonObject(TABLE_NAME).property('eventId', 'VARCHAR(36)')
         self.table = TargetTable(self.schema, Mock())
         self.step = BulkCopyFromS3JsonStep(metadata='', source=SOURCE,
@@ -149,6 +151,71 @@ class BulkCopyFromS3JsonStepShould(unittest.TestCase):
                                 "NOLOAD"
         self.assertEqual(expected_validate_sql, self.step.validate_sql)
 
+    def test_copy_compressed_source_on_run(self):
+        self.step.table.stage_update = Mock()
+        self.step.table.promote_update = Mock()
+        self.step.table.exists = Mock(return_value=False)
+        self.step.compression = 'BZIP2'
+        self.step.run()
+
+        self.assertEqual(self.step.copy_sql + ' BZIP2',
+                         self.step.sql.execute.call_args[0][0][0])
+
     def test_delete_schema_from_s3_bucket_on_run(self):
         self.step.run()
-        self.bucket.delete.assert_called_once_with(self.step.schema_key)
+        self.bucket.delete_many.assert_called_once_with(
+            [self.step.schema_key])
+
+    def test_copy_compacted_parts_on_run(self):
+        self.step.table.stage_update = Mock()
+        self.step.table.promote_update = Mock()
+        self.step.table.exists = Mock(return_value=False)
+        self.bucket.list_keys = Mock(return_value=[])
+        self.step.compactor = Mock(format=None, codec='GZIP')
+        self.step.compactor.compact = Mock(return_value=[])
+        self.step.compactor.parts_url = 's3://bucket/event_created_compacted/a_'
+        self.step.compactor.parts = ['event_created_compacted/a_00000.json.gz']
+        self.step.run()
+
+        self.assertEqual(self.step.copy_sql + ' GZIP',
+                         self.step.sql.execute.call_args[0][0][0])
+        self.assertEqual('s3://bucket/event_created_compacted/a_',
+                         self.step.sql.execute.call_args[0][0][2])
+        self.bucket.delete_many.assert_called_once_with(
+            [self.step.schema_key, 'event_created_compacted/a_00000.json.gz'])
+
+    def test_compaction_prefix(self):
+        self.assertEqual('/event_created_compacted',
+                         self.step.compaction_prefix)
+
+    def test_copy_transcoded_csv_without_jsonpaths_on_run(self):
+        self.step.table.stage_update = Mock()
+        self.step.table.promote_update = Mock()
+        self.step.table.exists = Mock(return_value=False)
+        self.bucket.list_keys = Mock(return_value=[])
+        self.step.compactor = Mock(format='CSV', codec='GZIP', parts=[])
+        self.step.compactor.compact = Mock(return_value=[])
+        self.step.run()
+
+        self.assertEqual("COPY %s FROM '%s' "
+                         "CREDENTIALS "
+                         "'aws_access_key_id=%s;aws_secret_access_key=%s' "
+                         "CSV NULL AS '\\\\N' "
+                         "TIMEFORMAT 'auto' "
+                         "MAXERROR %s GZIP",
+                         self.step.sql.execute.call_args[0][0][0])
+        self.assertEqual(6, len(self.step.sql.execute.call_args[0][0]))
+
+    def test_validate_source_objects_locally_before_redshift(self):
+        self.bucket.list_keys = Mock(return_value=[
+            ListedKey('arbalest_test.event.created/0', 10, None, None)])
+        self.step.validator = Mock()
+        self.step.validator.validate = Mock(
+            side_effect=PipelineException('Invalid source objects'))
+
+        self.assertRaises(PipelineException, self.step.validate)
+        self.assertEqual(
+            [{'url': 's3://bucket/arbalest_test.event.created/0',
+              'mandatory': True, 'meta': {'content_length': 10}}],
+            list(self.step.validator.validate.call_args[0][0]))
+        self.assertEqual(False, self.step.sql.execute.called)
@@ -0,0 +1,297 @@
+import bz2
+import datetime
+import decimal
+import json
+import shutil
+import tempfile
+import unittest
+import zlib
+from mock import patch
+from arbalest.core import PipelineException
+from arbalest.redshift.compaction import Compactor, CsvTranscoder, \
+    ParquetTranscoder, column_kind, convert, pyarrow
+from arbalest.redshift.manifest import Manifest
+from arbalest.redshift.schema import JsonObject, Property
+from arbalest.s3 import LocalBucket
+from test import BUCKET_NAME, TABLE_NAME
+
+
+def gzip(contents):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(contents) + compressor.flush()
+
+
+class CompactorShould(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.bucket = LocalBucket(self.directory, BUCKET_NAME)
+        self.schema = JsonObject(TABLE_NAME, Property('id', 'VARCHAR(36)'))
+        for i in range(10):
+            self.bucket.save('source/{0:02d}.json'.format(i),
+                             json.dumps({'id': i}))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def entries(self, names):
+        return [{'url': 's3://{0}/{1}'.format(BUCKET_NAME, name),
+                 'mandatory': True,
+                 'meta': {'content_length': self.bucket.size(name)}} for
+                name in names]
+
+    def source_entries(self):
+        return self.entries(['source/{0:02d}.json'.format(i) for i in
+                             range(10)])
+
+    def contents(self, entry):
+        name = entry['url'][len('s3://{0}/'.format(BUCKET_NAME)):]
+        return zlib.decompress(self.bucket.get(name).get_contents_as_string(),
+                               16 + zlib.MAX_WBITS)
+
+    def test_concatenate_keys_into_compressed_part(self):
+        compactor = Compactor(self.bucket, 'metadata/event_created_compacted')
+        entries = list(compactor.compact(self.source_entries()))
+
+        self.assertEqual(1, len(entries))
+        self.assertEqual(
+            ''.join(json.dumps({'id': i}) + '\n' for i in range(10)),
+            self.contents(entries[0]))
+        self.assertEqual(True, entries[0]['url'].endswith('.json.gz'))
+        self.assertEqual(compactor.parts, [
+            entries[0]['url'][len('s3://{0}/'.format(BUCKET_NAME)):]])
+
+    def test_split_parts_at_part_size(self):
+        compactor = Compactor(self.bucket, 'metadata/event_created_compacted',
+                              part_size=30, processes=2)
+        entries = list(compactor.compact(self.source_entries()))
+
+        self.assertEqual(3, len(entries))
+        self.assertEqual(
+            ''.join(json.dumps({'id': i}) + '\n' for i in range(10)),
+            ''.join(self.contents(entry) for entry in entries))
+        self.assertEqual(True, all(entry['url'].startswith(
+            compactor.parts_url) for entry in entries))
+
+    def test_split_parts_at_part_files(self):
+        compactor = Compactor(self.bucket, 'metadata/event_created_compacted',
+                              part_files=5)
+
+        self.assertEqual(2, len(list(compactor.compact(
+            self.source_entries()))))
+
+    def test_decompress_compressed_keys(self):
+        self.bucket.save('compressed/a.json.gz',
+                         gzip('{"id": "a"}\n') + gzip('{"id": "b"}'))
+        self.bucket.save('compressed/c.json.bz2', bz2.compress('{"id": "c"}'))
+        compactor = Compactor(self.bucket, 'metadata/event_created_compacted')
+        entries = list(compactor.compact(self.entries(
+            ['compressed/a.json.gz', 'compressed/c.json.bz2'])))
+
+        self.assertEqual('{"id": "a"}\n{"id": "b"}\n{"id": "c"}\n',
+                         self.contents(entries[0]))
+
+    def test_throw_pipeline_exception_for_unsupported_codec(self):
+        self.bucket.save('compressed/a.json.zst', '')
+        compactor = Compactor(self.bucket, 'metadata/event_created_compacted')
+
+        self.assertRaises(PipelineException, list, compactor.compact(
+            self.entries(['compressed/a.json.zst'])))
+
+    def test_save_manifest_of_compacted_parts(self):
+        manifest = Manifest(metadata='metadata', source='source/',
+                            schema=self.schema, bucket=self.bucket)
+        manifest.compactor = Compactor(
+            self.bucket, 'metadata/event_created_compacted', part_size=60)
+        updated_journal = manifest.save()
+        entries = json.loads(self.bucket.get(
+            manifest.manifest_key).get_contents_as_string())['entries']
+
+        self.assertEqual(10, len(updated_journal))
+        self.assertEqual(['GZIP'], manifest.manifest_codecs)
+        self.assertEqual(2, len(entries))
+        self.assertEqual(
+            ''.join(json.dumps({'id': i}) + '\n' for i in range(10)),
+            ''.join(self.contents(entry) for entry in entries))
+
+
+class CsvTranscoderShould(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.bucket = LocalBucket(self.directory, BUCKET_NAME)
+        self.schema = JsonObject(
+            TABLE_NAME, Property('id', 'VARCHAR(36)'),
+            Property('user', Property('name', 'VARCHAR(64)')),
+            Property('active', 'BOOLEAN'), Property('score', 'FLOAT'))
+        self.bucket.save('source/00.json', json.dumps(
+            {'id': 'a', 'user': {'name': u'\xe9, "e"'}, 'active': True,
+             'score': 0.1, 'ignored': 'x' * 100}))
+        self.bucket.save('source/01.json.gz', gzip(
+            '{"id": "b", "active": false}\n{"id": "c", "user": null}'))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def transcoder(self, **kwargs):
+        return CsvTranscoder(self.bucket, 'metadata/event_created_compacted',
+                             self.schema, transcode_processes=2, **kwargs)
+
+    def entries(self):
+        return [{'url': 's3://{0}/{1}'.format(BUCKET_NAME, name),
+                 'mandatory': True} for name in
+                ['source/00.json', 'source/01.json.gz']]
+
+    def contents(self, entry):
+        name = entry['url'][len('s3://{0}/'.format(BUCKET_NAME)):]
+        return zlib.decompress(self.bucket.get(name).get_contents_as_string(),
+                               16 + zlib.MAX_WBITS)
+
+    def test_transcode_declared_properties_to_compressed_csv(self):
+        entries = list(self.transcoder().compact(self.entries()))
+
+        self.assertEqual(1, len(entries))
+        self.assertEqual(True, entries[0]['url'].endswith('.csv.gz'))
+        self.assertEqual('a,"\xc3\xa9, ""e""",true,0.1\r\n'
+                         'b,\\N,false,\\N\r\n'
+                         'c,\\N,\\N,\\N\r\n', self.contents(entries[0]))
+
+    def test_transcode_parts_in_parallel(self):
+        transcoder = self.transcoder(part_files=1)
+        entries = list(transcoder.compact(self.entries()))
+
+        self.assertEqual(2, len(entries))
+        self.assertEqual(2, len(transcoder.parts))
+        self.assertEqual('b,\\N,false,\\N\r\nc,\\N,\\N,\\N\r\n',
+                         self.contents(entries[1]))
+
+
+class ParquetTranscoderShould(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.bucket = LocalBucket(self.directory, BUCKET_NAME)
+        self.schema = JsonObject(
+            TABLE_NAME, Property('id', 'VARCHAR(36)'),
+            Property('amount', 'DECIMAL(10,2)'),
+            Property('created', 'TIMESTAMP'))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_have_column_kinds_of_property_types(self):
+        self.assertEqual(('int16', None, None), column_kind('SMALLINT'))
+        self.assertEqual(('int64', None, None), column_kind('bigint'))
+        self.assertEqual(('decimal', 10, 2), column_kind('DECIMAL(10, 2)'))
+        self.assertEqual(('decimal', 18, 0), column_kind('NUMERIC'))
+        self.assertEqual(('float64', None, None),
+                         column_kind('DOUBLE PRECISION'))
+        self.assertEqual(('string', 36, None), column_kind('VARCHAR(36)'))
+        self.assertEqual(('timestamp', None, None), column_kind('TIMESTAMP'))
+        self.assertEqual(('string', 65535, None), column_kind('VARCHAR(MAX)'))
+        self.assertEqual(('string', 4096, None), column_kind('CHAR(MAX)'))
+        self.assertEqual(('timestamptz', None, None),
+                         column_kind('TIMESTAMPTZ'))
+        self.assertEqual(('timestamptz', None, None),
+                         column_kind('timestamp with time zone'))
+
+    def test_throw_pipeline_exception_for_unsupported_column_type(self):
+        self.assertRaises(PipelineException, column_kind, 'GEOMETRY')
+
+    def test_convert_values_to_column_kinds(self):
+        self.assertEqual(42, convert(('int32', None, None), '42'))
+        self.assertEqual(decimal.Decimal('1.50'),
+                         convert(('decimal', 10, 2), 1.5))
+        self.assertEqual(True, convert(('bool', None, None), 't'))
+        self.assertEqual(u'{"a":1}', convert(('string', None, None),
+                                             {'a': 1}))
+        self.assertEqual(datetime.date(2015, 1, 2),
+                         convert(('date', None, None), '2015-01-02'))
+        self.assertEqual(datetime.datetime(2015, 1, 2, 10, 0),
+                         convert(('timestamp', None, None),
+                                 '01/02/2015 10:00'))
+        self.assertEqual(datetime.datetime(2015, 1, 2, 22, 30),
+                         convert(('timestamp', None, None),
+                                 'Jan 02, 2015 10:30 PM'))
+        self.assertEqual(datetime.datetime(2015, 10, 2),
+                         convert(('timestamp', None, None), '02-OCT-2015'))
+        self.assertEqual(datetime.datetime(2015, 1, 2, 9, 0),
+                         convert(('timestamptz', None, None),
+                                 '2015-01-02T10:00:00+01:00'))
+        self.assertEqual(datetime.datetime(2015, 1, 2, 3, 4, 5, 600000),
+                         convert(('timestamp', None, None),
+                                 '2015-01-02T03:04:05.6Z'))
+        self.assertEqual(None, convert(('int32', None, None), None))
+
+    def test_throw_value_error_for_invalid_values(self):
+        self.assertRaises(ValueError, convert, ('int32', None, None), 1.5)
+        self.assertRaises(ValueError, convert, ('bool', None, None), 'x')
+        self.assertRaises(ValueError, convert, ('timestamp', None, None),
+                          'yesterday')
+
+    def test_throw_pipeline_exception_without_pyarrow(self):
+        with patch('arbalest.redshift.compaction.pyarrow', None):
+            self.assertRaises(PipelineException, ParquetTranscoder,
+                              self.bucket, 'metadata', self.schema)
+
+    def test_transcode_typed_parquet_parts(self):
+        if pyarrow is None:
+            return
+        self.bucket.save('source/00.json', json.dumps(
+            {'id': 'a', 'amount': 1.5, 'created': '2015-01-02T03:04:05Z'}))
+        transcoder = ParquetTranscoder(self.bucket, 'metadata', self.schema,
+                                       transcode_processes=1)
+        entries = list(transcoder.compact([
+            {'url': 's3://{0}/source/00.json'.format(BUCKET_NAME),
+             'mandatory': True}]))
+        name = entries[0]['url'][len('s3://{0}/'.format(BUCKET_NAME)):]
+        table = pyarrow.parquet.read_table(pyarrow.BufferReader(
+            self.bucket.get(name).get_contents_as_string()))
+
+        self.assertEqual(True, name.endswith('.parquet'))
+        self.assertEqual(['id', 'amount', 'created'], table.schema.names)
+        self.assertEqual({'id': [u'a'], 'amount': [decimal.Decimal('1.50')],
+                          'created': [datetime.datetime(2015, 1, 2, 3, 4,
+                                                        5)]},
+                         table.to_pydict())
+
+    def test_convert_mixed_parquet_columns(self):
+        if pyarrow is None:
+            return
+        self.schema.property('count', 'INTEGER')
+        rows = [{'id': 'a', 'count': 1, 'created': '2015-01-02T03:04:05Z'},
+                {'id': 2, 'count': '2', 'created': '01/02/2015 10:00'},
+                {'id': None, 'count': None,
+                 'created': '2015-01-02T10:00:00+01:00'}]
+        self.bucket.save('source/00.json',
+                         '\n'.join(json.dumps(row) for row in rows))
+        transcoder = ParquetTranscoder(self.bucket, 'metadata', self.schema,
+                                       transcode_processes=1)
+        entries = list(transcoder.compact([
+            {'url': 's3://{0}/source/00.json'.format(BUCKET_NAME),
+             'mandatory': True}]))
+        name = entries[0]['url'][len('s3://{0}/'.format(BUCKET_NAME)):]
+        table = pyarrow.parquet.read_table(pyarrow.BufferReader(
+            self.bucket.get(name).get_contents_as_string()))
+
+        self.assertEqual({'id': [u'a', u'2', None],
+                          'amount': [None, None, None],
+                          'count': [1, 2, None],
+                          'created': [
+                              datetime.datetime(2015, 1, 2, 3, 4, 5),
+                              datetime.datetime(2015, 1, 2, 10, 0),
+                              datetime.datetime(2015, 1, 2, 9, 0)]},
+                         table.to_pydict())
+
+    def test_throw_pipeline_exception_for_invalid_parquet_values(self):
+        if pyarrow is None:
+            return
+        self.bucket.save('source/00.json', json.dumps(
+            {'id': 'a', 'amount': 'many'}))
+        transcoder = ParquetTranscoder(self.bucket, 'metadata', self.schema,
+                                       transcode_processes=1)
+
+        try:
+            list(transcoder.compact([
+                {'url': 's3://{0}/source/00.json'.format(BUCKET_NAME),
+                 'mandatory': True}]))
+            self.fail()
+        except PipelineException, e:
+            self.assertEqual(True, 'amount in source/00.json' in str(e))
@@ -0,0 +1,196 @@
+import json
+import struct
+import unittest
+import zlib
+from StringIO import StringIO
+from arbalest.core import JournalException
+from arbalest.redshift.journal import difference, sort, BloomFilter, \
+    JournalReader, JournalWriter, write_journal
+
+
+class JournalShould(unittest.TestCase):
+    def setUp(self):
+        self.keys = ['object_path/00c68a1e-85f2-49e5-9d07-6922046dbc5a',
+                     'object_path/19440481-7766-4061-bd42-4a54fa0aac7c',
+                     'object_path/282e6063-ecef-4e45-bdfb-9fdfb39840cd',
+                     'object_path/35cbf09a-b2dc-43f2-96f6-7d7573906268']
+        self.journal = ['object_path/19440481-7766-4061-bd42-4a54fa0aac7c',
+                        'object_path/35cbf09a-b2dc-43f2-96f6-7d7573906268',
+                        'object_path/80536e83-6bbe-4a42-ade1-533d99321a6c']
+
+    def test_have_difference(self):
+        self.assertEqual(
+            ['object_path/00c68a1e-85f2-49e5-9d07-6922046dbc5a',
+             'object_path/282e6063-ecef-4e45-bdfb-9fdfb39840cd'],
+            list(difference(iter(self.keys), iter(self.journal))))
+
+    def test_have_difference_when_journal_is_empty(self):
+        self.assertEqual(self.keys, list(difference(iter(self.keys), [])))
+
+    def test_have_difference_of_duplicate_keys(self):
+        self.assertEqual(['b'], list(difference(['a', 'a', 'b'], ['a', 'a'])))
+
+    def test_have_difference_with_bloom_filter(self):
+        bloom_filter = BloomFilter(100, 0.01)
+        for key in self.journal:
+            bloom_filter.add(key)
+
+        self.assertEqual(
+            ['object_path/00c68a1e-85f2-49e5-9d07-6922046dbc5a',
+             'object_path/282e6063-ecef-4e45-bdfb-9fdfb39840cd'],
+            list(difference(self.keys, self.journal,
+                            bloom_filter=bloom_filter)))
+
+    def test_not_read_journal_when_bloom_filter_rules_out_keys(self):
+        def journal():
+            raise AssertionError('journal should not be read')
+            yield
+
+        self.assertEqual(self.keys, list(difference(
+            self.keys, journal(), bloom_filter=BloomFilter(100, 0.01))))
+
+    def test_update_journal_with_new_keys(self):
+        updated_journal = []
+        list(difference(self.keys, self.journal, updated_journal))
+
+        self.assertEqual(
+            ['object_path/00c68a1e-85f2-49e5-9d07-6922046dbc5a',
+             'object_path/282e6063-ecef-4e45-bdfb-9fdfb39840cd'],
+            updated_journal)
+
+    def test_sort_sorted_keys(self):
+        self.assertEqual(self.keys, list(sort(self.keys)))
+
+    def test_sort_unsorted_keys_on_disk(self):
+        keys = list(reversed(self.keys + self.journal))
+
+        self.assertEqual(sorted(keys), list(sort(keys, buffer_size=2)))
+
+    def test_sort_unicode_keys_on_disk(self):
+        keys = [u'object_path/\xe9', u'object_path/e', u'object_path/\n']
+
+        self.assertEqual(sorted(keys), list(sort(iter(keys), buffer_size=1)))
+
+
+class JournalFormatShould(unittest.TestCase):
+    def setUp(self):
+        self.keys = ['object_path/2015-01-01/{0:02d}/{1:04d}.json'.format(
+            hour, i) for hour in range(24) for i in range(100)]
+
+    def journal(self, keys, block_size=1024):
+        journal = StringIO()
+        write_journal(keys, journal, block_size)
+        journal.seek(0)
+        return journal
+
+    def test_read_written_keys_as_stream(self):
+        self.assertEqual(self.keys,
+                         list(JournalReader(self.journal(self.keys))))
+
+    def test_read_unicode_keys(self):
+        keys = [u'object_path/e', u'object_path/\xe9', u'object_path/\u4e2d']
+
+        self.assertEqual(keys, list(JournalReader(self.journal(keys))))
+
+    def test_read_empty_journal(self):
+        reader = JournalReader(self.journal([]))
+
+        self.assertEqual([], list(reader))
+        self.assertEqual(False, 'object_path/a' in reader)
+
+    def test_have_block_index(self):
+        reader = JournalReader(self.journal(self.keys))
+
+        self.assertEqual(True, len(reader.index) > 1)
+        self.assertEqual(self.keys[0], reader.index[0][1])
+
+    def test_search_keys(self):
+        reader = JournalReader(self.journal(self.keys))
+
+        self.assertEqual(True, self.keys[0] in reader)
+        self.assertEqual(True, self.keys[1234] in reader)
+        self.assertEqual(True, self.keys[-1] in reader)
+        self.assertEqual(False, 'object_path/2014-12-31/00.json' in reader)
+        self.assertEqual(False, 'object_path/2015-01-01/00/0000.jsonx' in
+                         reader)
+        self.assertEqual(False, 'object_path/2015-01-02' in reader)
+
+    def test_compress_keys_with_shared_prefixes(self):
+        self.assertEqual(True, len(self.journal(self.keys).getvalue()) * 10 <
+                         len(json.dumps(self.keys)))
+
+    def test_skip_duplicate_keys(self):
+        self.assertEqual(['a', 'b'],
+                         list(JournalReader(self.journal(['a', 'a', 'b']))))
+
+    def test_throw_journal_exception_when_keys_are_not_sorted(self):
+        writer = JournalWriter(StringIO())
+        writer.write('b')
+
+        self.assertRaises(JournalException, writer.write, 'a')
+
+    def test_throw_journal_exception_when_not_a_journal(self):
+        self.assertRaises(JournalException, JournalReader,
+                          StringIO(json.dumps(self.keys)))
+
+    def test_throw_journal_exception_when_version_is_unsupported(self):
+        self.assertRaises(JournalException, JournalReader,
+                          StringIO(struct.pack('>4sB', 'ARBJ', 99)))
+
+
+class BloomFilterShould(unittest.TestCase):
+    def setUp(self):
+        self.keys = ['object_path/{0:05d}.json'.format(i) for i in
+                     range(1000)]
+        self.bloom_filter = BloomFilter(len(self.keys), 0.01)
+        for key in self.keys:
+            self.bloom_filter.add(key)
+
+    def test_contain_added_keys(self):
+        self.assertEqual(True, all(key in self.bloom_filter for key in
+                                   self.keys))
+
+    def test_contain_unicode_keys(self):
+        self.bloom_filter.add(u'object_path/\xe9')
+
+        self.assertEqual(True, u'object_path/\xe9' in self.bloom_filter)
+
+    def test_have_bounded_false_positive_rate(self):
+        false_positives = sum(1 for i in range(10000) if
+                              'other_path/{0:05d}'.format(i) in
+                              self.bloom_filter)
+
+        self.assertEqual(True, false_positives < 300)
+
+    def test_be_full_when_capacity_is_exceeded(self):
+        self.assertEqual(False, self.bloom_filter.full)
+        self.bloom_filter.add('object_path/overflow')
+
+        self.assertEqual(True, self.bloom_filter.full)
+
+    def test_load_dumped_filter(self):
+        bloom_filter = BloomFilter.loads(self.bloom_filter.dumps())
+
+        self.assertEqual(self.bloom_filter.bits, bloom_filter.bits)
+        self.assertEqual(self.bloom_filter.count, bloom_filter.count)
+        self.assertEqual(0.01, bloom_filter.error_rate)
+        self.assertEqual(True, self.keys[0] in bloom_filter)
+        self.assertEqual(None, bloom_filter.identity)
+
+    def test_load_dumped_filter_identity(self):
+        self.bloom_filter.identity = '\1' * 16
+        bloom_filter = BloomFilter.loads(self.bloom_filter.dumps())
+
+        self.assertEqual('\1' * 16, bloom_filter.identity)
+
+    def test_load_version_1_filter_without_identity(self):
+        bloom_filter = BloomFilter.loads(
+            struct.pack('>4sBdQQ', 'ARBF', 1, 0.01, 8, 0) +
+            zlib.compress('\0' * 10))
+
+        self.assertEqual(None, bloom_filter.identity)
+        self.assertEqual(8, bloom_filter.capacity)
+
+    def test_throw_journal_exception_when_not_a_filter(self):
+        self.assertRaises(JournalException, BloomFilter.loads,
+                          struct.pack('>4sBdQQ', 'ARBJ', 1, 0.01, 1, 0))
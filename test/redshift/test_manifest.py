@@ -1,10 +1,16 @@
+import datetime
 import json
+import shutil
+import tempfile
 import unittest
+from StringIO import StringIO
 from boto.s3.key import Key
-from mock import Mock
-from arbalest.redshift.manifest import Manifest
+from mock import Mock, patch
+from arbalest.redshift.journal import BloomFilter, JournalReader, \
+    write_journal
+from arbalest.redshift.manifest import Manifest, balance, codec
 from arbalest.redshift.schema import JsonObject, Property
-from arbalest.s3 import Bucket
+from arbalest.s3 import Bucket, LocalBucket
 from test import BUCKET_NAME, TABLE_NAME, AWS_ACCESS_KEY_ID, \
     AWS_SECRET_ACCESS_KEY
 
@@ -16,7 +22,11 @@ class ManifestShould(unittest.TestCase):
         self.schema = JsonObject(TABLE_NAME, Property('id', 'VARCHAR(36)'))
         self.bucket = Bucket(AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY,
                              BUCKET_NAME, Mock())
+        self.bucket.bucket.get_key = Mock(side_effect=self.mock_head)
         self.bucket.save = Mock()
+        self.bucket.delete = Mock()
+        self.bucket.delete_many = Mock(return_value=[])
+        self.segments = {}
         self.key_names = [
             'object_path/00c68a1e-85f2-49e5-9d07-6922046dbc5a',
             'object_path/19440481-7766-4061-bd42-4a54fa0aac7c',
@@ -26,8 +36,7 @@ class ManifestShould(unittest.TestCase):
             'object_path/80536e83-6bbe-4a42-ade1-533d99321a6c',
             'object_path/cf00b394-3ff3-4418-b244-2ccf104fcc40',
             'object_path/e822e2ae-61f5-4be0-aacd-ca6de70faad1']
-        self.bucket.list = Mock(
-            return_value=[self.mock_key(key) for key in self.key_names])
+        self.mock_list(self.key_names)
         self.manifest = Manifest(metadata='',
                                  source='',
                                  schema=self.schema,
@@ -59,6 +68,10 @@ class ManifestShould(unittest.TestCase):
                     BUCKET_NAME), 'mandatory': True}
         ]}
 
+    def mock_head(self, name):
+        key = self.bucket.get(name)
+        return key if key.exists() else None
+
     def mock_key(self, name):
         return Key(Mock(), name)
 
@@ -68,23 +81,213 @@ class ManifestShould(unittest.TestCase):
         self.bucket.get = Mock(return_value=key)
         return key
 
-    def mock_journal(self, exists, key_names=None):
-        key = self.mock_key_exists(self.manifest.journal_key, exists)
-        if exists:
-            key.get_contents_as_string = Mock(
+    def mock_journal_key(self, name, key_names):
+        key = self.mock_key(name)
+        key.exists = Mock(return_value=True)
+        contents = StringIO()
+        write_journal(key_names, contents)
+        contents.seek(0)
+        key.read = contents.read
+        key.close = Mock(side_effect=lambda: contents.seek(0))
+        key.size = len(contents.getvalue())
+        key.etag = '"{0}"'.format(name)
+        return key
+
+    def mock_list(self, key_names):
+        def list_keys(prefix, marker=''):
+            if prefix == self.manifest.journal_segments_prefix:
+                return [self.mock_journal_key(name, self.segments[name]) for
+                        name in sorted(self.segments)]
+            else:
+                return [self.mock_key(key) for key in key_names]
+
+        self.bucket.list = Mock(side_effect=list_keys)
+        self.bucket.list_keys = Mock(side_effect=list_keys)
+
+    def mock_journal(self, exists, key_names=None, legacy=False):
+        keys = {}
+        if exists and legacy:
+            legacy_journal = self.mock_key(self.manifest.legacy_journal_key)
+            legacy_journal.exists = Mock(return_value=True)
+            legacy_journal.get_contents_as_string = Mock(
                 return_value=json.dumps(key_names))
+            keys[legacy_journal.name] = legacy_journal
+        elif exists:
+            journal = self.mock_journal_key(self.manifest.journal_key,
+                                            key_names)
+            keys[journal.name] = journal
+
+        def get(name):
+            if name not in keys:
+                keys[name] = self.mock_key(name)
+                keys[name].exists = Mock(return_value=False)
+            return keys[name]
+
+        self.bucket.get = Mock(side_effect=get)
+
+    def mock_journal_filter(self, key_names, identity=None):
+        bloom_filter = BloomFilter(
+            100, 0.01, identity=identity or self.manifest.journal_identity())
+        for name in key_names:
+            bloom_filter.add(name)
+        journal_filter = self.mock_key(self.manifest.journal_filter_key)
+        journal_filter.exists = Mock(return_value=True)
+        journal_filter.get_contents_as_string = Mock(
+            return_value=bloom_filter.dumps())
+        get = self.bucket.get.side_effect
+        self.bucket.get = Mock(side_effect=lambda name: journal_filter if
+                               name == journal_filter.name else get(name))
+        self.manifest.journal_filter.false_positive_rate = 0.01
+
+    def mock_commit(self):
+        committed = {}
+
+        def save(key, f):
+            if key.endswith('.bloom'):
+                committed[key] = BloomFilter.loads(f)
+                return
+            f.seek(0)
+            committed[key] = list(JournalReader(f))
+
+        self.bucket.save = Mock(side_effect=save)
+        return committed
 
     def test_have_all_keys(self):
-        self.assertEqual(self.key_names, self.manifest.all_keys)
+        self.assertEqual(self.key_names, list(self.manifest.all_keys))
+
+    def test_list_all_keys_from_start(self):
+        list(self.manifest.all_keys)
+
+        self.bucket.list_keys.assert_called_once_with('', marker='')
+
+    def test_have_all_keys_from_key_source(self):
+        self.manifest.incremental = True
+        self.manifest.watermark.marks = Mock(return_value=[
+            {'key': self.key_names[3], 'committed': '2015-01-01T00:00:00'}])
+        self.manifest.key_source = Mock()
+        self.manifest.key_source.keys = Mock(return_value=[
+            self.mock_key(name) for name in self.key_names[4:]])
+
+        self.assertEqual(self.key_names[4:], list(self.manifest.all_keys))
+        self.manifest.key_source.keys.assert_called_once_with(
+            '', self.key_names[3])
+        self.assertEqual(False, self.bucket.list_keys.called)
+
+    def test_list_all_keys_from_watermark_when_incremental(self):
+        self.manifest.incremental = True
+        self.manifest.watermark.marks = Mock(return_value=[
+            {'key': 'object_path/19440481-7766-4061-bd42-4a54fa0aac7c',
+             'committed': '2015-01-01T00:00:00'}])
+        list(self.manifest.all_keys)
+
+        self.bucket.list_keys.assert_called_once_with(
+            '', marker='object_path/19440481-7766-4061-bd42-4a54fa0aac7c')
+
+    def test_list_all_keys_in_parallel(self):
+        self.manifest.list_processes = 4
+        self.bucket.list_parallel = Mock(return_value=iter(
+            [self.mock_key(name) for name in self.key_names]))
+
+        self.assertEqual(self.key_names, list(self.manifest.all_keys))
+        self.bucket.list_parallel.assert_called_once_with(
+            '', marker='', processes=4)
+
+    def test_list_all_keys_after_retention_key(self):
+        self.manifest.retention = 'object_path/19440481'
+        list(self.manifest.all_keys)
+
+        self.bucket.list_keys.assert_called_once_with(
+            '', marker='object_path/19440481')
+
+    def test_list_all_keys_after_retention_age(self):
+        self.manifest.retention = datetime.timedelta(days=1)
+        self.manifest.watermark.marks = Mock(return_value=[
+            {'key': 'object_path/19440481-7766-4061-bd42-4a54fa0aac7c',
+             'committed': '2015-01-01T00:00:00'}])
+        list(self.manifest.all_keys)
+
+        self.bucket.list_keys.assert_called_once_with(
+            '', marker='object_path/19440481-7766-4061-bd42-4a54fa0aac7c')
+
+    def test_have_content_length_in_entries(self):
+        self.mock_journal(False)
+        key = self.mock_key(self.key_names[0])
+        key.size = 1024
+        self.bucket.list_keys = Mock(return_value=[key])
+
+        self.assertEqual([{'url': 's3://{0}/{1}'.format(BUCKET_NAME,
+                                                       self.key_names[0]),
+                           'mandatory': True,
+                           'meta': {'content_length': 1024}}],
+                         self.manifest.get()['manifest']['entries'])
+
+    def mock_compressed_list(self):
+        self.mock_list([name + suffix for name, suffix in zip(
+            self.key_names, ['.gz', '', '.bz2', '.gz', '.zst', '', '.gz',
+                             '.json'])])
+        self.mock_journal(False)
+
+    def saved_entries(self):
+        return [(c[0][0], [codec(entry['url']) for entry in
+                           json.loads(c[0][1])['entries']]) for c in
+                self.bucket.save.call_args_list]
+
+    def test_save_manifest_per_codec(self):
+        self.mock_compressed_list()
+        self.manifest.save()
+
+        self.assertEqual(['GZIP', None, 'BZIP2', 'ZSTD'],
+                         self.manifest.manifest_codecs)
+        self.assertEqual(sorted([
+            ('/event_created_manifest.json', ['GZIP', 'GZIP', 'GZIP']),
+            ('/event_created_manifest_1.json', [None, None, None]),
+            ('/event_created_manifest_2.json', ['BZIP2']),
+            ('/event_created_manifest_3.json', ['ZSTD'])]),
+            sorted(self.saved_entries()))
+
+    def test_save_balanced_manifests_per_codec(self):
+        self.mock_compressed_list()
+        self.manifest.max_files = 2
+        self.manifest.save()
+
+        self.assertEqual(['GZIP', 'GZIP', None, None, 'BZIP2', 'ZSTD'],
+                         self.manifest.manifest_codecs)
+        self.assertEqual(self.manifest.manifest_keys,
+                         [key for key, _ in self.saved_entries()])
+
+    def test_save_manifests_bounded_by_file_count(self):
+        self.mock_journal(False)
+        self.manifest.max_files = 3
+        self.manifest.save()
+
+        saved = dict((c[0][0], json.loads(c[0][1])['entries']) for c in
+                     self.bucket.save.call_args_list)
+        self.assertEqual(['/event_created_manifest.json',
+                          '/event_created_manifest_1.json',
+                          '/event_created_manifest_2.json'],
+                         self.manifest.manifest_keys)
+        self.assertEqual(True, all(len(saved[key]) <= 3 for key in
+                                   self.manifest.manifest_keys))
+        self.assertEqual(sorted(self.expected_manifest['entries']),
+                         sorted(sum([saved[key] for key in
+                                     self.manifest.manifest_keys], [])))
 
     def test_have_manifest_key(self):
         self.assertEqual('/event_created_manifest.json',
                          self.manifest.manifest_key)
 
     def test_have_journal_key(self):
-        self.assertEqual('/event_created_journal.json',
+        self.assertEqual('/event_created_journal.bin',
                          self.manifest.journal_key)
 
+    def test_have_legacy_journal_key(self):
+        self.assertEqual('/event_created_journal.json',
+                         self.manifest.legacy_journal_key)
+
+    def test_have_watermark_key(self):
+        self.assertEqual('/event_created_watermark.json',
+                         self.manifest.watermark_key)
+
     def test_have_manifest_url(self):
         self.assertEqual(
             's3://{0}/event_created_manifest.json'.format(BUCKET_NAME),
@@ -93,12 +296,17 @@ class ManifestShould(unittest.TestCase):
     def test_have_empty_journal(self):
         self.mock_journal(False)
 
-        self.assertEqual([], self.manifest.journal())
+        self.assertEqual([], list(self.manifest.journal()))
 
     def test_have_journal(self):
         self.mock_journal(True, self.key_names)
 
-        self.assertEqual(self.key_names, self.manifest.journal())
+        self.assertEqual(self.key_names, list(self.manifest.journal()))
+
+    def test_have_sorted_legacy_journal(self):
+        self.mock_journal(True, list(reversed(self.key_names)), legacy=True)
+
+        self.assertEqual(self.key_names, list(self.manifest.journal()))
 
     def test_have_manifest_when_journal_is_empty(self):
         self.mock_journal(False)
@@ -116,8 +324,7 @@ class ManifestShould(unittest.TestCase):
         self.mock_journal(True, list(self.key_names))
         self.key_names.append(
             'object_path/5acd5fb0-be96-451a-be32-b65c4461b3f4')
-        self.bucket.list = Mock(
-            return_value=[self.mock_key(key) for key in self.key_names])
+        self.mock_list(self.key_names)
 
         self.assertEqual({'entries': [{
                                           'url': 's3://{0}/object_path/5acd5fb0-be96-451a-be32-b65c4461b3f4'.format(
@@ -125,6 +332,126 @@ class ManifestShould(unittest.TestCase):
                                           'mandatory': True}]},
                          self.manifest.get()['manifest'])
 
+    def test_have_new_keys_as_updated_journal(self):
+        self.mock_journal(True, list(self.key_names))
+        new_key = 'object_path/5acd5fb0-be96-451a-be32-b65c4461b3f4'
+        self.mock_list(self.key_names + [new_key])
+
+        self.assertEqual([new_key], self.manifest.get()['updated_journal'])
+
+    def test_have_journal_filter_key(self):
+        self.assertEqual('/event_created_journal.bloom',
+                         self.manifest.journal_filter_key)
+
+    def test_not_read_journal_when_journal_filter_rules_out_keys(self):
+        self.mock_journal(True, self.key_names[0:4])
+        self.mock_journal_filter(self.key_names[0:4])
+        self.mock_list(self.key_names[4:])
+        journal = self.bucket.get(self.manifest.journal_key)
+        journal.read = Mock(side_effect=AssertionError)
+
+        self.assertEqual(self.key_names[4:],
+                         self.manifest.get()['updated_journal'])
+
+    def test_check_possible_hits_against_journal(self):
+        self.mock_journal(True, self.key_names[0:4])
+        self.mock_journal_filter(self.key_names)
+
+        self.assertEqual(self.key_names[4:],
+                         self.manifest.get()['updated_journal'])
+
+    def test_build_journal_filter_when_missing(self):
+        self.mock_journal(True, self.key_names[0:4])
+        self.manifest.journal_filter.false_positive_rate = 0.01
+        bloom_filter = self.manifest.journal_filter.get(
+            self.manifest.journal, self.manifest.journal_identity())
+
+        self.assertEqual(4, bloom_filter.count)
+        self.assertEqual(True, all(name in bloom_filter for name in
+                                   self.key_names[0:4]))
+        self.assertEqual(self.manifest.journal_identity(),
+                         bloom_filter.identity)
+
+    def test_read_journal_once_when_building_journal_filter(self):
+        self.mock_journal(True, self.key_names[0:4])
+        self.manifest.journal_filter.false_positive_rate = 0.01
+        journal = Mock(side_effect=self.manifest.journal)
+
+        bloom_filter = self.manifest.journal_filter.get(
+            journal, self.manifest.journal_identity())
+
+        self.assertEqual(1, journal.call_count)
+        self.assertEqual(True, all(name in bloom_filter for name in
+                                   self.key_names[0:4]))
+
+    def test_rebuild_journal_filter_when_journal_changed(self):
+        self.mock_journal(True, self.key_names[0:4])
+        self.mock_journal_filter([], '\1' * 16)
+
+        self.assertEqual(self.key_names[4:],
+                         self.manifest.get()['updated_journal'])
+
+    def test_commit_keys_to_journal_filter(self):
+        self.mock_journal(True, self.key_names[0:4])
+        self.mock_journal_filter(self.key_names[0:4])
+        committed = self.mock_commit()
+        self.manifest.commit(self.key_names[4:])
+
+        bloom_filter = committed[self.manifest.journal_filter_key]
+        self.assertEqual(len(self.key_names), bloom_filter.count)
+        self.assertEqual(True, all(name in bloom_filter for name in
+                                   self.key_names))
+        self.assertEqual(self.manifest.journal_identity(),
+                         bloom_filter.identity)
+
+    def test_rebuild_stale_journal_filter_on_commit(self):
+        self.mock_journal(True, self.key_names[0:4])
+        self.mock_journal_filter([], '\1' * 16)
+        committed = self.mock_commit()
+        self.manifest.commit(self.key_names[4:])
+
+        bloom_filter = committed[self.manifest.journal_filter_key]
+        self.assertEqual(4, bloom_filter.count)
+        self.assertEqual(True, all(name in bloom_filter for name in
+                                   self.key_names[0:4]))
+
+    def test_not_commit_journal_filter_when_disabled(self):
+        self.mock_journal(False)
+        committed = self.mock_commit()
+        self.manifest.commit(self.key_names)
+
+        self.assertEqual([self.manifest.journal_key], committed.keys())
+
+    def test_read_journal_from_cache(self):
+        self.mock_journal(True, [])
+        self.manifest.cache = Mock()
+        contents = StringIO()
+        write_journal(self.key_names, contents)
+        contents.seek(0)
+        self.manifest.cache.fetch = Mock(
+            side_effect=lambda key, etag=None: contents if
+            key.name == self.manifest.journal_key else None)
+
+        self.assertEqual(self.key_names, list(self.manifest.journal()))
+
+    def test_put_committed_journal_in_cache(self):
+        self.mock_journal(False)
+        self.manifest.cache = Mock()
+        self.bucket.save = Mock(return_value='"etag"')
+        self.manifest.commit(self.key_names)
+
+        bucket_name, key, etag, _ = self.manifest.cache.put.call_args[0]
+        self.assertEqual((BUCKET_NAME, self.manifest.journal_key, '"etag"'),
+                         (bucket_name, key, etag))
+
+    def test_have_journal_with_segments(self):
+        self.mock_journal(True, self.key_names[0:4])
+        self.segments = {
+            'segment-1': self.key_names[2:6],
+            'segment-2': self.key_names[6:]}
+
+        self.assertEqual(self.key_names, list(self.manifest.journal()))
+
     def test_save_and_have_updated_journal(self):
         self.mock_journal(False)
         updated_journal = self.manifest.save()
@@ -143,10 +470,126 @@ class ManifestShould(unittest.TestCase):
         self.assertEqual(expected_entries, actual_entries)
 
     def test_commit_and_save_journal(self):
+        self.mock_journal(False)
+        committed = self.mock_commit()
         self.manifest.commit(self.key_names)
 
-        self.bucket.save.assert_called_once_with(self.manifest.journal_key,
-                                                 json.dumps(self.key_names))
+        self.assertEqual({self.manifest.journal_key: self.key_names},
+                         committed)
+
+    def test_commit_segment_when_journal_exists(self):
+        self.mock_journal(True, self.key_names[0:4])
+        committed = self.mock_commit()
+        self.manifest.commit(self.key_names[4:])
+
+        self.assertEqual(1, len(committed))
+        segment_key = committed.keys()[0]
+        self.assertEqual(True, segment_key.startswith(
+            self.manifest.journal_segments_prefix))
+        self.assertEqual(self.key_names[4:], committed[segment_key])
+
+    def test_not_commit_empty_segment(self):
+        self.mock_journal(True, self.key_names)
+        committed = self.mock_commit()
+        self.manifest.commit([])
+
+        self.assertEqual({}, committed)
+
+    def test_compact_segments_into_journal(self):
+        self.manifest.compaction_segments = 2
+        self.mock_journal(True, self.key_names[0:4])
+        self.segments = {
+            'segment-1': self.key_names[2:6],
+            'segment-2': self.key_names[6:]}
+        committed = self.mock_commit()
+        self.manifest.commit([])
+
+        self.assertEqual({self.manifest.journal_key: self.key_names},
+                         committed)
+        self.assertEqual(['segment-1', 'segment-2'],
+                         sorted([segment.name for segment in
+                                 self.bucket.delete_many.call_args[0][0]]))
+
+    def test_log_segments_that_failed_to_delete_on_compaction(self):
+        self.mock_journal(True, self.key_names[0:4])
+        self.segments = {'segment-1': self.key_names[4:]}
+        self.bucket.delete_many = Mock(return_value=[
+            Mock(key='segment-1', code='AccessDenied',
+                 message='Access Denied')])
+        self.mock_commit()
+        with patch('arbalest.redshift.manifest._logger') as logger:
+            self.manifest.compact()
+
+        self.assertEqual(1, logger.warning.call_count)
+        self.assertEqual('segment-1', logger.warning.call_args[0][1])
+
+    def test_prune_keys_before_retention_key_on_compaction(self):
+        self.manifest.retention = self.key_names[3]
+        self.mock_journal(True, self.key_names[0:4])
+        self.segments = {'segment-1': self.key_names[4:]}
+        committed = self.mock_commit()
+        self.manifest.compact()
+
+        self.assertEqual({self.manifest.journal_key: self.key_names[4:]},
+                         committed)
+
+    def test_commit_watermark_with_retention_age(self):
+        self.mock_journal(False)
+        self.manifest = Manifest(metadata='', source='', schema=self.schema,
+                                 bucket=self.bucket,
+                                 retention=datetime.timedelta(days=30))
+        self.manifest.watermark.commit = Mock()
+        self.manifest.commit(self.key_names)
+
+        self.manifest.watermark.commit.assert_called_once_with(
+            self.key_names)
+
+    def test_compact_segments_when_size_is_reached(self):
+        self.manifest.compaction_size = 1
+        self.mock_journal(True, self.key_names[0:4])
+        self.segments = {'segment-1': self.key_names[4:]}
+        committed = self.mock_commit()
+        self.manifest.commit([])
+
+        self.assertEqual({self.manifest.journal_key: self.key_names},
+                         committed)
+
+    def test_not_compact_segments_below_threshold(self):
+        self.mock_journal(True, self.key_names[0:4])
+        self.segments = {'segment-1': self.key_names[4:]}
+        committed = self.mock_commit()
+        self.manifest.commit([])
+
+        self.assertEqual({}, committed)
+        self.assertEqual(False, self.bucket.delete_many.called)
+
+    def test_update_existing_manifest_when_key_not_in_legacy_journal(self):
+        self.mock_journal(True, list(reversed(self.key_names)), legacy=True)
+        self.key_names.append(
+            'object_path/5acd5fb0-be96-451a-be32-b65c4461b3f4')
+        self.mock_list(self.key_names)
+
+        self.assertEqual([
+            's3://{0}/object_path/5acd5fb0-be96-451a-be32-b65c4461b3f4'.format(
+                BUCKET_NAME)],
+            [entry['url'] for entry in
+             self.manifest.get()['manifest']['entries']])
+
+    def test_commit_watermark_when_incremental(self):
+        self.mock_journal(False)
+        self.manifest.incremental = True
+        self.manifest.watermark.commit = Mock()
+        self.manifest.commit(self.key_names)
+
+        self.manifest.watermark.commit.assert_called_once_with(
+            self.key_names)
+
+    def test_not_commit_watermark(self):
+        self.mock_journal(False)
+        self.manifest.watermark.commit = Mock()
+        self.manifest.commit(self.key_names)
+
+        self.assertEqual(False, self.manifest.watermark.commit.called)
 
     def test_exist(self):
         exists = True
@@ -171,3 +614,113 @@ class ManifestShould(unittest.TestCase):
         self.mock_key_exists(self.manifest.journal_key, exists)
 
         self.assertEqual(exists, self.manifest.journal_exists())
+
+    def test_have_journal_existence_with_segments(self):
+        self.mock_key_exists(self.manifest.journal_key, False)
+        self.segments = {'segment-1': self.key_names}
+
+        self.assertEqual(True, self.manifest.journal_exists())
+
+
+class BalanceShould(unittest.TestCase):
+    def entries(self, *sizes):
+        return [{'url': 's3://bucket/{0}'.format(i), 'mandatory': True,
+                 'meta': {'content_length': size}} for i, size in
+                enumerate(sizes)]
+
+    def sizes(self, batches):
+        return [[entry['meta']['content_length'] for entry in batch] for
+                batch in batches]
+
+    def test_have_single_empty_batch_without_entries(self):
+        self.assertEqual([[]], balance([]))
+
+    def test_order_entries_by_size(self):
+        self.assertEqual([[3, 2, 1]], self.sizes(balance(
+            self.entries(1, 3, 2))))
+
+    def test_split_batches_by_bytes(self):
+        batches = balance(self.entries(5, 4, 3, 3, 2, 1), max_bytes=10)
+
+        self.assertEqual(2, len(batches))
+        self.assertEqual([9, 9], [sum(sizes) for sizes in
+                                  self.sizes(batches)])
+
+    def test_split_batches_by_file_count(self):
+        batches = balance(self.entries(1, 1, 1, 1, 1), max_files=2)
+
+        self.assertEqual([2, 2, 1], [len(batch) for batch in batches])
+
+    def test_put_oversized_entry_in_its_own_batch(self):
+        self.assertEqual([[20], [4, 1], [3, 2]], self.sizes(balance(
+            self.entries(1, 20, 2, 3, 4), max_bytes=10)))
+
+    def test_interleave_entries_across_slices(self):
+        self.assertEqual([[8, 7, 5, 6, 2, 1]], self.sizes(balance(
+            self.entries(1, 2, 5, 6, 7, 8), slices=2)))
+
+    def test_not_lose_entries_when_interleaving_skewed_slices(self):
+        entries = self.entries(100, 1, 1, 1, 1, 1)
+        batches = balance(entries, slices=2)
+
+        self.assertEqual([[100, 1, 1, 1, 1, 1]], self.sizes(batches))
+        self.assertEqual(sorted(entry['url'] for entry in entries),
+                         sorted(entry['url'] for entry in batches[0]))
+
+    def test_not_lose_entries_when_interleaving_with_limits(self):
+        entries = self.entries(*[i * 7 % 13 + 1 for i in range(50)])
+        for slices in range(2, 6):
+            batches = balance(entries, slices=slices, max_bytes=40)
+
+            self.assertEqual(
+                sorted(entry['url'] for entry in entries),
+                sorted(entry['url'] for batch in batches for entry in batch))
+
+
+class ManifestWithLocalBucketShould(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.bucket = LocalBucket(self.directory, BUCKET_NAME, page_size=3)
+        self.schema = JsonObject(TABLE_NAME, Property('id', 'VARCHAR(36)'))
+        for i in range(10):
+            self.bucket.save('source/{0:02d}.json'.format(i), '{}')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def manifest(self):
+        return Manifest(metadata='metadata', source='source/',
+                        schema=self.schema, bucket=self.bucket)
+
+    def saved_urls(self, manifest):
+        return [entry['url'] for entry in json.loads(self.bucket.get(
+            manifest.manifest_key).get_contents_as_string())['entries']]
+
+    def test_save_only_new_keys_after_commit(self):
+        manifest = self.manifest()
+        manifest.commit(manifest.save())
+        self.bucket.save('source/10.json', '{}')
+
+        manifest = self.manifest()
+        manifest.commit(manifest.save())
+
+        self.assertEqual(['s3://bucket/source/10.json'],
+                         self.saved_urls(manifest))
+        self.assertEqual(11, len(list(manifest.journal())))
+
+    def test_not_trust_journal_filter_committed_before_journal_changed(self):
+        manifest = self.manifest()
+        manifest.journal_filter.false_positive_rate = 0.01
+        manifest.commit(manifest.save())
+        self.bucket.save('source/10.json', '{}')
+
+        manifest = self.manifest()
+        manifest.commit(manifest.save())
+        self.bucket.save('source/11.json', '{}')
+
+        manifest = self.manifest()
+        manifest.journal_filter.false_positive_rate = 0.01
+        manifest.commit(manifest.save())
+
+        self.assertEqual(['s3://bucket/source/11.json'],
+                         self.saved_urls(manifest))
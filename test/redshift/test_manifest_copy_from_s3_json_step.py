@@ -2,6 +2,7 @@ import json
 import unittest
 from arbalest.redshift import TargetTable
 from mock import Mock, patch
+from arbalest.core import PipelineException
 from arbalest.redshift.schema import JsonObject
 from arbalest.redshift.step import ManifestCopyFromS3JsonStep
 from arbalest.s3 import Bucket
@@ -32,6 +33,9 @@ class ManifestCopyFromS3JsonStepShould(unittest.TestCase):
                              BUCKET_NAME, Mock())
         self.bucket.save = Mock()
         self.bucket.delete = Mock()
+        self.bucket.delete_many = Mock(return_value=[])
+        self.bucket.list = Mock(return_value=[])
+        self.bucket.list_keys = Mock(return_value=[])
         self.schema = JsonObject(TABLE_NAME).property('eventId', 'VARCHAR(36)')
         self.table = TargetTable(self.schema, Mock())
         self.step = ManifestCopyFromS3JsonStep(metadata='', source=SOURCE,
@@ -41,6 +45,9 @@ class ManifestCopyFromS3JsonStepShould(unittest.TestCase):
                                                bucket=self.bucket,
                                                table=self.table)
         self.step.manifest = Mock()
+        self.step.manifest.manifest_urls = [
+            's3://{0}/event_created_manifest.json'.format(BUCKET_NAME)]
+        self.step.manifest.manifest_codecs = [None]
         self.updated_journal = [
             'object_path/00c68a1e-85f2-49e5-9d07-6922046dbc5a',
             'object_path/19440481-7766-4061-bd42-4a54fa0aac7c',
@@ -224,10 +231,117 @@ class ManifestCopyFromS3JsonStepShould(unittest.TestCase):
         self.step.manifest.commit.assert_called_once_with(
             self.step.manifest.save())
 
+    def test_copy_each_manifest_on_run(self):
+        self.step.manifest.manifest_urls = [
+            's3://{0}/event_created_manifest.json'.format(BUCKET_NAME),
+            's3://{0}/event_created_manifest_1.json'.format(BUCKET_NAME)]
+        self.step.manifest.manifest_codecs = [None, None]
+        self.step.run()
+
+        self.assertEqual(self.step.manifest.manifest_urls,
+                         [c[0][0][2] for c in
+                          self.step.sql.execute.call_args_list])
+
+    def test_copy_compressed_manifests_with_codec_on_run(self):
+        self.step.manifest.manifest_urls = [
+            's3://{0}/event_created_manifest.json'.format(BUCKET_NAME),
+            's3://{0}/event_created_manifest_1.json'.format(BUCKET_NAME)]
+        self.step.manifest.manifest_codecs = [None, 'GZIP']
+        self.step.run()
+
+        self.assertEqual([EXPECTED_COPY_SQL, EXPECTED_COPY_SQL + ' GZIP'],
+                         [c[0][0][0] for c in
+                          self.step.sql.execute.call_args_list])
+
     def test_not_commit_manifest_on_validate(self):
         self.step.validate()
         self.assertEqual(False, self.step.manifest.commit.called)
 
+    def test_commit_key_source_after_database_on_run(self):
+        calls = []
+        self.table.database.commit = Mock(
+            side_effect=lambda: calls.append('database'))
+        self.step.manifest.key_source.commit = Mock(
+            side_effect=lambda: calls.append('key_source'))
+
+        self.step.run()
+
+        self.assertEqual(['database', 'key_source'], calls)
+
+    def test_roll_back_key_source_on_validate(self):
+        self.step.validate()
+
+        self.step.manifest.key_source.rollback.assert_called_once_with()
+        self.assertEqual(False, self.step.manifest.key_source.commit.called)
+
     def test_delete_schema_from_s3_bucket_on_run(self):
         self.step.run()
-        self.bucket.delete.assert_called_once_with(self.step.schema_key)
+        self.bucket.delete_many.assert_called_once_with(
+            [self.step.schema_key])
+
+    def test_log_keys_that_failed_to_delete_on_run(self):
+        self.bucket.delete_many = Mock(return_value=[
+            Mock(key=self.step.schema_key, code='AccessDenied',
+                 message='Access Denied')])
+        with patch('arbalest.redshift.runner._logger') as logger:
+            self.step.run()
+
+        self.assertEqual(1, logger.warning.call_count)
+        self.assertEqual(self.step.schema_key,
+                         logger.warning.call_args[0][1])
+        self.assertEqual([], self.step.runner.artifacts)
+
+    def test_delete_compacted_parts_from_s3_bucket_on_run(self):
+        self.step.compactor = Mock(format=None, codec='GZIP')
+        self.step.compactor.parts = ['event_created_compacted/a_00000.json.gz']
+        self.step.run()
+
+        self.assertEqual(self.step.compactor, self.step.manifest.compactor)
+        self.bucket.delete_many.assert_called_once_with(
+            [self.step.schema_key, 'event_created_compacted/a_00000.json.gz'])
+
+    def test_copy_transcoded_csv_without_jsonpaths_on_run(self):
+        self.step.compactor = Mock(format='CSV', codec='GZIP', parts=[])
+        self.step.manifest.manifest_codecs = ['GZIP']
+        self.step.run()
+
+        self.assertEqual("COPY %s FROM '%s' "
+                         "CREDENTIALS 'aws_access_key_id=%s;"
+                         "aws_secret_access_key=%s' "
+                         "CSV NULL AS '\\\\N' "
+                         "TIMEFORMAT 'auto' "
+                         "MANIFEST "
+                         "MAXERROR %s GZIP",
+                         self.step.sql.execute.call_args[0][0][0])
+        self.assertEqual(6, len(self.step.sql.execute.call_args[0][0]))
+
+    def test_copy_parquet_parts_on_run(self):
+        self.step.compactor = Mock(format='PARQUET', codec=None, parts=[])
+        self.step.run()
+
+        self.assertEqual("COPY %s FROM '%s' "
+                         "CREDENTIALS 'aws_access_key_id=%s;"
+                         "aws_secret_access_key=%s' "
+                         "FORMAT AS PARQUET "
+                         "MANIFEST",
+                         self.step.sql.execute.call_args[0][0][0])
+        self.assertEqual(5, len(self.step.sql.execute.call_args[0][0]))
+
+    def test_validate_source_objects_locally_before_redshift(self):
+        self.step.validator = Mock()
+
+        def save():
+            self.step.manifest.validator.validate([])
+            raise PipelineException('Invalid source objects')
+        self.step.manifest.save = Mock(side_effect=save)
+
+        self.assertRaises(PipelineException, self.step.validate)
+        self.step.validator.validate.assert_called_once_with([])
+        self.assertEqual(1, self.step.manifest.save.call_count)
+        self.assertEqual(False, self.step.sql.execute.called)
+
+    def test_not_validate_source_objects_on_run(self):
+        self.step.validator = Mock()
+        self.step.run()
+
+        self.assertEqual(None, self.step.manifest.validator)
@@ -0,0 +1,143 @@
+import json
+import unittest
+from boto.s3.key import Key
+from mock import Mock, create_autospec
+from arbalest.redshift.manifest import RedshiftJournalManifest
+from arbalest.redshift.schema import JsonObject, Property
+from arbalest.s3 import Bucket
+from arbalest.sql import Database
+from test import BUCKET_NAME, TABLE_NAME, AWS_ACCESS_KEY_ID, \
+    AWS_SECRET_ACCESS_KEY
+
+
+class RedshiftJournalManifestShould(unittest.TestCase):
+    def setUp(self):
+        self.schema = JsonObject(TABLE_NAME, Property('id', 'VARCHAR(36)'))
+        self.bucket = Bucket(AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY,
+                             BUCKET_NAME, Mock())
+        self.listings = []
+        self.bucket.save = Mock(side_effect=self.save)
+        self.bucket.delete = Mock()
+        self.database = create_autospec(Database)
+        self.database.cursor = Mock()
+        self.database.cursor.fetchone = Mock(return_value=None)
+        self.key_names = [
+            'object_path/00c68a1e-85f2-49e5-9d07-6922046dbc5a',
+            'object_path/19440481-7766-4061-bd42-4a54fa0aac7c',
+            'object_path/282e6063-ecef-4e45-bdfb-9fdfb39840cd']
+        self.bucket.list_keys = Mock(return_value=[
+            self.mock_key(name) for name in self.key_names + ['object_path/']])
+        self.database.fetchall = Mock(
+            return_value=[(name, 1024) for name in self.key_names[1:]])
+        self.manifest = RedshiftJournalManifest(
+            metadata='', source='', schema=self.schema, bucket=self.bucket,
+            db_connection=self.database,
+            aws_access_key_id=AWS_ACCESS_KEY_ID,
+            aws_secret_access_key=AWS_SECRET_ACCESS_KEY)
+
+    def mock_key(self, name):
+        key = Key(Mock(), name)
+        key.size = 1024
+        return key
+
+    def save(self, key, contents):
+        if key == self.manifest.listing_key:
+            self.listings.append(contents)
+
+    def executed(self):
+        return [c[0][0] % tuple(str(p) for p in c[0][1]) if len(c[0]) > 1
+                else c[0][0] for c in self.database.execute.call_args_list]
+
+    def test_have_manifest_key(self):
+        self.assertEqual('/event_created_manifest.json',
+                         self.manifest.manifest_key)
+
+    def test_have_listing_key(self):
+        self.assertEqual('/event_created_listing.csv',
+                         self.manifest.listing_key)
+
+    def test_have_manifest_url(self):
+        self.assertEqual(
+            's3://{0}/event_created_manifest.json'.format(BUCKET_NAME),
+            self.manifest.manifest_url)
+
+    def test_stage_listing_with_copy(self):
+        self.manifest.save()
+
+        self.assertEqual([''.join(name + ',1024\r\n' for name in
+                                  self.key_names)], self.listings)
+        self.assertEqual([
+            "SELECT 1 FROM pg_tables WHERE tablename = 'event_created_journal'",
+            'CREATE TABLE IF NOT EXISTS event_created_journal '
+            '(key VARCHAR(1024) NOT NULL) DISTKEY (key) SORTKEY (key)',
+            'CREATE TEMP TABLE event_created_listing '
+            '(key VARCHAR(1024) NOT NULL, size BIGINT) '
+            'DISTKEY (key) SORTKEY (key)',
+            "COPY event_created_listing "
+            "FROM 's3://{0}/event_created_listing.csv' "
+            "CREDENTIALS 'aws_access_key_id={1};aws_secret_access_key={2}' "
+            "CSV".format(BUCKET_NAME, AWS_ACCESS_KEY_ID,
+                         AWS_SECRET_ACCESS_KEY),
+            'DELETE FROM event_created_listing USING event_created_journal '
+            'WHERE event_created_listing.key = event_created_journal.key',
+            'SELECT key, size FROM event_created_listing ORDER BY key'],
+            self.executed())
+        self.bucket.delete.assert_called_once_with(
+            self.manifest.listing_key)
+
+    def test_save_manifest_of_new_keys(self):
+        updated_journal = self.manifest.save()
+
+        self.assertEqual(self.key_names[1:], updated_journal)
+        key, contents = self.bucket.save.call_args[0]
+        self.assertEqual(self.manifest.manifest_key, key)
+        self.assertEqual(
+            [{'url': 's3://{0}/{1}'.format(BUCKET_NAME, name),
+              'mandatory': True, 'meta': {'content_length': 1024}} for name in
+             self.key_names[1:]], json.loads(contents)['entries'])
+
+    def test_validate_staged_entries_once_before_saving(self):
+        self.manifest.validator = Mock()
+        self.manifest.save()
+
+        self.assertEqual(1, len(self.listings))
+        self.manifest.validator.validate.assert_called_once_with(
+            [{'url': 's3://{0}/{1}'.format(BUCKET_NAME, name),
+              'mandatory': True, 'meta': {'content_length': 1024}} for name in
+             self.key_names[1:]])
+
+    def test_split_manifest_over_file_cap(self):
+        self.manifest.max_files = 1
+        self.manifest.save()
+
+        self.assertEqual(
+            ['/event_created_manifest.json', '/event_created_manifest_1.json'],
+            [c[0][0] for c in self.bucket.save.call_args_list[1:]])
+        self.assertEqual(
+            ['s3://{0}/event_created_manifest.json'.format(BUCKET_NAME),
+             's3://{0}/event_created_manifest_1.json'.format(BUCKET_NAME)],
+            self.manifest.manifest_urls)
+
+    def test_commit_journal_without_committing_transaction(self):
+        self.manifest.save()
+        self.database.execute.reset_mock()
+        self.manifest.commit(self.key_names[1:])
+
+        self.assertEqual([
+            'INSERT INTO event_created_journal '
+            'SELECT DISTINCT key FROM event_created_listing',
+            'DROP TABLE event_created_listing'], self.executed())
+        self.assertEqual(False, self.database.commit.called)
+
+    def test_have_journal_existence_before_staging(self):
+        self.database.cursor.fetchone = Mock(return_value=(1,))
+        self.manifest.save()
+        self.database.cursor.fetchone = Mock(return_value=None)
+
+        self.assertEqual(True, self.manifest.journal_exists())
+
+    def test_not_have_journal_existence_after_staging_new_journal(self):
+        self.manifest.save()
+        self.database.cursor.fetchone = Mock(return_value=(1,))
+
+        self.assertEqual(False, self.manifest.journal_exists())
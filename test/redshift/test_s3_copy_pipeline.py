@@ -1,10 +1,11 @@
 import unittest
-from arbalest.redshift.manifest import SqlManifest
+from arbalest.redshift.manifest import SqlManifest, RedshiftJournalManifest
 
 from mock import Mock, create_autospec, mock_open, patch
 from arbalest.core import PipelineException
 from arbalest.redshift import S3CopyPipeline, BulkCopyFromS3JsonStep, \
     TargetTable, SqlStep
+from arbalest.redshift.compaction import CsvTranscoder
 from arbalest.redshift.schema import JsonObject, Property
 from arbalest.redshift.step import ManifestCopyFromS3JsonStep
 from arbalest.sql import Database
@@ -24,6 +25,17 @@ class S3CopyPipelineShould(unittest.TestCase):
                                          AWS_SECRET_ACCESS_KEY, Mock(),
                                          Mock()).validate)
 
+    def test_create_bucket_with_host_and_connection_limit(self):
+        with patch('arbalest.redshift.Bucket') as bucket:
+            S3CopyPipeline(AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY,
+                           'bucket', Mock(), host='s3.example.com',
+                           max_connections=4)
+
+        bucket.assert_called_once_with(AWS_ACCESS_KEY_ID,
+                                       AWS_SECRET_ACCESS_KEY, 'bucket',
+                                       host='s3.example.com',
+                                       max_connections=4)
+
     def test_add_bulk_copy(self):
         schema = JsonObject(TABLE_NAME, Property('id', 'VARCHAR(36)'))
         bucket = Mock()
@@ -129,6 +141,102 @@ class S3CopyPipelineShould(unittest.TestCase):
         self.assertEqual(expected.manifest.schema, step.manifest.schema)
         self.assertEqual(expected.manifest.bucket, step.manifest.bucket)
 
+    def test_add_redshift_manifest_copy(self):
+        schema = JsonObject(TABLE_NAME, Property('id', 'VARCHAR(36)'))
+        bucket = Mock()
+        database = create_autospec(Database)
+
+        pipeline = S3CopyPipeline(AWS_ACCESS_KEY_ID,
+                                  AWS_SECRET_ACCESS_KEY, bucket,
+                                  database)
+        pipeline.redshift_manifest_copy(metadata='',
+                                        source='',
+                                        schema=schema)
+
+        step = pipeline.steps()[0]
+
+        self.assertEqual(True, isinstance(step, ManifestCopyFromS3JsonStep))
+        self.assertEqual(True,
+                         isinstance(step.manifest, RedshiftJournalManifest))
+        self.assertEqual(database, step.manifest.database)
+        self.assertEqual(database, step.table.database)
+        self.assertEqual(AWS_ACCESS_KEY_ID, step.manifest.aws_access_key_id)
+        self.assertEqual(AWS_SECRET_ACCESS_KEY,
+                         step.manifest.aws_secret_access_key)
+
+    def test_add_manifest_copy_with_compaction(self):
+        schema = JsonObject(TABLE_NAME, Property('id', 'VARCHAR(36)'))
+        bucket = Mock()
+
+        pipeline = S3CopyPipeline(AWS_ACCESS_KEY_ID,
+                                  AWS_SECRET_ACCESS_KEY, bucket,
+                                  create_autospec(Database))
+        pipeline.manifest_copy(metadata='metadata',
+                               source='',
+                               schema=schema,
+                               compaction_part_size=64 * 1024 * 1024)
+
+        step = pipeline.steps()[0]
+
+        self.assertEqual(bucket, step.compactor.bucket)
+        self.assertEqual('metadata/event_created_compacted',
+                         step.compactor.prefix)
+        self.assertEqual(64 * 1024 * 1024, step.compactor.part_size)
+
+    def test_add_bulk_copy_with_csv_staging(self):
+        schema = JsonObject(TABLE_NAME, Property('id', 'VARCHAR(36)'))
+
+        pipeline = S3CopyPipeline(AWS_ACCESS_KEY_ID,
+                                  AWS_SECRET_ACCESS_KEY, Mock(),
+                                  create_autospec(Database))
+        pipeline.bulk_copy(metadata='', source='', schema=schema,
+                           staging_format='csv')
+
+        step = pipeline.steps()[0]
+
+        self.assertEqual(True, isinstance(step.compactor, CsvTranscoder))
+        self.assertEqual('CSV', step.staging_format)
+        self.assertEqual([('id', ['id'], 'VARCHAR(36)')],
+                         step.compactor.columns)
+
+    def test_throw_pipeline_exception_for_parquet_staging_without_pyarrow(
+            self):
+        pipeline = S3CopyPipeline(AWS_ACCESS_KEY_ID,
+                                  AWS_SECRET_ACCESS_KEY, Mock(),
+                                  create_autospec(Database))
+
+        with patch('arbalest.redshift.compaction.pyarrow', None):
+            self.assertRaises(PipelineException, pipeline.manifest_copy,
+                              metadata='', source='',
+                              schema=JsonObject(TABLE_NAME),
+                              staging_format='PARQUET')
+
+    def test_throw_pipeline_exception_for_unsupported_staging_format(self):
+        pipeline = S3CopyPipeline(AWS_ACCESS_KEY_ID,
+                                  AWS_SECRET_ACCESS_KEY, Mock(),
+                                  create_autospec(Database))
+
+        self.assertRaises(PipelineException, pipeline.manifest_copy,
+                          metadata='', source='',
+                          schema=JsonObject(TABLE_NAME),
+                          staging_format='AVRO')
+
+    def test_add_manifest_copy_with_local_validation(self):
+        schema = JsonObject(TABLE_NAME, Property('id', 'VARCHAR(36)'))
+        bucket = Mock()
+
+        pipeline = S3CopyPipeline(AWS_ACCESS_KEY_ID,
+                                  AWS_SECRET_ACCESS_KEY, bucket,
+                                  create_autospec(Database))
+        pipeline.manifest_copy(metadata='', source='', schema=schema,
+                               local_validation=True)
+
+        step = pipeline.steps()[0]
+
+        self.assertEqual(bucket, step.validator.bucket)
+        self.assertEqual([('id', ['id'], ('string', 36, None))],
+                         step.validator.columns)
+
     def test_add_sql(self):
         bucket = Mock()
         database = create_autospec(Database)
@@ -0,0 +1,281 @@
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+from mock import Mock
+from arbalest.core import PipelineException
+from arbalest.redshift.source import FileQueue, InventoryKeySource, \
+    MemoryQueue, NotificationKeySource, SqsQueue
+from arbalest.s3 import LocalBucket
+from test import BUCKET_NAME
+
+INVENTORY_PREFIX = 'inventory/bucket/daily/'
+
+
+def created(name, event_time='2015-01-01T00:00:00.000Z',
+            bucket_name=BUCKET_NAME, event_name='ObjectCreated:Put'):
+    return json.dumps({'Records': [{
+        'eventName': event_name,
+        'eventTime': event_time,
+        's3': {'bucket': {'name': bucket_name},
+               'object': {'key': name, 'size': 1, 'eTag': 'etag'}}}]})
+
+
+def gzipped(rows):
+    contents = StringIO()
+    f = gzip.GzipFile(fileobj=contents, mode='wb')
+    try:
+        f.write(''.join(rows))
+    finally:
+        f.close()
+    return contents.getvalue()
+
+
+class InventoryKeySourceShould(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.bucket = LocalBucket(self.directory, BUCKET_NAME)
+        self.source = InventoryKeySource(self.bucket, self.bucket,
+                                         INVENTORY_PREFIX, processes=2,
+                                         buffer_size=2)
+        self.save_inventory('2015-01-01T00-00Z', {
+            'data/1.csv.gz': ['"bucket","object_path/b","2","etag-b"\n',
+                              '"bucket","object_path/a+%C3%A9","1",'
+                              '"etag-a"\n'],
+            'data/2.csv.gz': ['"bucket","object_path/d","4","etag-d"\n',
+                              '"bucket","other_path/a","1","etag-o"\n',
+                              '"bucket","object_path/c","3","etag-c"\n']})
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def save_inventory(self, date, files, file_format='CSV'):
+        for name, rows in files.items():
+            self.bucket.save(INVENTORY_PREFIX + name, gzipped(rows))
+        self.bucket.save(INVENTORY_PREFIX + date + '/manifest.json',
+                         json.dumps({
+                             'sourceBucket': BUCKET_NAME,
+                             'fileFormat': file_format,
+                             'fileSchema': 'Bucket, Key, Size, ETag',
+                             'creationTimestamp': '1420070400000',
+                             'files': [{'key': INVENTORY_PREFIX + name} for
+                                       name in sorted(files)]}))
+
+    def names(self, keys):
+        return [key.name for key in keys]
+
+    def test_have_sorted_inventory_keys_with_prefix(self):
+        keys = list(self.source.keys('object_path/'))
+
+        self.assertEqual([u'object_path/a \xe9', 'object_path/b',
+                          'object_path/c', 'object_path/d'],
+                         self.names(keys))
+        self.assertEqual((1, 'etag-a'), (keys[0].size, keys[0].etag))
+
+    def test_have_inventory_keys_after_marker(self):
+        self.assertEqual(['object_path/c', 'object_path/d'], self.names(
+            self.source.keys('object_path/', 'object_path/b')))
+
+    def test_list_keys_after_inventory(self):
+        self.bucket.save('object_path/c', 'c')
+        self.bucket.save('object_path/e', 'e')
+
+        self.assertEqual(['object_path/d', 'object_path/e'], self.names(
+            self.source.keys('object_path/', 'object_path/c')))
+
+    def test_use_latest_inventory(self):
+        self.save_inventory('2015-01-02T00-00Z', {
+            'data/3.csv.gz': ['"bucket","object_path/f","6","etag-f"\n']})
+
+        self.assertEqual(['object_path/f'],
+                         self.names(self.source.keys('object_path/')))
+
+    def test_throw_pipeline_exception_when_format_is_unsupported(self):
+        self.save_inventory('2015-01-02T00-00Z', {}, 'ORC')
+
+        self.assertRaises(PipelineException, list, self.source.keys())
+
+    def test_throw_pipeline_exception_without_inventory(self):
+        source = InventoryKeySource(self.bucket, self.bucket, 'missing/')
+
+        self.assertRaises(PipelineException, list, source.keys())
+
+
+class NotificationKeySourceShould(unittest.TestCase):
+    def setUp(self):
+        self.queue = MemoryQueue([
+            created('object_path/b'),
+            created('object_path/a+%C3%A9'),
+            json.dumps({'Type': 'Notification',
+                        'Message': created('object_path/c')}),
+            created('object_path/b', '2015-01-02T00:00:00.000Z'),
+            created('object_path/d', bucket_name='other'),
+            created('object_path/e', event_name='ObjectRemoved:Delete'),
+            json.dumps({'Event': 's3:TestEvent'})])
+        self.source = NotificationKeySource(self.queue, BUCKET_NAME,
+                                            batch_size=2)
+
+    def names(self, keys):
+        return [key.name for key in keys]
+
+    def test_have_sorted_unique_created_keys(self):
+        keys = list(self.source.keys('object_path/'))
+
+        self.assertEqual([u'object_path/a \xe9', 'object_path/b',
+                          'object_path/c'], self.names(keys))
+        self.assertEqual('2015-01-02T00:00:00.000Z', keys[1].last_modified)
+
+    def test_have_created_keys_after_marker(self):
+        self.assertEqual(['object_path/c'], self.names(
+            self.source.keys('object_path/', 'object_path/b')))
+
+    def test_receive_messages_once_per_run(self):
+        list(self.source.keys())
+        self.queue.send(created('object_path/f'))
+
+        self.assertEqual(3, len(list(self.source.keys())))
+
+    def test_acknowledge_messages_on_commit(self):
+        list(self.source.keys())
+        self.assertEqual(7, len(self.queue.messages))
+
+        self.source.commit()
+
+        self.assertEqual(0, len(self.queue.messages))
+        self.assertEqual([], list(self.source.keys()))
+
+    def test_acknowledge_messages_of_keys_at_or_below_marker_on_commit(self):
+        list(self.source.keys('object_path/', 'object_path/b'))
+        self.source.commit()
+
+        self.assertEqual(0, len(self.queue.messages))
+
+    def test_release_messages_of_keys_not_yielded_on_commit(self):
+        self.assertEqual(['object_path/c'], self.names(
+            self.source.keys('object_path/c')))
+        self.source.commit()
+
+        self.assertEqual(3, len(self.queue.messages))
+        self.assertEqual([u'object_path/a \xe9', 'object_path/b'],
+                         self.names(self.source.keys()))
+
+    def test_receive_at_most_max_messages_per_run(self):
+        source = NotificationKeySource(self.queue, BUCKET_NAME,
+                                       batch_size=2, max_messages=3)
+
+        self.assertEqual([u'object_path/a \xe9', 'object_path/b',
+                          'object_path/c'], self.names(source.keys()))
+        source.commit()
+
+        self.assertEqual(['object_path/b'], self.names(source.keys()))
+
+    def test_redeliver_messages_on_rollback(self):
+        list(self.source.keys())
+        self.source.rollback()
+
+        self.assertEqual(3, len(list(self.source.keys())))
+
+    def test_not_stall_file_queue_on_keys_outside_prefix(self):
+        directory = tempfile.mkdtemp()
+        try:
+            queue = FileQueue(os.path.join(directory, 'events'))
+            queue.send(created('other/x.json'))
+            for i in range(5):
+                queue.send(created('source/{0}.json'.format(i)))
+            names = []
+            for _ in range(3):
+                source = NotificationKeySource(
+                    FileQueue(queue.file_name), BUCKET_NAME, max_messages=3)
+                names.extend(self.names(source.keys('source/')))
+                source.commit()
+        finally:
+            shutil.rmtree(directory)
+
+        self.assertEqual(['source/{0}.json'.format(i) for i in range(5)],
+                         names)
+
+
+class FileQueueShould(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.queue = FileQueue(os.path.join(self.directory, 'events'))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_receive_sent_messages(self):
+        self.queue.send(created('a'))
+        self.queue.send(created('b'))
+
+        self.assertEqual([created('a') + '\n'],
+                         [body for _, body in self.queue.receive(1)])
+        self.assertEqual([created('b') + '\n'],
+                         [body for _, body in self.queue.receive(10)])
+        self.assertEqual([], self.queue.receive(10))
+
+    def test_not_receive_partial_messages(self):
+        with open(self.queue.file_name, 'w') as f:
+            f.write(created('a') + '\n' + created('b'))
+
+        self.assertEqual(1, len(self.queue.receive(10)))
+
+    def test_resume_after_acknowledged_messages(self):
+        self.queue.send(created('a'))
+        self.queue.send(created('b'))
+        self.queue.acknowledge([receipt for receipt, _ in
+                                self.queue.receive(1)])
+
+        queue = FileQueue(self.queue.file_name)
+
+        self.assertEqual([created('b') + '\n'],
+                         [body for _, body in queue.receive(10)])
+
+    def test_resume_after_contiguous_acknowledged_messages(self):
+        for name in ['a', 'b', 'c']:
+            self.queue.send(created(name))
+        receipts = [receipt for receipt, _ in self.queue.receive(10)]
+        self.queue.acknowledge([receipts[0], receipts[2]])
+        self.queue.release([receipts[1]])
+
+        queue = FileQueue(self.queue.file_name)
+
+        self.assertEqual([created('b') + '\n', created('c') + '\n'],
+                         [body for _, body in queue.receive(10)])
+
+    def test_redeliver_released_messages(self):
+        self.queue.send(created('a'))
+        self.queue.release([receipt for receipt, _ in
+                            self.queue.receive(1)])
+
+        self.assertEqual(1, len(self.queue.receive(10)))
+
+
+class SqsQueueShould(unittest.TestCase):
+    def setUp(self):
+        self.sqs_queue = Mock()
+        self.queue = SqsQueue(self.sqs_queue)
+
+    def test_receive_raw_messages(self):
+        message = Mock()
+        message.get_body = Mock(return_value=created('a'))
+        self.sqs_queue.get_messages = Mock(return_value=[message])
+
+        self.assertEqual([(message, created('a'))], self.queue.receive(100))
+        self.assertEqual(10, self.sqs_queue.get_messages.call_args[1][
+            'num_messages'])
+
+    def test_delete_acknowledged_messages_in_batches(self):
+        self.queue.acknowledge(range(25))
+
+        self.assertEqual([10, 10, 5], [
+            len(c[0][0]) for c in
+            self.sqs_queue.delete_message_batch.call_args_list])
+
+    def test_make_released_messages_visible(self):
+        self.queue.release(['message'])
+
+        self.sqs_queue.change_message_visibility_batch.assert_called_once_with(
+            [('message', 0)])
@@ -1,10 +1,16 @@
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
 import unittest
 
 from boto.s3.key import Key
-from mock import Mock, patch, mock_open, create_autospec, call
+from mock import Mock, create_autospec, call
+from arbalest.redshift.journal import BloomFilter
 from arbalest.redshift.manifest import SqlManifest
 from arbalest.redshift.schema import Property, JsonObject
-from arbalest.s3 import Bucket
+from arbalest.s3 import Bucket, LocalBucket
 from arbalest.sql import Database
 from test import BUCKET_NAME, TABLE_NAME, AWS_ACCESS_KEY_ID, \
     AWS_SECRET_ACCESS_KEY
@@ -15,6 +21,7 @@ class SqlManifestShould(unittest.TestCase):
         self.schema = JsonObject(TABLE_NAME, Property('id', 'VARCHAR(36)'))
         self.bucket = Bucket(AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY,
                              BUCKET_NAME, Mock())
+        self.bucket.bucket.get_key = Mock(side_effect=self.mock_head)
         self.bucket.save = Mock()
         self.database = create_autospec(Database)
         self.key_names = [
@@ -26,7 +33,7 @@ class SqlManifestShould(unittest.TestCase):
             'object_path/80536e83-6bbe-4a42-ade1-533d99321a6c',
             'object_path/cf00b394-3ff3-4418-b244-2ccf104fcc40',
             'object_path/e822e2ae-61f5-4be0-aacd-ca6de70faad1']
-        self.bucket.list = Mock(
+        self.bucket.list_keys = Mock(
             return_value=[self.mock_key(key) for key in self.key_names])
         self.manifest = SqlManifest(metadata='',
                                     source='',
@@ -60,6 +67,10 @@ class SqlManifestShould(unittest.TestCase):
                     BUCKET_NAME), 'mandatory': True}
         ]}
 
+    def mock_head(self, name):
+        key = self.bucket.get(name)
+        return key if key.exists() else None
+
     def mock_key(self, name):
         return Key(Mock(), name)
 
@@ -74,7 +85,7 @@ class SqlManifestShould(unittest.TestCase):
         self.mock_key_exists(self.manifest.journal_key, exists)
         if exists:
             self.database.fetchall = Mock(
-                return_value=((key,) for key in key_names))
+                side_effect=lambda: [(key,) for key in key_names])
 
     def test_have_all_keys(self):
         self.assertEqual(self.key_names, list(self.manifest.all_keys))
@@ -97,18 +108,23 @@ class SqlManifestShould(unittest.TestCase):
 
         self.assertEqual([], list(self.manifest.journal()))
         self.database.open.assert_called_once_with()
-        sql = 'CREATE TABLE IF NOT EXISTS journal (key TEXT)'
-        self.database.execute.assert_called_once_with(sql)
+        self.database.execute.assert_has_calls(
+            [call('PRAGMA page_size = 65536'),
+             call('PRAGMA journal_mode = MEMORY'),
+             call('PRAGMA synchronous = OFF'),
+             call('CREATE TABLE IF NOT EXISTS journal (key TEXT)'),
+             call('CREATE UNIQUE INDEX IF NOT EXISTS journal_key '
+                  'ON journal (key)')])
         self.database.commit.assert_called_once_with()
-        self.database.close.assert_called_once_with()
+        self.assertEqual(False, self.database.close.called)
 
     def test_have_journal(self):
         self.mock_journal(True, self.key_names)
 
         self.assertEqual(self.key_names, list(self.manifest.journal()))
         self.database.open.assert_called_once_with()
-        sql = 'SELECT key FROM journal'
-        self.database.execute.assert_called_once_with(sql)
+        sql = 'SELECT key FROM journal ORDER BY key'
+        self.database.execute.assert_called_with(sql)
 
     def test_have_manifest_when_journal_is_empty(self):
         self.mock_journal(False)
@@ -126,7 +142,7 @@ class SqlManifestShould(unittest.TestCase):
         self.mock_journal(True, list(self.key_names))
         self.key_names.append(
             'object_path/5acd5fb0-be96-451a-be32-b65c4461b3f4')
-        self.bucket.list = Mock(
+        self.bucket.list_keys = Mock(
             return_value=[self.mock_key(key) for key in self.key_names])
 
         self.assertEqual([{
@@ -135,85 +151,117 @@ class SqlManifestShould(unittest.TestCase):
             'mandatory': True}],
             list(self.manifest.get()['manifest']['entries']))
 
+    def test_list_all_keys_from_watermark_when_incremental(self):
+        self.manifest.incremental = True
+        self.manifest.watermark.marks = Mock(return_value=[
+            {'key': 'object_path/19440481-7766-4061-bd42-4a54fa0aac7c',
+             'committed': '2015-01-01T00:00:00'}])
+        list(self.manifest.all_keys)
+
+        self.bucket.list_keys.assert_called_once_with(
+            '', marker='object_path/19440481-7766-4061-bd42-4a54fa0aac7c')
+
     def test_save(self):
-        f = mock_open()
         self.mock_journal(False)
-        key = self.mock_key(self.manifest.manifest_key)
-        key.set_contents_from_filename = Mock()
-        key.get_contents_to_filename = Mock()
-        self.bucket.get = Mock(return_value=key)
 
-        with patch('__builtin__.open', f, create=True):
-            self.manifest.save()
-
-            f.assert_called_once_with(self.manifest.file_name, 'wb')
-
-            handle = f()
-            self.assertEqual(call(0), handle.seek.call_args_list[0])
-            self.assertEqual(2, handle.truncate.call_count)
-            self.assertEqual([call('{\n'),
-                              call('"entries": [\n'),
-                              call(
-                                  '{"url": "s3://bucket/object_path/35cbf09a-b2dc-43f2-96f6-7d7573906268", "mandatory": true},\n'),
-                              call(
-                                  '{"url": "s3://bucket/object_path/80536e83-6bbe-4a42-ade1-533d99321a6c", "mandatory": true},\n'),
-                              call(
-                                  '{"url": "s3://bucket/object_path/e822e2ae-61f5-4be0-aacd-ca6de70faad1", "mandatory": true},\n'),
-                              call(
-                                  '{"url": "s3://bucket/object_path/cf00b394-3ff3-4418-b244-2ccf104fcc40", "mandatory": true},\n'),
-                              call(
-                                  '{"url": "s3://bucket/object_path/2014-09-02/19440481-7766-4061-bd42-4a54fa0aac7c", "mandatory": true},\n'),
-                              call(
-                                  '{"url": "s3://bucket/object_path/282e6063-ecef-4e45-bdfb-9fdfb39840cd", "mandatory": true},\n'),
-                              call(
-                                  '{"url": "s3://bucket/object_path/19440481-7766-4061-bd42-4a54fa0aac7c", "mandatory": true},\n'),
-                              call(
-                                  '{"url": "s3://bucket/object_path/00c68a1e-85f2-49e5-9d07-6922046dbc5a", "mandatory": true},\n'),
-                              call(
-                                  '{"url": "s3://bucket/object_path/00c68a1e-85f2-49e5-9d07-6922046dbc5a", "mandatory": true}\n'),
-                              call(']}')], handle.write.call_args_list)
-
-            key.set_contents_from_filename.assert_called_once_with(
-                self.manifest.file_name)
+        self.manifest.save()
+
+        key, contents = self.bucket.save.call_args[0]
+        self.assertEqual(self.manifest.manifest_key, key)
+        self.assertEqual(self.expected_manifest, json.loads(contents))
+        self.assertEqual('{\n"entries": [\n' + ',\n'.join(
+            '{{"url": "s3://bucket/{0}", "mandatory": true}}'.format(name)
+            for name in self.key_names) + '\n]}', contents)
+
+    def test_save_empty_manifest(self):
+        self.mock_journal(True, self.key_names)
+
+        self.manifest.save()
+
+        self.assertEqual({'entries': []},
+                         json.loads(self.bucket.save.call_args[0][1]))
 
     def test_commit(self):
-        key = self.mock_key(self.manifest.journal_key)
-        key.set_contents_from_filename = Mock()
-        self.bucket.get = Mock(return_value=key)
+        self.bucket.upload = Mock()
 
         self.manifest.commit(self.key_names)
 
         self.database.open.assert_called_once_with()
-        inserts = [call('DELETE FROM journal'),
-                   call('INSERT INTO journal VALUES (?)',
-                        (
-                            'object_path/00c68a1e-85f2-49e5-9d07-6922046dbc5a',)),
-                   call('INSERT INTO journal VALUES (?)',
-                        (
-                            'object_path/19440481-7766-4061-bd42-4a54fa0aac7c',)),
-                   call('INSERT INTO journal VALUES (?)',
-                        (
-                            'object_path/2014-09-02/19440481-7766-4061-bd42-4a54fa0aac7c',)),
-                   call('INSERT INTO journal VALUES (?)',
-                        (
-                            'object_path/282e6063-ecef-4e45-bdfb-9fdfb39840cd',)),
-                   call('INSERT INTO journal VALUES (?)',
-                        (
-                            'object_path/35cbf09a-b2dc-43f2-96f6-7d7573906268',)),
-                   call('INSERT INTO journal VALUES (?)',
-                        (
-                            'object_path/80536e83-6bbe-4a42-ade1-533d99321a6c',)),
-                   call('INSERT INTO journal VALUES (?)',
-                        (
-                            'object_path/cf00b394-3ff3-4418-b244-2ccf104fcc40',)),
-                   call('INSERT INTO journal VALUES (?)',
-                        (
-                            'object_path/e822e2ae-61f5-4be0-aacd-ca6de70faad1',))]
-        self.database.execute.assert_has_calls(inserts)
+        sql, params = self.database.executemany.call_args[0]
+        self.assertEqual('INSERT OR IGNORE INTO journal VALUES (?)', sql)
+        self.assertEqual([(name,) for name in self.key_names], list(params))
+        self.assertEqual(False, self.database.execute.called)
         self.database.commit.assert_called_once_with()
         self.database.close.assert_called_once_with()
-        key.set_contents_from_filename.assert_called_once_with(
-            self.manifest.journal_file_name)
+        self.bucket.upload.assert_called_once_with(
+            self.manifest.journal_key, self.manifest.journal_file_name)
+
+    def test_copy_journal_from_cache(self):
+        self.mock_journal(True, self.key_names)
+        cached = tempfile.TemporaryFile()
+        cached.write('journal')
+        cached.seek(0)
+        self.manifest.cache = Mock()
+        self.manifest.cache.fetch = Mock(return_value=cached)
+        self.manifest.journal_file_name = tempfile.mktemp()
+        try:
+            self.assertEqual(self.key_names, list(self.manifest.journal()))
+            with open(self.manifest.journal_file_name) as f:
+                self.assertEqual('journal', f.read())
+        finally:
+            os.remove(self.manifest.journal_file_name)
+        self.assertEqual(False, self.bucket.get.return_value.
+                         get_contents_to_filename.called)
+
+    def test_prune_journal_before_retention_key(self):
+        self.bucket.upload = Mock()
+        self.manifest.retention = self.key_names[3]
+        self.database.cursor = Mock()
+        self.database.cursor.rowcount = 4
+
+        self.manifest.commit(self.key_names[4:])
+
+        self.database.execute.assert_has_calls([
+            call('DELETE FROM journal WHERE key <= ?', (self.key_names[3],)),
+            call('VACUUM')])
+
+    def test_not_vacuum_when_nothing_is_pruned(self):
+        self.bucket.upload = Mock()
+        self.manifest.retention = self.key_names[3]
+        self.database.cursor = Mock()
+        self.database.cursor.rowcount = 0
+
+        self.manifest.commit(self.key_names[4:])
+
+        self.assertEqual(False, call('VACUUM') in
+                         self.database.execute.call_args_list)
+
+    def test_commit_journal_filter(self):
+        self.bucket.upload = Mock(return_value='"etag"')
+        self.manifest.journal_filter.false_positive_rate = 0.01
+        self.mock_journal(True, self.key_names)
+        self.bucket.get.return_value.exists.return_value = False
+
+        self.manifest.commit(self.key_names)
+
+        key, contents = self.bucket.save.call_args[0]
+        self.assertEqual(self.manifest.journal_filter_key, key)
+        bloom_filter = BloomFilter.loads(contents)
+        self.assertEqual(True, all(name in bloom_filter for name in
+                                   self.key_names))
+        self.bucket.etag = Mock(return_value='"etag"')
+        self.assertEqual(self.manifest.journal_identity(),
+                         bloom_filter.identity)
+
+    def test_commit_watermark_when_incremental(self):
+        self.bucket.upload = Mock()
+        self.manifest.incremental = True
+        self.manifest.watermark.commit = Mock()
+
+        self.manifest.commit(self.key_names)
+
+        self.manifest.watermark.commit.assert_called_once_with(
+            self.key_names)
 
     def test_exist(self):
         exists = True
@@ -238,3 +286,38 @@ class SqlManifestShould(unittest.TestCase):
         self.mock_key_exists(self.manifest.journal_key, exists)
 
         self.assertEqual(exists, self.manifest.journal_exists())
+
+
+class SqlManifestWithLocalBucketShould(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.bucket = LocalBucket(self.directory, BUCKET_NAME)
+        self.schema = JsonObject(TABLE_NAME, Property('id', 'VARCHAR(36)'))
+        self.key_names = ['source/{0:02d}.json'.format(i) for i in range(5)]
+        for name in self.key_names:
+            self.bucket.save(name, '{}')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def manifest(self):
+        manifest = SqlManifest(
+            metadata='metadata', source='source/', schema=self.schema,
+            bucket=self.bucket, db_connection=sqlite3.connect(
+                os.path.join(self.directory, 'journal.db')),
+            false_positive_rate=0.01)
+        manifest.journal_file_name = os.path.join(self.directory,
+                                                  'journal.db')
+        return manifest
+
+    def test_rebuild_full_journal_filter_on_commit(self):
+        manifest = self.manifest()
+        manifest.journal_filter.capacity = 2
+
+        manifest.commit(manifest.save())
+
+        bloom_filter = BloomFilter.loads(self.bucket.get(
+            manifest.journal_filter_key).get_contents_as_string())
+        self.assertEqual(True, all(name in bloom_filter for name in
+                                   self.key_names))
+        self.assertEqual(manifest.journal_identity(), bloom_filter.identity)
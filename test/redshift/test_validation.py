@@ -0,0 +1,103 @@
+import json
+import shutil
+import tempfile
+import unittest
+from arbalest.core import PipelineException
+from arbalest.redshift.compaction import column_kind
+from arbalest.redshift.schema import JsonObject, Property
+from arbalest.redshift.validation import LocalValidator, ValidationError, \
+    check
+from arbalest.s3 import LocalBucket
+from test import BUCKET_NAME, TABLE_NAME
+
+
+class LocalValidatorShould(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.bucket = LocalBucket(self.directory, BUCKET_NAME)
+        self.schema = JsonObject(
+            TABLE_NAME, Property('id', 'VARCHAR(4)'),
+            Property('count', 'SMALLINT'),
+            Property('amount', 'DECIMAL(4,2)'),
+            Property('user', Property('created', 'TIMESTAMP')))
+        self.bucket.save('source/00.json', '\n'.join([
+            json.dumps({'id': 'a', 'count': 1, 'amount': 1.5,
+                        'user': {'created': '2015-01-01T00:00:00Z'}}),
+            json.dumps({'id': 'abcde', 'count': 1})]))
+        self.bucket.save('source/01.json', '\n\n'.join([
+            json.dumps({'id': 'b', 'count': 40000, 'amount': '123.4'}),
+            json.dumps({'user': {'created': 'yesterday'}}),
+            '{"id": ']))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def validator(self, **kwargs):
+        return LocalValidator(self.bucket, self.schema, processes=2,
+                              **kwargs)
+
+    def entries(self, names):
+        return [{'url': 's3://{0}/{1}'.format(BUCKET_NAME, name),
+                 'mandatory': True} for name in names]
+
+    def test_report_errors_per_file_and_line(self):
+        errors = list(self.validator(batch_files=1).errors(self.entries(
+            ['source/00.json', 'source/01.json'])))
+
+        self.assertEqual(
+            [('source/00.json', 2, 'id'), ('source/01.json', 1, 'count'),
+             ('source/01.json', 1, 'amount'),
+             ('source/01.json', 3, 'user_created'),
+             ('source/01.json', None, None)],
+            [(error.key, error.line, error.column) for error in errors])
+
+    def test_have_no_errors_for_valid_objects(self):
+        self.bucket.save('valid/00.json', json.dumps(
+            {'id': u'\xe9', 'count': '-3', 'amount': -10,
+             'user': {'created': 1420070400}}))
+
+        self.assertEqual([], list(self.validator().errors(self.entries(
+            ['valid/00.json']))))
+        self.validator().validate(self.entries(['valid/00.json']))
+
+    def test_skip_checks_for_unsupported_column_types(self):
+        self.schema = JsonObject(
+            TABLE_NAME, Property('id', 'VARCHAR(4)'),
+            Property('name', 'VARCHAR(4) ENCODE ZSTD'))
+        self.bucket.save('valid/00.json', json.dumps(
+            {'id': 'a', 'name': 'abcde'}))
+
+        self.assertEqual([], list(self.validator().errors(self.entries(
+            ['valid/00.json']))))
+
+    def test_throw_pipeline_exception_with_errors_on_validate(self):
+        try:
+            self.validator(max_errors=1).validate(self.entries(
+                ['source/00.json', 'source/01.json']))
+            self.fail('PipelineException not raised')
+        except PipelineException, e:
+            self.assertEqual(
+                'Invalid source objects (first 1 errors):\n'
+                'source/00.json:2: id: Length of 5 bytes exceeds 4', str(e))
+
+    def test_format_validation_error(self):
+        self.assertEqual('a.json:3: id: bad',
+                         str(ValidationError('a.json', 3, 'id', 'bad')))
+        self.assertEqual('a.json: bad',
+                         str(ValidationError('a.json', None, None, 'bad')))
+
+    def test_check_values_against_column_types(self):
+        self.assertEqual(None, check(column_kind('CHAR'), 'a'))
+        self.assertNotEqual(None, check(column_kind('CHAR'), 'ab'))
+        self.assertNotEqual(None, check(column_kind('INTEGER'), 2 ** 31))
+        self.assertEqual(None, check(column_kind('BIGINT'), 2 ** 31))
+        self.assertEqual(None, check(column_kind('DECIMAL(4,2)'), '99.994'))
+        self.assertNotEqual(None, check(column_kind('DECIMAL(4,2)'), 100))
+        self.assertNotEqual(None, check(column_kind('BOOLEAN'), 'maybe'))
+        self.assertEqual(None, check(column_kind('TIMESTAMP'),
+                                     '2015-01-01 00:00:00+01:00'))
+        self.assertNotEqual(None, check(column_kind('DATE'), '01/02/2015'))
+        self.assertEqual(None, check(column_kind('TIMESTAMP'),
+                                     '01/02/2015 10:00'))
+        self.assertNotEqual(None, check(column_kind('TIMESTAMP'), 'soon'))
+        self.assertEqual(None, check(column_kind('VARCHAR(MAX)'), 'a' * 300))
@@ -0,0 +1,118 @@
+import datetime
+import json
+import unittest
+from boto.s3.key import Key
+from mock import Mock
+from arbalest.redshift.manifest import Watermark, WATERMARK_TIME_FORMAT
+from arbalest.s3 import Bucket
+from test import BUCKET_NAME, AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY
+
+WATERMARK_KEY = '/event_created_watermark.json'
+
+
+def committed(days_ago):
+    return (datetime.datetime.utcnow() - datetime.timedelta(
+        days=days_ago)).strftime(WATERMARK_TIME_FORMAT)
+
+
+class WatermarkShould(unittest.TestCase):
+    def setUp(self):
+        self.bucket = Bucket(AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY,
+                             BUCKET_NAME, Mock())
+        self.bucket.bucket.get_key = Mock(side_effect=self.mock_head)
+        self.bucket.save = Mock()
+        self.marks = [
+            {'key': 'object_path/2015-01-01/0', 'committed': committed(3)},
+            {'key': 'object_path/2015-01-02/0', 'committed': committed(2)},
+            {'key': 'object_path/2015-01-03/0', 'committed': committed(1)}]
+
+    def mock_head(self, name):
+        key = self.bucket.get(name)
+        return key if key.exists() else None
+
+    def mock_watermark(self, exists, marks=None):
+        key = Key(Mock(), WATERMARK_KEY)
+        key.exists = Mock(return_value=exists)
+        if exists:
+            key.get_contents_as_string = Mock(
+                return_value=json.dumps({'marks': marks}))
+        self.bucket.get = Mock(return_value=key)
+
+    def saved_marks(self):
+        self.assertEqual(WATERMARK_KEY, self.bucket.save.call_args[0][0])
+        return json.loads(self.bucket.save.call_args[0][1])['marks']
+
+    def test_have_empty_marker_without_watermark(self):
+        self.mock_watermark(False)
+
+        self.assertEqual('', Watermark(self.bucket, WATERMARK_KEY).marker)
+
+    def test_have_marker_of_last_committed_key(self):
+        self.mock_watermark(True, self.marks)
+
+        self.assertEqual('object_path/2015-01-03/0',
+                         Watermark(self.bucket, WATERMARK_KEY).marker)
+
+    def test_have_marker_before_lookback(self):
+        self.mock_watermark(True, self.marks)
+        watermark = Watermark(self.bucket, WATERMARK_KEY,
+                              datetime.timedelta(hours=36))
+
+        self.assertEqual('object_path/2015-01-02/0', watermark.marker)
+
+    def test_have_empty_marker_when_lookback_exceeds_marks(self):
+        self.mock_watermark(True, self.marks)
+        watermark = Watermark(self.bucket, WATERMARK_KEY,
+                              datetime.timedelta(days=7))
+
+        self.assertEqual('', watermark.marker)
+
+    def test_commit_greatest_key(self):
+        self.mock_watermark(False)
+
+        Watermark(self.bucket, WATERMARK_KEY).commit(
+            ['object_path/b', 'object_path/c', 'object_path/a'])
+
+        self.assertEqual(['object_path/c'],
+                         [mark['key'] for mark in self.saved_marks()])
+
+    def test_not_move_marker_backwards(self):
+        self.mock_watermark(True, self.marks)
+
+        Watermark(self.bucket, WATERMARK_KEY).commit(
+            ['object_path/2014-12-31/0'])
+
+        self.assertEqual(['object_path/2015-01-03/0'],
+                         [mark['key'] for mark in self.saved_marks()])
+
+    def test_keep_marks_within_lookback(self):
+        self.mock_watermark(True, self.marks)
+
+        Watermark(self.bucket, WATERMARK_KEY,
+                  datetime.timedelta(hours=36)).commit(
+            ['object_path/2015-01-04/0'])
+
+        self.assertEqual(['object_path/2015-01-02/0',
+                          'object_path/2015-01-03/0',
+                          'object_path/2015-01-04/0'],
+                         [mark['key'] for mark in self.saved_marks()])
+
+    def test_have_marker_before_age(self):
+        self.mock_watermark(True, self.marks)
+
+        self.assertEqual('object_path/2015-01-01/0',
+                         Watermark(self.bucket, WATERMARK_KEY).marker_before(
+                             datetime.timedelta(hours=60)))
+
+    def test_keep_marks_within_retention(self):
+        self.mock_watermark(True, self.marks)
+
+        Watermark(self.bucket, WATERMARK_KEY,
+                  retention=datetime.timedelta(hours=60)).commit(
+            ['object_path/2015-01-04/0'])
+
+        self.assertEqual(['object_path/2015-01-01/0',
+                          'object_path/2015-01-02/0',
+                          'object_path/2015-01-03/0',
+                          'object_path/2015-01-04/0'],
+                         [mark['key'] for mark in self.saved_marks()])
@@ -0,0 +1,100 @@
+import threading
+import unittest
+from boto.exception import S3ResponseError
+from mock import Mock
+from arbalest.s3 import AsyncBucket, ListedKey
+
+
+class AsyncBucketShould(unittest.TestCase):
+    def setUp(self):
+        self.bucket = Mock()
+        self.bucket.limiter.request = Mock(
+            side_effect=lambda function, *args: function(*args))
+        self.async_bucket = AsyncBucket(self.bucket, processes=4)
+
+    def tearDown(self):
+        self.async_bucket.close()
+
+    def test_save_keys_concurrently(self):
+        started = []
+        barrier = threading.Event()
+
+        def save(key, contents):
+            started.append(key)
+            if len(started) == 4:
+                barrier.set()
+            barrier.wait(5)
+            return '"{0}"'.format(key)
+
+        self.bucket.save = Mock(side_effect=save)
+
+        results = [self.async_bucket.save(str(i), 'contents') for i in
+                   range(4)]
+
+        self.assertEqual(['"0"', '"1"', '"2"', '"3"'],
+                         [result.get(5) for result in results])
+        self.assertEqual(True, barrier.is_set())
+
+    def test_get_key_contents(self):
+        self.bucket.get.return_value.get_contents_as_string = Mock(
+            return_value='contents')
+
+        self.assertEqual('contents', self.async_bucket.get('key').get(5))
+        self.bucket.get.assert_called_once_with('key')
+
+    def test_delete_key(self):
+        self.async_bucket.delete('key').get(5)
+
+        self.bucket.delete.assert_called_once_with('key')
+
+    def test_have_key_existence(self):
+        self.bucket.exists = Mock(return_value=True)
+
+        self.assertEqual(True, self.async_bucket.exists('key').get(5))
+
+    def test_raise_errors_from_results(self):
+        self.bucket.delete = Mock(side_effect=S3ResponseError(403,
+                                                              'Forbidden'))
+
+        self.assertRaises(S3ResponseError,
+                          self.async_bucket.delete('key').get, 5)
+
+    def test_bound_pending_operations(self):
+        async_bucket = AsyncBucket(self.bucket, processes=2, max_pending=2)
+        self.bucket.delete = Mock(side_effect=S3ResponseError(403,
+                                                              'Forbidden'))
+
+        results = [async_bucket.delete(str(i)) for i in range(10)]
+        async_bucket.close()
+
+        self.assertEqual(10, self.bucket.delete.call_count)
+        self.assertEqual(False, any(result.successful() for result in
+                                    results))
+
+    def test_stream_listed_keys(self):
+        keys = [ListedKey('object_path/{0}'.format(i), i, None, None) for i
+                in range(10)]
+        self.bucket.list_keys = Mock(return_value=iter(keys))
+
+        self.assertEqual(keys, list(self.async_bucket.list(
+            'object_path/', prefetch=2)))
+        self.bucket.list_keys.assert_called_once_with('object_path/', '')
+
+    def test_stop_listing_when_consumer_stops(self):
+        self.bucket.list_keys = Mock(return_value=(
+            ListedKey(str(i), i, None, None) for i in range(100)))
+
+        listing = self.async_bucket.list(prefetch=1)
+        self.assertEqual('0', next(listing).name)
+        listing.close()
+
+    def test_raise_listing_errors(self):
+        def list_keys(prefix, marker):
+            yield ListedKey('a', 1, None, None)
+            raise S3ResponseError(500, 'Internal Error')
+
+        self.bucket.list_keys = Mock(side_effect=list_keys)
+
+        listing = self.async_bucket.list()
+        self.assertEqual('a', next(listing).name)
+        self.assertRaises(S3ResponseError, next, listing)
@@ -1,7 +1,12 @@
+import tempfile
 import unittest
+import urlparse
+from StringIO import StringIO
+from boto.exception import S3ResponseError
 from boto.s3.key import Key
+from boto.s3.prefix import Prefix
 from mock import Mock, patch
-from arbalest.s3 import Bucket
+from arbalest.s3 import Bucket, ListedKey, LIST_NAMESPACE
 from test import AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, BUCKET_NAME
 
 
@@ -18,6 +23,68 @@ class BucketShould(unittest.TestCase):
 
             set_contents_from_string.assert_called_once_with(contents)
 
+    def test_save_key_as_file(self):
+        with patch.object(Key,
+                          'set_contents_from_file') as \
+                set_contents_from_file:
+            connection = Mock()
+            key = Key()
+            contents = StringIO('contents')
+            Bucket(AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, BUCKET_NAME,
+                   connection).save(key, contents)
+
+            set_contents_from_file.assert_called_once_with(contents,
+                                                           rewind=True)
+
+    def test_upload_small_file_in_one_request(self):
+        with patch.object(Key, 'set_contents_from_filename') as \
+                set_contents_from_filename:
+            with tempfile.NamedTemporaryFile() as f:
+                f.write('contents')
+                f.flush()
+                Bucket(AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, BUCKET_NAME,
+                       Mock()).upload('key', f.name)
+
+                set_contents_from_filename.assert_called_once_with(f.name)
+
+    def test_upload_large_file_in_parallel_parts(self):
+        connection = Mock()
+        multipart_upload = connection.get_bucket.return_value. \
+            initiate_multipart_upload.return_value
+        uploaded = {}
+
+        def upload_part_from_file(f, part_num, size):
+            uploaded[part_num] = f.read(size)
+
+        multipart_upload.upload_part_from_file = Mock(
+            side_effect=upload_part_from_file)
+        with tempfile.NamedTemporaryFile() as f:
+            f.write('0123456789')
+            f.flush()
+            Bucket(AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, BUCKET_NAME,
+                   connection).upload('key', f.name, part_size=4)
+
+        self.assertEqual({1: '0123', 2: '4567', 3: '89'}, uploaded)
+        multipart_upload.complete_upload.assert_called_once_with()
+
+    def test_cancel_upload_when_part_fails(self):
+        connection = Mock()
+        multipart_upload = connection.get_bucket.return_value. \
+            initiate_multipart_upload.return_value
+        multipart_upload.upload_part_from_file = Mock(
+            side_effect=IOError())
+        with tempfile.NamedTemporaryFile() as f:
+            f.write('0123456789')
+            f.flush()
+            self.assertRaises(IOError, Bucket(AWS_ACCESS_KEY_ID,
+                                              AWS_SECRET_ACCESS_KEY,
+                                              BUCKET_NAME,
+                                              connection).upload,
+                              'key', f.name, 4)
+
+        multipart_upload.cancel_upload.assert_called_once_with()
+        self.assertEqual(False, multipart_upload.complete_upload.called)
+
     def test_delete_key(self):
         with patch.object(Key, 'delete') as delete:
             connection = Mock()
@@ -27,6 +94,50 @@ class BucketShould(unittest.TestCase):
 
             delete.assert_called_once()
 
+    def test_delete_many_keys_in_batches(self):
+        connection = Mock()
+        delete_keys = connection.get_bucket.return_value.delete_keys
+        delete_keys.return_value.errors = []
+        keys = ['key-{0}'.format(i) for i in range(2500)]
+
+        errors = Bucket(AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, BUCKET_NAME,
+                        connection).delete_many(iter(keys))
+
+        self.assertEqual([], errors)
+        self.assertEqual([keys[0:1000], keys[1000:2000], keys[2000:]],
+                         [c[0][0] for c in delete_keys.call_args_list])
+        self.assertEqual(True, all(c[1] == {'quiet': True} for c in
+                                   delete_keys.call_args_list))
+
+    def test_delete_many_key_objects(self):
+        connection = Mock()
+        delete_keys = connection.get_bucket.return_value.delete_keys
+        delete_keys.return_value.errors = []
+
+        Bucket(AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, BUCKET_NAME,
+               connection).delete_many([Key(name='a'), 'b'])
+
+        self.assertEqual(['a', 'b'], delete_keys.call_args[0][0])
+
+    def test_report_keys_that_failed_to_delete(self):
+        connection = Mock()
+        error = Mock(key='b', code='AccessDenied')
+        connection.get_bucket.return_value.delete_keys.return_value.errors = [
+            error]
+
+        self.assertEqual([error], Bucket(
+            AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, BUCKET_NAME,
+            connection).delete_many(['a', 'b']))
+
+    def test_not_delete_without_keys(self):
+        connection = Mock()
+
+        Bucket(AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, BUCKET_NAME,
+               connection).delete_many([])
+
+        self.assertEqual(False,
+                         connection.get_bucket.return_value.delete_keys.called)
+
     def test_get_key(self):
         self.assertNotEqual(None,
                             Bucket(AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY,
@@ -40,3 +151,109 @@ class BucketShould(unittest.TestCase):
         Bucket(AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, BUCKET_NAME,
                    connection).list('/')
         bucket.list.assert_called_once_with('/', '', '', None, None)
+
+
+class BucketListShould(unittest.TestCase):
+    def setUp(self):
+        self.names = sorted(['a/{0}/{1:03d}'.format(c, i) for c in 'xyz' for
+                             i in range(50)] + ['a/w', 'a/x0'])
+        self.connection = Mock()
+        self.connection.get_bucket.return_value.list = Mock(
+            side_effect=self.list)
+        self.connection.make_request = Mock(side_effect=self.make_request)
+        self.bucket = Bucket(AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY,
+                             BUCKET_NAME, self.connection)
+
+    def list(self, prefix='', delimiter='', marker='', headers=None,
+             encoding_type=None):
+        items = []
+        for name in self.names:
+            if not name.startswith(prefix) or name <= marker:
+                continue
+            rest = name[len(prefix):]
+            if delimiter and delimiter in rest:
+                common_prefix = prefix + rest[:rest.index(delimiter) + 1]
+                if not items or items[-1].name != common_prefix:
+                    items.append(Prefix(name=common_prefix))
+            else:
+                items.append(Key(name=name))
+        pages = [items[i:i + 3] for i in range(0, len(items), 3)]
+        return (item for page in pages for item in sorted(
+            page, key=lambda item: isinstance(item, Prefix)))
+
+    def make_request(self, method, bucket, query_args):
+        query = dict(urlparse.parse_qsl(query_args, keep_blank_values=True))
+        names = [name for name in self.names if
+                 name.startswith(query['prefix']) and name > query['marker']]
+        page_size = int(query.get('max-keys', 10))
+        contents = ''.join(
+            '<Contents><Key>{0}</Key><LastModified>2015-01-01T00:00:00.000Z'
+            '</LastModified><ETag>&quot;{1}&quot;</ETag><Size>{1}</Size>'
+            '<StorageClass>STANDARD</StorageClass></Contents>'.format(
+                name, len(name)) for name in names[:page_size])
+        response = StringIO(
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<ListBucketResult xmlns="{0}"><Name>{1}</Name>'
+            '<IsTruncated>{2}</IsTruncated>{3}</ListBucketResult>'.format(
+                LIST_NAMESPACE[1:-1], bucket,
+                'true' if len(names) > page_size else 'false', contents))
+        response.status = 200
+        return response
+
+    def names_of(self, keys):
+        return [key.name for key in keys]
+
+    def test_list_keys_across_pages(self):
+        keys = list(self.bucket.list_keys('a/x'))
+
+        self.assertEqual([name for name in self.names if
+                          name.startswith('a/x')], self.names_of(keys))
+        self.assertEqual(6, self.connection.make_request.call_count)
+
+    def test_list_keys_as_tuples(self):
+        self.assertEqual(
+            [ListedKey('a/w', 3, '"3"', '2015-01-01T00:00:00.000Z')],
+            list(self.bucket.list_keys('a/w')))
+
+    def test_list_keys_after_marker(self):
+        self.assertEqual(self.names[11:], self.names_of(
+            self.bucket.list_keys('a/', self.names[10], page_size=100)))
+
+    def test_throw_s3_response_error_on_failed_listing(self):
+        response = StringIO('<Error/>')
+        response.status = 403
+        response.reason = 'Forbidden'
+        self.connection.make_request = Mock(return_value=response)
+
+        self.assertRaises(S3ResponseError, list, self.bucket.list_keys('a/'))
+
+    def test_list_in_sorted_order_by_sub_prefix(self):
+        self.assertEqual(self.names, self.names_of(
+            self.bucket.list_parallel('a/', processes=2)))
+
+    def test_list_in_sorted_order_by_key_ranges(self):
+        self.assertEqual(self.names, self.names_of(
+            self.bucket.list_parallel('a/', boundaries=['x/020', 'y', 'y/'],
+                                      processes=2)))
+
+    def test_list_after_marker(self):
+        self.assertEqual(self.names[70:], self.names_of(
+            self.bucket.list_parallel('a/', marker=self.names[69],
+                                      processes=3)))
+        self.assertEqual(self.names[70:], self.names_of(
+            self.bucket.list_parallel('a/', marker=self.names[69],
+                                      boundaries=['x', 'y', 'z'],
+                                      processes=3)))
+
+    def test_include_range_boundary_once(self):
+        names = self.names_of(self.bucket.list_parallel(
+            'a/', boundaries=['x/010', 'w'], processes=2))
+
+        self.assertEqual(self.names, names)
+
+    def test_list_prefixes_in_order(self):
+        self.assertEqual(
+            [[name for name in self.names if name.startswith(prefix)] for
+             prefix in ('a/z/', 'a/x/')],
+            [self.names_of(keys) for keys in self.bucket.list_prefixes(
+                ['a/z/', 'a/x/'], '/', processes=2)])
@@ -0,0 +1,93 @@
+import unittest
+from boto.exception import S3ResponseError
+from mock import Mock, patch
+from arbalest.s3 import ConcurrencyLimiter, connect, RETRY_ATTEMPTS
+
+
+def slow_down():
+    return S3ResponseError(
+        503, 'Slow Down', '<Error><Code>SlowDown</Code></Error>')
+
+
+class ConcurrencyLimiterShould(unittest.TestCase):
+    def setUp(self):
+        self.limiter = ConcurrencyLimiter(maximum=8, minimum=2)
+
+    def test_halve_limit_when_throttled(self):
+        self.limiter.acquire()
+        self.limiter.release(throttled=True)
+        self.limiter.acquire()
+        self.limiter.release(throttled=True)
+        self.limiter.acquire()
+        self.limiter.release(throttled=True)
+
+        self.assertEqual(2, self.limiter.limit)
+
+    def test_grow_limit_after_successes(self):
+        self.limiter.limit = 2
+        for _ in range(2):
+            self.limiter.acquire()
+            self.limiter.release()
+
+        self.assertEqual(3, self.limiter.limit)
+
+    def test_not_grow_limit_beyond_maximum(self):
+        for _ in range(100):
+            self.limiter.acquire()
+            self.limiter.release()
+
+        self.assertEqual(8, self.limiter.limit)
+
+    def test_retry_throttled_requests_with_backoff(self):
+        function = Mock(side_effect=[slow_down(), slow_down(), 'result'])
+
+        with patch('time.sleep') as sleep:
+            self.assertEqual('result', self.limiter.request(function, 'a',
+                                                            b='b'))
+
+        self.assertEqual(2, sleep.call_count)
+        function.assert_called_with('a', b='b')
+        self.assertEqual(0, self.limiter.active)
+
+    def test_throw_when_retries_are_exhausted(self):
+        function = Mock(side_effect=slow_down())
+
+        with patch('time.sleep'):
+            self.assertRaises(S3ResponseError, self.limiter.request, function)
+
+        self.assertEqual(RETRY_ATTEMPTS + 1, function.call_count)
+
+    def test_not_retry_other_errors(self):
+        function = Mock(side_effect=S3ResponseError(403, 'Forbidden'))
+
+        self.assertRaises(S3ResponseError, self.limiter.request, function)
+        self.assertEqual(1, function.call_count)
+        self.assertEqual(8, self.limiter.limit)
+        self.assertEqual(0, self.limiter.active)
+
+
+class ConnectShould(unittest.TestCase):
+    def test_share_connection_for_same_credentials(self):
+        with patch('arbalest.s3.S3Connection') as s3_connection:
+            s3_connection.side_effect = lambda *args, **kwargs: Mock()
+            first = connect('shared_id', 'secret')
+            second = connect('shared_id', 'secret')
+            other = connect('other_id', 'secret')
+
+        self.assertEqual(first, second)
+        self.assertNotEqual(first[0], other[0])
+        self.assertEqual(2, s3_connection.call_count)
+
+    def test_connect_to_host_with_own_connection_limit(self):
+        with patch('arbalest.s3.S3Connection') as s3_connection:
+            s3_connection.side_effect = lambda *args, **kwargs: Mock()
+            default = connect('host_id', 'secret')
+            limited = connect('host_id', 'secret', max_connections=4)
+            hosted = connect('host_id', 'secret', 's3.example.com')
+
+        self.assertEqual(default[0], limited[0])
+        self.assertNotEqual(default[1], limited[1])
+        self.assertEqual(4, limited[1].maximum)
+        self.assertNotEqual(default[0], hosted[0])
+        self.assertEqual('s3.example.com',
+                         s3_connection.call_args[1]['host'])
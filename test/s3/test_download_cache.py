@@ -0,0 +1,91 @@
+import os
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+from mock import Mock
+from arbalest.s3 import DownloadCache
+from test import BUCKET_NAME
+
+
+class DownloadCacheShould(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = DownloadCache(self.directory, size=1024)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def mock_key(self, name, etag, contents):
+        key = Mock()
+        key.name = name
+        key.etag = etag
+        key.bucket.name = BUCKET_NAME
+        key.bucket.get_key = Mock(return_value=key)
+        key.get_contents_to_file = Mock(
+            side_effect=lambda f: f.write(contents))
+        return key
+
+    def cached_files(self):
+        return sorted(os.listdir(self.directory))
+
+    def test_download_key(self):
+        key = self.mock_key('journal', '"etag"', 'contents')
+
+        with self.cache.fetch(key) as f:
+            self.assertEqual('contents', f.read())
+        self.assertEqual(1, len(self.cached_files()))
+
+    def test_not_download_current_key(self):
+        key = self.mock_key('journal', '"etag"', 'contents')
+        self.cache.fetch(key).close()
+
+        with self.cache.fetch(key) as f:
+            self.assertEqual('contents', f.read())
+        self.assertEqual(1, key.get_contents_to_file.call_count)
+        key.bucket.get_key.assert_called_with('journal')
+
+    def test_download_changed_key(self):
+        self.cache.fetch(self.mock_key('journal', '"a"', 'a')).close()
+
+        with self.cache.fetch(self.mock_key('journal', '"b"', 'b')) as f:
+            self.assertEqual('b', f.read())
+
+    def test_not_head_key_with_known_etag(self):
+        key = self.mock_key('segment', '"etag"', 'contents')
+        self.cache.fetch(key, key.etag).close()
+
+        self.assertEqual(False, key.bucket.get_key.called)
+
+    def test_not_fetch_missing_key(self):
+        key = self.mock_key('journal', '"etag"', 'contents')
+        key.bucket.get_key = Mock(return_value=None)
+
+        self.assertEqual(None, self.cache.fetch(key))
+        self.assertEqual([], self.cached_files())
+
+    def test_put_uploaded_contents(self):
+        self.cache.put(BUCKET_NAME, 'journal', '"etag"', StringIO('contents'))
+        key = self.mock_key('journal', '"etag"', 'other')
+
+        with self.cache.fetch(key) as f:
+            self.assertEqual('contents', f.read())
+        self.assertEqual(False, key.get_contents_to_file.called)
+
+    def test_not_leave_partial_downloads(self):
+        key = self.mock_key('journal', '"etag"', 'contents')
+        key.get_contents_to_file = Mock(side_effect=IOError)
+
+        self.assertRaises(IOError, self.cache.fetch, key)
+        self.assertEqual([], self.cached_files())
+
+    def test_evict_least_recently_used_files(self):
+        for i in range(3):
+            self.cache.put(BUCKET_NAME, str(i), '"etag"', StringIO('x' * 400))
+            path = self.cache.path(BUCKET_NAME, str(i), '"etag"')
+            os.utime(path, (i, i))
+        self.cache.evict()
+
+        self.assertEqual(sorted([os.path.basename(self.cache.path(
+            BUCKET_NAME, str(i), '"etag"')) for i in (1, 2)]),
+            self.cached_files())
@@ -0,0 +1,124 @@
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+from boto.exception import S3ResponseError
+from boto.s3.prefix import Prefix
+from mock import patch
+from arbalest.s3 import DownloadCache, ListedKey, LocalBucket
+
+
+class LocalBucketShould(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.bucket = LocalBucket(self.directory, 'bucket')
+        self.key_names = ['/event_created_manifest.json',
+                          'a', 'a-b', 'a/', 'a/b/c', 'a/b/d', 'a/c', 'a0',
+                          '.', 'b/../c', u'b/\xe9']
+        for name in self.key_names:
+            self.bucket.save(name, name.encode('utf-8'))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def names(self, keys):
+        return [key.name for key in keys]
+
+    def test_list_keys_in_order(self):
+        self.assertEqual(sorted(self.key_names),
+                         self.names(self.bucket.list()))
+        self.assertEqual(sorted(self.key_names),
+                         self.names(self.bucket.list_keys()))
+
+    def test_list_keys_with_prefix_and_marker(self):
+        self.assertEqual(['a/', 'a/b/c', 'a/b/d', 'a/c'],
+                         self.names(self.bucket.list_keys('a/')))
+        self.assertEqual(['a/b/d', 'a/c'],
+                         self.names(self.bucket.list_keys('a/', 'a/b/c')))
+        self.assertEqual(['a/c', 'a0'],
+                         self.names(self.bucket.list('a', marker='a/b/d')))
+
+    def test_list_common_prefixes(self):
+        listing = list(self.bucket.list('a/', '/'))
+
+        self.assertEqual(['a/', 'a/b/', 'a/c'], self.names(listing))
+        self.assertEqual(True, isinstance(listing[1], Prefix))
+
+    def test_list_key_metadata(self):
+        key = next(self.bucket.list_keys('a/b/c'))
+
+        self.assertEqual(True, isinstance(key, ListedKey))
+        self.assertEqual(5, key.size)
+        self.assertEqual(key.etag, self.bucket.etag('a/b/c'))
+
+    def test_list_in_parallel(self):
+        self.assertEqual(sorted(self.key_names),
+                         self.names(self.bucket.list_parallel(processes=2)))
+
+    def test_get_saved_contents(self):
+        self.assertEqual('a/b/c',
+                         self.bucket.get('a/b/c').get_contents_as_string())
+        self.assertEqual(u'b/\xe9'.encode('utf-8'),
+                         self.bucket.get(u'b/\xe9').read())
+
+    def test_have_key_existence(self):
+        self.assertEqual(True, self.bucket.exists('a'))
+        self.assertEqual(True, self.bucket.get('a/b/c').exists())
+        self.assertEqual(False, self.bucket.exists('a/b'))
+        self.assertEqual(None, self.bucket.head('missing'))
+
+    def test_raise_not_found_for_missing_keys(self):
+        self.assertRaises(S3ResponseError,
+                          self.bucket.get('missing').get_contents_as_string)
+
+    def test_delete_keys(self):
+        self.bucket.delete('a/b/c')
+        self.assertEqual([], self.bucket.delete_many(['a/b/d', 'a/c']))
+
+        self.assertEqual(['a/'], self.names(self.bucket.list_keys('a/')))
+
+    def test_upload_multipart_files(self):
+        with tempfile.NamedTemporaryFile() as f:
+            f.write('0123456789' * 3)
+            f.flush()
+            etag = self.bucket.upload('upload', f.name, part_size=10)
+
+        self.assertEqual('0123456789' * 3,
+                         self.bucket.get('upload').get_contents_as_string())
+        self.assertEqual(self.bucket.etag('upload'), etag)
+
+    def test_stream_multipart_writes(self):
+        with self.bucket.writer('written', part_size=10) as writer:
+            for _ in range(3):
+                writer.write('0123456789')
+
+        self.assertEqual('0123456789' * 3,
+                         self.bucket.get('written').get_contents_as_string())
+
+    def test_be_usable_with_download_cache(self):
+        cache = DownloadCache(tempfile.mkdtemp())
+        try:
+            with cache.fetch(self.bucket.get('a/b/c')) as f:
+                self.assertEqual('a/b/c', f.read())
+        finally:
+            shutil.rmtree(cache.directory)
+
+    def test_inject_latency_per_request_and_page(self):
+        bucket = LocalBucket(self.directory, latency=0.01, page_size=4)
+
+        with patch('time.sleep') as sleep:
+            list(bucket.list_keys())
+            bucket.exists('a')
+            bucket.save('b', StringIO('b'))
+
+        self.assertEqual(5, sleep.call_count)
+        self.assertEqual(True, all(c[0][0] == 0.01 for c in
+                                   sleep.call_args_list))
+
+    def test_inject_latency_per_page_of_boto_listing(self):
+        bucket = LocalBucket(self.directory, latency=0.01, page_size=4)
+
+        with patch('time.sleep') as sleep:
+            list(bucket.list())
+
+        self.assertEqual(3, sleep.call_count)
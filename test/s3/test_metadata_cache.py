@@ -0,0 +1,99 @@
+import datetime
+import unittest
+from boto.s3.key import Key
+from mock import Mock, patch
+from arbalest.s3 import Bucket, ListedKey, MetadataCache
+from test import AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, BUCKET_NAME
+
+
+class MetadataCacheShould(unittest.TestCase):
+    def setUp(self):
+        self.connection = Mock()
+        self.get_key = self.connection.get_bucket.return_value.get_key
+        self.get_key.side_effect = self.mock_head
+        self.cache = MetadataCache()
+        self.bucket = Bucket(AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY,
+                             BUCKET_NAME, self.connection,
+                             metadata_cache=self.cache)
+        self.keys = {'journal': ListedKey('journal', 10, '"etag"', None)}
+
+    def mock_head(self, name):
+        if name not in self.keys:
+            return None
+        key = Mock()
+        key.name, key.size, key.etag, key.last_modified = self.keys[name]
+        return key
+
+    def test_have_key_metadata(self):
+        self.assertEqual(True, self.bucket.exists('journal'))
+        self.assertEqual(10, self.bucket.size('journal'))
+        self.assertEqual('"etag"', self.bucket.etag('journal'))
+        self.assertEqual(1, self.get_key.call_count)
+
+    def test_remember_missing_keys(self):
+        self.assertEqual(False, self.bucket.exists('manifest'))
+        self.assertEqual(None, self.bucket.etag('manifest'))
+        self.assertEqual(1, self.get_key.call_count)
+
+    def test_head_keys_without_cache(self):
+        bucket = Bucket(AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY,
+                        BUCKET_NAME, self.connection)
+
+        bucket.exists('journal')
+        bucket.exists('journal')
+
+        self.assertEqual(2, self.get_key.call_count)
+
+    def test_expire_entries_after_ttl(self):
+        self.cache.ttl = datetime.timedelta(seconds=60)
+        with patch('time.time', Mock(return_value=1000)):
+            self.bucket.exists('journal')
+        with patch('time.time', Mock(return_value=1059)):
+            self.bucket.exists('journal')
+        self.assertEqual(1, self.get_key.call_count)
+
+        with patch('time.time', Mock(return_value=1060)):
+            self.bucket.exists('journal')
+        self.assertEqual(2, self.get_key.call_count)
+
+    def test_expire_entries_after_ttl_of_days(self):
+        self.cache.ttl = datetime.timedelta(days=1, microseconds=500000)
+        with patch('time.time', Mock(return_value=1000)):
+            self.bucket.exists('journal')
+        with patch('time.time', Mock(return_value=87400)):
+            self.bucket.exists('journal')
+        self.assertEqual(1, self.get_key.call_count)
+
+        with patch('time.time', Mock(return_value=87400.5)):
+            self.bucket.exists('journal')
+        self.assertEqual(2, self.get_key.call_count)
+
+    def test_invalidate_saved_keys(self):
+        self.assertEqual(False, self.bucket.exists('manifest'))
+        with patch.object(Key, 'set_contents_from_string'):
+            self.bucket.save('manifest', 'contents')
+        self.keys['manifest'] = ListedKey('manifest', 8, '"etag"', None)
+
+        self.assertEqual(True, self.bucket.exists('manifest'))
+
+    def test_invalidate_deleted_keys(self):
+        self.assertEqual(True, self.bucket.exists('journal'))
+        with patch.object(Key, 'delete'):
+            self.bucket.delete('journal')
+        del self.keys['journal']
+
+        self.assertEqual(False, self.bucket.exists('journal'))
+
+    def test_invalidate_keys_deleted_in_batches(self):
+        self.connection.get_bucket.return_value.delete_keys.return_value \
+            .errors = []
+        self.assertEqual(True, self.bucket.exists('journal'))
+        self.bucket.delete_many(['journal'])
+        del self.keys['journal']
+
+        self.assertEqual(False, self.bucket.exists('journal'))
+
+    def test_not_share_entries_between_buckets(self):
+        self.cache.put('other', 'journal', None)
+
+        self.assertEqual(True, self.bucket.exists('journal'))
@@ -0,0 +1,76 @@
+import unittest
+from mock import Mock
+from arbalest.s3 import Bucket, MetadataCache, MultipartWriter
+from test import AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, BUCKET_NAME
+
+
+class MultipartWriterShould(unittest.TestCase):
+    def setUp(self):
+        self.connection = Mock()
+        self.bucket = Bucket(AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY,
+                             BUCKET_NAME, self.connection)
+        self.bucket.save = Mock(return_value='"etag"')
+        self.multipart_upload = Mock()
+        self.multipart_upload.complete_upload.return_value.etag = '"parts"'
+        self.parts = {}
+        self.multipart_upload.upload_part_from_file = Mock(
+            side_effect=lambda f, part_num, size: self.parts.update(
+                {part_num: f.read(size)}))
+        self.bucket.bucket.initiate_multipart_upload = Mock(
+            return_value=self.multipart_upload)
+
+    def test_save_small_contents_in_one_request(self):
+        with self.bucket.writer('manifest', part_size=10) as writer:
+            writer.write('{')
+            writer.write(u'}')
+
+        self.bucket.save.assert_called_once_with('manifest', '{}')
+        self.assertEqual('"etag"', writer.etag)
+        self.assertEqual(False,
+                         self.bucket.bucket.initiate_multipart_upload.called)
+
+    def test_upload_parts_while_writing(self):
+        writer = MultipartWriter(self.bucket, 'manifest', part_size=10,
+                                 processes=2)
+        for i in range(25):
+            writer.write(str(i % 10))
+
+        self.assertEqual('"parts"', writer.close())
+        self.bucket.bucket.initiate_multipart_upload.assert_called_once_with(
+            'manifest')
+        self.assertEqual({1: '0123456789', 2: '0123456789', 3: '01234'},
+                         self.parts)
+        self.assertEqual(1, self.multipart_upload.complete_upload.call_count)
+        self.assertEqual(False, self.bucket.save.called)
+
+    def test_cancel_upload_when_writing_fails(self):
+        def write():
+            with self.bucket.writer('manifest', part_size=10) as writer:
+                writer.write('0123456789')
+                raise ValueError()
+
+        self.assertRaises(ValueError, write)
+        self.multipart_upload.cancel_upload.assert_called_once_with()
+        self.assertEqual(False, self.multipart_upload.complete_upload.called)
+
+    def test_cancel_upload_when_part_fails(self):
+        self.multipart_upload.upload_part_from_file = Mock(
+            side_effect=IOError())
+
+        def write():
+            with self.bucket.writer('manifest', part_size=10) as writer:
+                writer.write('0123456789')
+                writer.write('0123456789')
+
+        self.assertRaises(IOError, write)
+        self.multipart_upload.cancel_upload.assert_called_once_with()
+
+    def test_invalidate_uploaded_key(self):
+        self.bucket.metadata_cache = MetadataCache()
+        self.bucket.metadata_cache.put(BUCKET_NAME, 'manifest', None)
+
+        with self.bucket.writer('manifest', part_size=10) as writer:
+            writer.write('0123456789')
+
+        self.assertRaises(KeyError, self.bucket.metadata_cache.get,
+                          BUCKET_NAME, 'manifest')